@@ -1,2 +1,5 @@
 from aceclient import *
 from acemessages import *
+from acepool import *
+from contentcache import *
+from enginescheduler import *
@@ -1,8 +1,13 @@
 import gevent
 from gevent.event import AsyncResult
 from gevent.event import Event
-import telnetlib
 import logging
+import itertools
+import json
+import time
+from collections import deque
+import streamer
+import telemetry
 from acemessages import *
 
 
@@ -16,9 +21,12 @@ class AceException(Exception):
 
 class AceClient(object):
 
+    # LOADASYNC request ids
+    _requestid = itertools.count(1)
+    # STATUS messages kept in the history (engine sends one per second)
+    STATUSHISTORY = 60
+
     def __init__(self, host, port, connect_timeout=5, result_timeout=10, debug=logging.ERROR):
-        # Receive buffer
-        self._recvbuffer = None
         # Stream URL
         self._url = None
         # Ace stream socket
@@ -46,15 +54,27 @@ class AceClient(object):
         self._urlresult = AsyncResult()
         # Event for resuming from PAUSE
         self._resumeevent = Event()
-        #PID video info
-        self._pidinfo = None
+        # Download speed from STATUS (in KiB/s)
+        self._speeddown = 0
+        # Recent STATUS records, the last one is current
+        self._statushistory = deque(maxlen=AceClient.STATUSHISTORY)
+        # LOADASYNC results by request id
+        self._loadresults = dict()
+        # How long keygen request took during authentication
+        self._keygentime = None
+        # Session setup stages: list of (stage, duration). Pooled sessions
+        # are set up outside of the request trace.
+        self.setuptimes = list()
 
         # Logger
         logger = logging.getLogger('AceClient_init')
 
         try:
-            self._socket = telnetlib.Telnet(host, port, connect_timeout)
+            connectstart = time.time()
+            self._socket = streamer.LineReader(host, port, connect_timeout)
             logger.info("Successfully connected with Ace!")
+            self.setuptimes.append(('ace_connect', time.time() - connectstart))
+            telemetry.mark('ace_connect')
         except Exception as e:
             raise AceException(
                 "Socket creation error! Ace is not running? " + repr(e))
@@ -110,6 +130,7 @@ class AceClient(object):
         logger = logging.getLogger("AceClient_aceInit")
 
         # Sending HELLO
+        authstart = time.time()
         self._write(AceMessage.request.HELLO)
         if not self._authevent.wait(self._resulttimeout):
             errmsg = "Authentication timeout. Wrong key?"
@@ -123,6 +144,11 @@ class AceClient(object):
             raise AceException(errmsg)
             return
 
+        self.setuptimes.append(('ace_auth', time.time() - authstart))
+        telemetry.mark('ace_auth')
+        if self._keygentime is not None:
+            self.setuptimes.append(('ace_keygen', self._keygentime))
+            telemetry.record('ace_keygen', self._keygentime)
         logger.debug("aceInit ended")
 
     def START(self, datatype, value):
@@ -148,38 +174,74 @@ class AceClient(object):
             logger.error(errmsg)
             raise AceException(errmsg)
 
-    def LOADASYNC(self, zreqtype, vpid):
+    def STOP(self):
         '''
-        Get video info
+        Stop video method. Session stays authenticated and can be
+        STARTed again.
         '''
-        
+
+        # Logger
+        logger = logging.getLogger("AceClient_STOP")
+
+        self._write(AceMessage.request.STOP)
+        # Reset session state
+        self._resumeevent.clear()
+        self._result = AsyncResult()
+        self._urlresult = AsyncResult()
+        self._url = None
+        self._status = None
+        self._state = None
+        self._speeddown = 0
+        self._statushistory.clear()
+        logger.debug("Session stopped")
+
+    def isAlive(self):
+        '''
+        Connection with engine is alive and authenticated
+        '''
+        return bool(self._auth) and not self._shuttingDown.isSet()
+
+    def LOADASYNC(self, datatype, value):
+        '''
+        Get video info. Returns LOADRESP dict.
+        '''
+
         # Logger
         logger = logging.getLogger("AceClient_LOADASYNC")
-		
-        if zreqtype == 'pid':
-            tmess = AceMessage.request.LOADASYNC('PID', '123456', {'content_id': vpid})
-        elif zreqtype == 'torrent':
-            tmess = AceMessage.request.LOADASYNC('TORRENT', '123456', {'url': vpid})
-		
-        self._write(tmess) 
-        logger.debug('mess = ' + tmess)
 
+        requestid = str(next(AceClient._requestid))
+        if datatype == 'pid':
+            tmess = AceMessage.request.LOADASYNC('PID', requestid, {'content_id': value})
+        elif datatype == 'torrent':
+            tmess = AceMessage.request.LOADASYNC('TORRENT', requestid, {'url': value})
+        else:
+            raise AceException("LOADASYNC: unknown type " + datatype)
+
+        # Every request gets its own result
+        result = AsyncResult()
+        self._loadresults[requestid] = result
         try:
-            if not self._result.get(timeout=self._resulttimeout):
-                errmsg = "LOADASYNC error!"
-                logger.error(errmsg)
-                raise AceException(errmsg)
+            self._write(tmess)
+            logger.debug('mess = ' + tmess)
+            return result.get(timeout=self._resulttimeout)
         except gevent.Timeout:
             errmsg = "LOADASYNC timeout!"
             logger.error(errmsg)
             raise AceException(errmsg)
-			
-    def getLOADRESP(self):
+        finally:
+            self._loadresults.pop(requestid, None)
+
+    @staticmethod
+    def contentName(loadresp):
         '''
-        Get LOADRESP string
+        Get (quoted) content name from LOADRESP dict
         '''
-        return self._pidinfo
-        
+        try:
+            return loadresp['files'][0][0]
+        except (KeyError, IndexError, TypeError):
+            return None
+
+
     def getUrl(self, timeout=40):
         # Logger
         logger = logging.getLogger("AceClient_getURL")
@@ -192,6 +254,41 @@ class AceClient(object):
             logger.error(errmsg)
             raise AceException(errmsg)
 
+    def getSpeedDown(self):
+        '''
+        Current download speed reported by engine
+        '''
+        return self._speeddown
+
+    def getStatus(self):
+        '''
+        Last STATUS record or None
+        '''
+        return self._statushistory[-1] if self._statushistory else None
+
+    def statusStats(self, history=False):
+        '''
+        Last STATUS with averages over the history, None if there was no
+        STATUS in this session yet
+        '''
+        records = list(self._statushistory)
+        if not records:
+            return None
+        stats = records[-1].toDict()
+        speeds = [record.speeddown for record in records if record.speeddown is not None]
+        peers = [record.peers for record in records if record.peers is not None]
+        stats['avg_speed_down'] = sum(speeds) / len(speeds) if speeds else None
+        stats['min_peers'] = min(peers) if peers else None
+        stats['max_peers'] = max(peers) if peers else None
+        # Share of the time the engine was short of data
+        stats['buffering'] = round(sum(1 for record in records if record.status in
+                                       ('main:prebuf', 'main:buf', 'main:wait')) / float(len(records)), 3)
+        stats['span'] = round(records[-1].time - records[0].time, 1)
+        if history:
+            stats['history'] = [[round(record.time, 1), record.status, record.speeddown, record.peers]
+                                for record in records]
+        return stats
+
     def getPlayEvent(self, timeout=None):
         '''
         Blocking while in PAUSE, non-blocking while in RESUME
@@ -206,10 +303,8 @@ class AceClient(object):
         logger = logging.getLogger('AceClient_recvdata')
 
         while True:
-            gevent.sleep()
             try:
-                self._recvbuffer = self._socket.read_until("\r\n")
-                self._recvbuffer = self._recvbuffer.strip()
+                line = self._socket.readline().strip()
             except:
                 # If something happened during read, abandon reader.
                 if not self._shuttingDown.isSet():
@@ -217,92 +312,132 @@ class AceClient(object):
                     self._shuttingDown.set()
                 return
 
-            if self._recvbuffer:
-                # Parsing everything only if the string is not empty
-                if self._recvbuffer.startswith(AceMessage.response.HELLO):
-                    # Parse HELLO
-                    if 'key=' in self._recvbuffer:
-                        self._request_key = self._recvbuffer.split()[
-                            2].split('=')[1]
-                        try:
-                            self._write(AceMessage.request.READY_key(
-                                self._request_key, self._product_key,
-                                self._resulttimeout))
-                        except urllib2.URLError as e:
-                            logger.error("Can't connect to keygen server! " + \
-                                repr(e))
-                            self._auth = False
-                            self._authevent.set()
-                            
-                        self._request_key = None
-                    else:
-                        self._write(AceMessage.request.READY_nokey)
-
-                elif self._recvbuffer.startswith(AceMessage.response.NOTREADY):
-                    # NOTREADY
-                    logger.error("Ace is not ready. Wrong auth?")
-                    self._auth = False
-                    self._authevent.set()                    
-
-                elif self._recvbuffer.startswith(AceMessage.response.START):
-                    # START
-                    try:
-                        self._url = self._recvbuffer.split()[1]
-                        self._urlresult.set(self._url)
-                        self._resumeevent.set()
-                    except IndexError as e:
-                        self._url = None
-						
-                elif self._recvbuffer.startswith(AceMessage.response.LOADRESP):
-                    # LOADASYNC
-                    self._pidinfo = self._recvbuffer.split()[5].split('"')[1]
-                    logger.debug('pidinfo = ' + self._pidinfo)					
-                    
-                elif self._recvbuffer.startswith(AceMessage.response.STOP):
-                    pass
-
-                elif self._recvbuffer.startswith(AceMessage.response.SHUTDOWN):
-                    logger.debug("Got SHUTDOWN from engine")
-                    self._socket.close()
+            # Parsing everything only if the string is not empty
+            if line:
+                command, _, params = line.partition(' ')
+                handler = AceClient._handlers.get(command)
+                # Handler returns True when the reader should stop
+                if handler and handler(self, params):
                     return
 
-                elif self._recvbuffer.startswith(AceMessage.response.AUTH):
-                    try:
-                        self._auth = self._recvbuffer.split()[1]
-                        # Send USERDATA here
-                        self._write(
-                            AceMessage.request.USERDATA(self._gender, self._age))
-                    except:
-                        pass
-                    self._authevent.set()
-
-                elif self._recvbuffer.startswith(AceMessage.response.GETUSERDATA):
-                    raise AceException("You should init me first!")
-
-                elif self._recvbuffer.startswith(AceMessage.response.STATE):
-                    self._state = self._recvbuffer.split()[1]
-
-                elif self._recvbuffer.startswith(AceMessage.response.STATUS):
-                    self._tempstatus = self._recvbuffer.split()[1].split(';')[0]
-                    if self._tempstatus != self._status:
-                        self._status = self._tempstatus
-                        logger.debug("STATUS changed to " + self._status)
-
-                    if self._status == 'main:err':
-                        logger.error(
-                            self._status + ' with message ' + self._recvbuffer.split(';')[2])
-                        self._result.set_exception(
-                            AceException(self._status + ' with message ' + self._recvbuffer.split(';')[2]))
-                        self._urlresult.set_exception(
-                            AceException(self._status + ' with message ' + self._recvbuffer.split(';')[2]))
-                    elif self._status == 'main:starting':
-                        self._result.set(True)
-
-                elif self._recvbuffer.startswith(AceMessage.response.PAUSE):
-                    logger.debug("PAUSE event")
-                    self._resumeevent.clear()
-
-                elif self._recvbuffer.startswith(AceMessage.response.RESUME):
-                    logger.debug("RESUME event")
-                    gevent.sleep(self._pausedelay)
-                    self._resumeevent.set()
+    def _onHello(self, params):
+        # HELLOTS version=<version> [key=<key>] ...
+        if 'key=' in params:
+            logger = logging.getLogger('AceClient_recvdata')
+            self._request_key = params.split()[1].split('=')[1]
+            try:
+                keygenstart = time.time()
+                self._write(AceMessage.request.READY_key(
+                    self._request_key, self._product_key,
+                    self._resulttimeout))
+                self._keygentime = time.time() - keygenstart
+            except urllib2.URLError as e:
+                logger.error("Can't connect to keygen server! " + \
+                    repr(e))
+                self._auth = False
+                self._authevent.set()
+
+            self._request_key = None
+        else:
+            self._write(AceMessage.request.READY_nokey)
+
+    def _onNotReady(self, params):
+        logging.getLogger('AceClient_recvdata').error("Ace is not ready. Wrong auth?")
+        self._auth = False
+        self._authevent.set()
+
+    def _onStart(self, params):
+        # START <url> [stream=1]
+        url = params.split(' ', 1)[0]
+        if url:
+            self._url = url
+            self._urlresult.set(self._url)
+            self._resumeevent.set()
+        else:
+            self._url = None
+
+    def _onLoadResp(self, params):
+        # LOADRESP <request id> <json>
+        logger = logging.getLogger('AceClient_recvdata')
+        try:
+            requestid, loadresp = params.split(' ', 1)
+            loadresp = json.loads(loadresp)
+        except ValueError:
+            logger.error("Bad LOADRESP " + params)
+            return
+        logger.debug('loadresp = ' + repr(loadresp))
+        result = self._loadresults.pop(requestid, None)
+        if result:
+            result.set(loadresp)
+
+    def _onStop(self, params):
+        pass
+
+    def _onShutdown(self, params):
+        logging.getLogger('AceClient_recvdata').debug("Got SHUTDOWN from engine")
+        self._socket.close()
+        return True
+
+    def _onAuth(self, params):
+        try:
+            self._auth = params.split()[0]
+            # Send USERDATA here
+            self._write(
+                AceMessage.request.USERDATA(self._gender, self._age))
+        except:
+            pass
+        self._authevent.set()
+
+    def _onEvent(self, params):
+        if params.startswith('getuserdata'):
+            raise AceException("You should init me first!")
+
+    def _onState(self, params):
+        state = params.split(' ', 1)[0]
+        if state != self._state:
+            self._state = state
+            telemetry.engine_transitions.inc(('state', state))
+
+    def _onStatus(self, params):
+        # Sent every second for every session, split only once
+        status = AceStatus(params)
+        self._statushistory.append(status)
+        if status.status != self._status:
+            self._status = status.status
+            logging.getLogger('AceClient_recvdata').debug("STATUS changed to " + self._status)
+            telemetry.engine_transitions.inc(('status', self._status))
+
+        if self._status == 'main:err':
+            errmsg = self._status + ' with message ' + status.message
+            logging.getLogger('AceClient_recvdata').error(errmsg)
+            self._result.set_exception(AceException(errmsg))
+            self._urlresult.set_exception(AceException(errmsg))
+        elif self._status == 'main:starting':
+            self._result.set(True)
+        else:
+            speeddown = status.speeddown
+            if speeddown is not None:
+                self._speeddown = speeddown
+
+    def _onPause(self, params):
+        logging.getLogger('AceClient_recvdata').debug("PAUSE event")
+        self._resumeevent.clear()
+
+    def _onResume(self, params):
+        logging.getLogger('AceClient_recvdata').debug("RESUME event")
+        gevent.sleep(self._pausedelay)
+        self._resumeevent.set()
+
+    # Message handlers by the first token of the line
+    _handlers = {AceMessage.response.HELLO: _onHello,
+                 AceMessage.response.NOTREADY: _onNotReady,
+                 AceMessage.response.START: _onStart,
+                 AceMessage.response.LOADRESP: _onLoadResp,
+                 AceMessage.response.STOP: _onStop,
+                 AceMessage.response.SHUTDOWN: _onShutdown,
+                 AceMessage.response.AUTH: _onAuth,
+                 AceMessage.response.EVENT: _onEvent,
+                 AceMessage.response.STATE: _onState,
+                 AceMessage.response.STATUS: _onStatus,
+                 AceMessage.response.PAUSE: _onPause,
+                 AceMessage.response.RESUME: _onResume}
@@ -4,6 +4,7 @@ Minimal Ace Stream client library to use with HTTP Proxy
 
 import hashlib
 import platform
+import time
 import urllib2
 
 
@@ -138,9 +139,91 @@ class AceMessage(object):
         STOP = 'STOP'
         SHUTDOWN = 'SHUTDOWN'
         AUTH = 'AUTH'
+        EVENT = 'EVENT'
         GETUSERDATA = 'EVENT getuserdata'
         STATE = 'STATE'
         STATUS = 'STATUS'
         PAUSE = 'PAUSE'
         RESUME = 'RESUME'
         LOADRESP = 'LOADRESP'
+
+
+class AceStatus(object):
+
+    '''
+    STATUS message parameters, split once. Engine sends STATUS every
+    second for every session, so numbers are parsed only when they're read.
+    main:<status>;<fields separated with ;>
+    '''
+
+    __slots__ = ('status', 'time', '_fields', '_start')
+
+    # Where download fields (total progress, immediate progress, speed
+    # down, http speed down, speed up, peers, http peers, downloaded,
+    # http downloaded, uploaded) start, after the status own fields
+    DOWNLOADFIELDS = {'main:dl': 1, 'main:wait': 2, 'main:prebuf': 3, 'main:buf': 3}
+
+    def __init__(self, params):
+        self._fields = params.split(';')
+        self.status = self._fields[0]
+        self.time = time.time()
+        self._start = AceStatus.DOWNLOADFIELDS.get(self.status)
+
+    def _number(self, index):
+        try:
+            # Ad status may follow the last field after |
+            return int(self._fields[index].split('|', 1)[0])
+        except (IndexError, ValueError):
+            return None
+
+    def _download(self, offset):
+        return self._number(self._start + offset) if self._start is not None else None
+
+    @property
+    def progress(self):
+        '''
+        Prebuffering/buffering/checking progress (percent)
+        '''
+        if self._start == 3 or self.status == 'main:check':
+            return self._number(1)
+        return None
+
+    @property
+    def speeddown(self):
+        '''
+        Download speed (in KiB/s)
+        '''
+        return self._download(2)
+
+    @property
+    def speedup(self):
+        return self._download(4)
+
+    @property
+    def peers(self):
+        return self._download(5)
+
+    @property
+    def downloaded(self):
+        '''
+        Downloaded total (in bytes)
+        '''
+        return self._download(7)
+
+    @property
+    def uploaded(self):
+        return self._download(9)
+
+    @property
+    def message(self):
+        '''
+        Error message of main:err
+        '''
+        if self.status == 'main:err':
+            return self._fields[2] if len(self._fields) > 2 else ''
+        return None
+
+    def toDict(self):
+        return {'status': self.status, 'time': self.time, 'progress': self.progress,
+                'speed_down': self.speeddown, 'speed_up': self.speedup, 'peers': self.peers,
+                'downloaded': self.downloaded, 'uploaded': self.uploaded, 'message': self.message}
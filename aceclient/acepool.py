@@ -0,0 +1,172 @@
+'''
+Pool of authenticated Ace Stream engine sessions
+'''
+
+import gevent
+import logging
+import time
+import telemetry
+from aceclient import AceClient, AceException
+from acemessages import AceConst
+
+
+class AcePool(object):
+
+    '''
+    Keeps authenticated AceClient sessions ready for new channels.
+    Sessions used by channels count towards the pool size, so sessions of
+    closed channels are recycled with STOP instead of creating new ones.
+    '''
+
+    def __init__(self, host, port, size=2, idle_timeout=600, check_interval=30,
+                 connect_timeout=5, result_timeout=10, debug=logging.ERROR,
+                 gender=AceConst.SEX_MALE, age=AceConst.AGE_18_24, product_key=None, pause_delay=0):
+        self._host = host
+        self._port = port
+        # Number of idle sessions to keep
+        self._size = size
+        # Idle session lifetime
+        self._idletimeout = idle_timeout
+        # Health check interval
+        self._checkinterval = check_interval
+        self._connecttimeout = connect_timeout
+        self._resulttimeout = result_timeout
+        self._debug = debug
+        # aceInit parameters
+        self._gender = gender
+        self._age = age
+        self._product_key = product_key
+        self._pausedelay = pause_delay
+        # Idle sessions: list of [AceClient, idle since]
+        self._idle = list()
+        # Sessions being created by the filler
+        self._creating = 0
+        # Sessions used by channels (got and not released yet)
+        self._used = 0
+        # Filler greenlet
+        self._fillergreenlet = None
+
+        if self._size > 0:
+            self._fill()
+            self._checkergreenlet = gevent.spawn(self._checker)
+        else:
+            self._checkergreenlet = None
+
+    def _create(self):
+        '''
+        Create and authenticate new session
+        '''
+        ace = AceClient(self._host, self._port, connect_timeout=self._connecttimeout,
+                        result_timeout=self._resulttimeout, debug=self._debug)
+        try:
+            ace.aceInit(gender=self._gender, age=self._age,
+                        product_key=self._product_key, pause_delay=self._pausedelay)
+        except:
+            ace.destroy()
+            raise
+        return ace
+
+    def get(self):
+        '''
+        Get authenticated session. Creates a new one if there are no
+        idle sessions.
+        '''
+        logger = logging.getLogger('AcePool_get')
+
+        while self._idle:
+            ace = self._idle.pop()[0]
+            if ace.isAlive():
+                logger.debug("Got session from pool")
+                # It was set up by the filler, outside of the request trace
+                for stage, duration in ace.setuptimes:
+                    telemetry.record(stage, duration)
+                # Recycled sessions are not set up again
+                ace.setuptimes = list()
+                self._used += 1
+                return ace
+            ace.destroy()
+
+        logger.debug("Pool is empty, creating new session")
+        # Dead sessions are replaced
+        self._fill()
+        ace = self._create()
+        self._used += 1
+        return ace
+
+    def release(self, ace):
+        '''
+        Return session to the pool or destroy it
+        '''
+        logger = logging.getLogger('AcePool_release')
+
+        self._used = max(self._used - 1, 0)
+        if ace.isAlive() and len(self._idle) + self._creating + self._used < self._size:
+            try:
+                ace.STOP()
+                ace.setuptimes = list()
+                self._idle.append([ace, time.time()])
+                logger.debug("Session returned to pool")
+                return
+            except AceException as e:
+                logger.debug("Can't recycle session " + repr(e))
+
+        ace.destroy()
+        self._fill()
+
+    def destroy(self):
+        '''
+        Destroy all idle sessions
+        '''
+        if self._checkergreenlet:
+            self._checkergreenlet.kill(block=False)
+        if self._fillergreenlet:
+            self._fillergreenlet.kill(block=False)
+        while self._idle:
+            self._idle.pop()[0].destroy()
+
+    def _fill(self):
+        if self._fillergreenlet is None and len(self._idle) + self._used < self._size:
+            self._fillergreenlet = gevent.spawn(self._filler)
+
+    def _filler(self):
+        '''
+        Filler method for greenlet
+        '''
+        logger = logging.getLogger('AcePool_filler')
+
+        try:
+            while len(self._idle) + self._used < self._size:
+                self._creating += 1
+                try:
+                    ace = self._create()
+                except AceException as e:
+                    logger.error("Can't create session: " + repr(e))
+                    # Engine is not ready, retry on the next check
+                    return
+                finally:
+                    self._creating -= 1
+                self._idle.append([ace, time.time()])
+                logger.debug("Session added to pool")
+        finally:
+            self._fillergreenlet = None
+
+    def _checker(self):
+        '''
+        Health checker method for greenlet
+        '''
+        logger = logging.getLogger('AcePool_checker')
+
+        while True:
+            gevent.sleep(self._checkinterval)
+            now = time.time()
+            for item in list(self._idle):
+                ace, idlesince = item
+                if not ace.isAlive():
+                    logger.debug("Evicting dead session")
+                elif self._idletimeout and now - idlesince > self._idletimeout:
+                    logger.debug("Evicting idle session")
+                else:
+                    continue
+                self._idle.remove(item)
+                ace.destroy()
+            self._fill()
@@ -5,27 +5,57 @@ Simple Client Counter for VLC VLM
 
 class ClientCounter(object):
 
-    def __init__(self):
+    def __init__(self, shared=None):
         self.clients = dict()
         self.aces = dict()
+        self.broadcasters = dict()
+        # Where timeshift clients stopped: id -> {ip: stream position}
+        self.positions = dict()
+        # Counted clients of this process
         self.total = 0
+        # Global counter of all worker processes (WorkerClient)
+        self.shared = shared
+
+    def getTotal(self):
+        '''
+        Total clients of all workers
+        '''
+        if self.shared:
+            return self.shared.total()
+        return self.total
 
     def get(self, id):
         return self.clients.get(id, (False,))[0]
 
-    def add(self, id, ip):
+    def add(self, id, ip, limit=0, counted=True):
+        '''
+        Add client. Returns number of channel clients or 0 if limit of
+        total clients is reached. Not counted clients are not limited
+        and don't count in the global total.
+        '''
+        if counted:
+            if self.shared:
+                if not self.shared.add(limit):
+                    return 0
+            elif limit > 0 and self.total >= limit:
+                return 0
+
         if self.clients.has_key(id):
             self.clients[id][0] += 1
             self.clients[id][1].append(ip)
         else:
             self.clients[id] = [1, [ip]]
 
-        self.total += 1
+        if counted:
+            self.total += 1
         return self.clients[id][0]
 
-    def delete(self, id, ip):
+    def delete(self, id, ip, counted=True):
         if self.clients.has_key(id):
-            self.total -= 1
+            if counted:
+                self.total -= 1
+                if self.shared:
+                    self.shared.delete()
             if self.clients[id][0] == 1:
                 del self.clients[id]
                 return False
@@ -53,3 +83,47 @@ class ClientCounter(object):
 
         del self.aces[id]
         return True
+
+    def getStatus(self, id, history=False):
+        '''
+        Engine STATUS stats of the channel session, None if there is no
+        session in this process or no STATUS yet
+        '''
+        ace = self.aces.get(id)
+        return ace.statusStats(history) if ace else None
+
+    def statuses(self, history=False):
+        '''
+        Engine STATUS stats of all channel sessions
+        '''
+        result = dict()
+        for id, ace in self.aces.items():
+            stats = ace.statusStats(history)
+            if stats:
+                result[id] = stats
+        return result
+
+    def getBroadcaster(self, id):
+        return self.broadcasters.get(id, False)
+
+    def addBroadcaster(self, id, value):
+        if self.broadcasters.has_key(id):
+            return False
+
+        self.broadcasters[id] = value
+        return True
+
+    def deleteBroadcaster(self, id):
+        if not self.broadcasters.has_key(id):
+            return False
+
+        del self.broadcasters[id]
+        # Positions are in the stream of this broadcaster
+        self.positions.pop(id, None)
+        return True
+
+    def getPosition(self, id, ip):
+        return self.positions.get(id, {}).get(ip)
+
+    def setPosition(self, id, ip, position):
+        self.positions.setdefault(id, dict())[ip] = position
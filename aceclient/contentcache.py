@@ -0,0 +1,48 @@
+'''
+LRU cache with TTL for content info
+'''
+
+import time
+from collections import OrderedDict
+
+
+class ContentCache(object):
+
+    '''
+    Content info cache class.
+    Least recently used items are removed when cache is full.
+    '''
+
+    def __init__(self, maxsize=500, ttl=3600):
+        # Maximum number of items
+        self._maxsize = maxsize
+        # Item lifetime (in seconds)
+        self._ttl = ttl
+        # Items: key -> (value, expiration time)
+        self._items = OrderedDict()
+        # Counters
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        item = self._items.pop(key, None)
+        if item is None or item[1] < time.time():
+            self.misses += 1
+            return default
+
+        # Moving item to the end as the most recently used
+        self._items[key] = item
+        self.hits += 1
+        return item[0]
+
+    def set(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = (value, time.time() + self._ttl)
+        while len(self._items) > self._maxsize:
+            self._items.popitem(last=False)
+
+    def delete(self, key):
+        return self._items.pop(key, None) is not None
+
+    def __len__(self):
+        return len(self._items)
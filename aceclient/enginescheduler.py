@@ -0,0 +1,112 @@
+'''
+Scheduler for several Ace Stream engines
+'''
+
+import logging
+import time
+from aceclient import AceException
+from acepool import AcePool
+
+
+class AceEngine(object):
+
+    '''
+    One Ace Stream engine with its session pool
+    '''
+
+    def __init__(self, host, port, pool):
+        self.host = host
+        self.port = port
+        self.pool = pool
+        # Sessions used by channels
+        self.sessions = set()
+        # Time of the last connect or auth failure, None if healthy
+        self.failedsince = None
+        # Counters
+        self.started = 0
+        self.failures = 0
+
+    def name(self):
+        return self.host + ':' + str(self.port)
+
+    def speedDown(self):
+        return sum(ace.getSpeedDown() for ace in self.sessions)
+
+
+class EngineScheduler(object):
+
+    '''
+    Places channels on the least loaded healthy engine.
+    A channel stays on its engine while it has viewers.
+    '''
+
+    def __init__(self, engines, retry_interval=30, **poolparams):
+        # Unhealthy engine is not used for that long
+        self._retryinterval = retry_interval
+        # List of AceEngine
+        self.engines = [AceEngine(host, port, AcePool(host, port, **poolparams)) for host, port in engines]
+        # Channel -> AceEngine
+        self._pinned = dict()
+
+    def _candidates(self, channel):
+        engine = self._pinned.get(channel)
+        if engine:
+            return [engine]
+
+        now = time.time()
+        healthy = [engine for engine in self.engines
+                   if engine.failedsince is None or now - engine.failedsince > self._retryinterval]
+        # If all the engines failed, try them anyway
+        candidates = healthy or list(self.engines)
+        # Least loaded first: by active sessions, then by download speed
+        return sorted(candidates, key=lambda engine: (len(engine.sessions), engine.speedDown()))
+
+    def get(self, channel):
+        '''
+        Get authenticated session for channel
+        '''
+        logger = logging.getLogger('EngineScheduler_get')
+
+        error = None
+        for engine in self._candidates(channel):
+            try:
+                ace = engine.pool.get()
+            except AceException as e:
+                logger.error("Engine " + engine.name() + " failed: " + repr(e))
+                engine.failures += 1
+                engine.failedsince = time.time()
+                error = e
+                continue
+
+            engine.failedsince = None
+            engine.sessions.add(ace)
+            engine.started += 1
+            self._pinned[channel] = engine
+            logger.debug(channel + " placed on engine " + engine.name())
+            return ace
+
+        raise error or AceException("No Ace Stream engines")
+
+    def release(self, channel, ace):
+        '''
+        Return session of the channel which has no viewers anymore
+        '''
+        engine = self._pinned.pop(channel, None)
+        if engine:
+            engine.sessions.discard(ace)
+            engine.pool.release(ace)
+        else:
+            ace.destroy()
+
+    def stats(self):
+        '''
+        Per-engine load statistics
+        '''
+        return [{'engine': engine.name(), 'healthy': engine.failedsince is None,
+                 'sessions': len(engine.sessions), 'speed_down': engine.speedDown(),
+                 'started': engine.started, 'failures': engine.failures}
+                for engine in self.engines]
+
+    def destroy(self):
+        for engine in self.engines:
+            engine.pool.destroy()
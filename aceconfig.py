@@ -13,6 +13,10 @@ class AceConfig(object):
     acehost = '127.0.0.1'
     # Ace Stream Engine port (autodetect for Windows)
     aceport = 53053
+    # Several Ace Stream Engines, list of (host, port). Channels go to the
+    # least loaded one. Empty uses the settings above.
+    # i.e. aceengines = (('127.0.0.1', 62062), ('192.168.1.2', 62062))
+    aceengines = ()
     # Ace Stream age parameter (LT_13, 13_17, 18_24, 25_34, 35_44, 45_54,
     # 55_64, GT_65)
     aceage = AceConst.AGE_25_34
@@ -22,6 +26,15 @@ class AceConfig(object):
     aceconntimeout = 5
     # Ace Stream authentication result timeout
     aceresulttimeout = 10
+    # Number of authenticated Ace Stream sessions kept ready for new
+    # channels, sessions used by channels count too and are recycled when
+    # the channel stops (0 to connect on every channel start)
+    acepoolsize = 2
+    # Idle session lifetime in the pool (in seconds)
+    acepoolidle = 600
+    # Content info (LOADRESP) cache size and lifetime (in seconds)
+    contentcachesize = 500
+    contentcachettl = 3600
     # AceClient debug level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
     debug = logging.DEBUG
 
@@ -29,8 +42,47 @@ class AceConfig(object):
     httphost = '0.0.0.0'
     # HTTP Server port
     httpport = 38082
+    # HTTP front end: 'threading' (BaseHTTPServer, one request per
+    # connection) or 'gevent' (gevent StreamServer with keep-alive for
+    # plugins and chunked transfer for streams)
+    httpfrontend = 'threading'
     # Maximum concurrent connections (video clients)
     maxconns = 10
+    # Number of worker processes sharing HTTP port (0 or 1 to run in one
+    # process). Needs Linux 3.9+ for SO_REUSEPORT.
+    workers = 0
+    # Unix socket for worker processes shared state
+    workersocket = '/tmp/aceproxy-workers.sock'
+    # Workers relay channels to each other on 127.0.0.1 ports starting
+    # from this one (one port per worker)
+    workerrelayport = 38090
+    # Size of the per-channel broadcast buffer shared by all the clients
+    # of the channel (in chunks)
+    broadcastbuffer = 256
+    # Maximum chunk size of the broadcast buffer. Reads are aligned to
+    # MPEG-TS packets (188 bytes) and adapt to the stream bitrate up to
+    # this size.
+    broadcastchunk = 188 * 64
+    # Per-channel cache of the stream since the last keyframe (in bytes).
+    # Clients joining a running channel get it first and see the picture
+    # at once. 0 disables it.
+    broadcastgopcache = 4 * 1024 * 1024
+    # Per-channel timeshift ring file size (in bytes), 0 disables timeshift.
+    # Clients can start earlier with /pid/<id>?offset=-300 (in seconds)
+    # or continue where they stopped with ?offset=resume
+    timeshiftsize = 0
+    # Directory for timeshift ring files
+    timeshiftpath = '/tmp/'
+    # HLS output: /pid/<id>/index.m3u8 and /torrent/<url>/index.m3u8
+    # Enable HLS or not. Segments are kept in memory of one process, so
+    # HLS is off with several workers.
+    hlsuse = False
+    # Segment duration (in seconds)
+    hlssegment = 4
+    # Number of segments in the playlist, older ones are dropped
+    hlswindow = 6
+    # Stop segmenting the channel after that many seconds without requests
+    hlsidle = 30
 
     # Enable VLC or not
     # I strongly recommend to use VLC, because it lags a lot without it
@@ -44,6 +96,13 @@ class AceConfig(object):
     vlcoutport = 38083
     # VLC password
     vlcpass = 'admin'
+    # Several VLC instances to spread remuxing over CPU cores, list of
+    # (host, telnet port, streaming port). Empty uses the settings above.
+    # i.e. vlcinstances = (('127.0.0.1', 4212, 38083), ('127.0.0.1', 4213, 38084))
+    vlcinstances = ()
+    # How channels are assigned to VLC instances: 'hash' (channel always
+    # goes to the same instance) or 'load' (least loaded instance)
+    vlcbalance = 'hash'
     # VLC muxer. You probably want one of these streamable muxers:
     # ts, asf, flv, ogg, mkv
     # You can use ffmpeg muxers too, if your VLC is built with it
@@ -73,6 +132,17 @@ class AceConfig(object):
     videodestroydelay = 3
     # Pre-buffering timeout
     videotimeout = 40
+    # Channel prewarming. Channels which are popular at this hour of the
+    # day are kept started, clients get them without pre-buffering.
+    # Maximum number of prewarmed channels, 0 disables prewarming
+    prewarmchannels = 0
+    # Download bandwidth budget of prewarmed channels in KiB/s, 0 - unlimited
+    prewarmbandwidth = 0
+    # Which channel to drop when over budget: 'lfu' - least requested at
+    # this hour, 'lru' - least recently requested
+    prewarmpolicy = 'lfu'
+    # Minimum number of requests at this hour to prewarm a channel
+    prewarmminrequests = 3
     # ------------------------
     #CyberTV 
     #Set your IP or domain name
@@ -82,16 +152,20 @@ class AceConfig(object):
     #Cybertv add_ch 
     cybertv_add_ch = 'http://cybertv.host-ed.me/add_ch_get.php?md5pass='
     cybertv_add_serv = 'http://cybertv.host-ed.me/add_serv_addr.php?md5pass='
+    #CyberTV request timeout. Requests are sent in background, failed ones
+    #are retried later
+    cybertvtimeout = 10
     #-------------------------
 
     # Fake User-Agents (not video players) which generates a lot of requests
     # which Ace stream handles badly. Send them 200 OK and do nothing.
     fakeuas = ('Mozilla/5.0 IMC plugin Macintosh', )
-    # User-Agents with fast and non-configurable timeout, for which we send
-    # fake headers right after the connection initiated
-    fakeheaderuas = ('HLS Client/2.0 (compatible; LG NetCast.TV-2012)',
-                     'Mozilla/5.0 (DirectFB; Linux armv7l) AppleWebKit/534.26+ (KHTML, like Gecko) Version/5.0 Safari/534.26+ LG Browser/5.00.00(+mouse+3D+SCREEN+TUNER; LGE; 42LM670T-ZA; 04.41.03; 0x00000001;); LG NetCast.TV-2012 0'
-                     )
+    # Send 200 OK headers right after the request and MPEG-TS null packets
+    # while the channel starts, so players don't time out while the engine
+    # prebuffers. Error codes can't be sent then, the connection is closed.
+    earlyheaders = True
+    # Interval of null packets while the channel starts (seconds)
+    earlypadding = 0.5
     # HTTP debug level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
     httpdebug = logging.DEBUG
     # Logging to a file
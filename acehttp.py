@@ -7,24 +7,45 @@ import gevent
 import gevent.monkey
 # Monkeypatching and all the stuff
 gevent.monkey.patch_all()
+import gevent.event
 import gevent.queue
 import glob
 import os
 import sys
 import logging
+import time
 import BaseHTTPServer
 import SocketServer
 import urllib2
+import urlparse
 import hashlib
 import aceclient
 from aceconfig import AceConfig
 import vlcclient
+import streamer
+import cybertv
+import prewarm
+import telemetry
+import multiworker
+import geventhttp
+import socket
 from aceclient.clientcounter import ClientCounter
 from plugins.PluginInterface import AceProxyPlugin
 
 
+def isHlsPath(splittedpath):
+    '''
+    /pid/<id>/index.m3u8 or /pid/<id>/hls/<sequence>.ts (same for torrent)
+    '''
+    return len(splittedpath) > 3 and splittedpath[1].lower() in ('pid', 'torrent') and \
+        (splittedpath[3] == 'index.m3u8' or (splittedpath[3] == 'hls' and len(splittedpath) > 4))
+
+
 class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
+    # Null packets sent while the channel starts, 7 like in UDP streams
+    PADDING = streamer.NULLPACKET * 7
+
     def closeConnection(self):
         '''
         Disconnecting client
@@ -37,12 +58,22 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             except:
                 pass
 
+    def sendData(self, data):
+        '''
+        Send video data to client
+        '''
+        self.connection.sendall(data)
+
     def dieWithError(self, errorcode=500):
         '''
         Close connection with error
         '''
         logging.warning("Dying with error")
-        if self.clientconnected:
+        if self.clientconnected and self.headerssent:
+            # Early headers are sent, the error can't be sent anymore,
+            # just close the connection
+            self.closeConnection()
+        elif self.clientconnected:
             self.send_error(errorcode)
             self.end_headers()
             self.closeConnection()
@@ -55,6 +86,31 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         logger.debug("Started")
 
         self.vlcstate = True
+        # Byte counter is collected on metrics scrape
+        telemetry.clients.add(self)
+        # Our position in the channel broadcaster
+        cursor = self.broadcaster.attach()
+        # Timeshifted clients read from the ring file until they catch up
+        position = self.timeshiftPosition()
+        if position is None:
+            # Cached stream since the last keyframe goes first, it ends
+            # right before the cursor
+            burst = self.broadcaster.burst()
+        else:
+            logger.debug("Timeshift from position " + str(position))
+            burst = self.broadcaster.streamHeaders()
+        try:
+            self.relayStream(cursor, position, burst)
+        finally:
+            self.broadcaster.detach(cursor)
+
+    def relayStream(self, cursor, position, burst):
+        '''
+        Send burst, then the timeshift ring from position (if not None),
+        then the live stream from cursor
+        '''
+        logger = logging.getLogger('http_proxyReadWrite')
+        firstbyte = True
         while True:
             try:
                 if AceConfig.videoobey and not AceConfig.vlcuse:
@@ -69,31 +125,134 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                         # stream
                         self.ace.getPlayEvent(0.5)
                         if not self.vlcstate:
-                            AceStuff.vlcclient.unPauseBroadcast(self.vlcid)
+                            AceStuff.vlcpool.unPauseBroadcast(self.vlcid)
                             self.vlcstate = True
                     except gevent.Timeout:
                         if self.vlcstate:
-                            AceStuff.vlcclient.pauseBroadcast(self.vlcid)
+                            AceStuff.vlcpool.pauseBroadcast(self.vlcid)
                             self.vlcstate = False
 
                 if not self.clientconnected:
                     logger.debug("Client is not connected, terminating")
                     return
 
-                data = self.video.read(4096)
-                if data and self.clientconnected:
-                    self.wfile.write(data)
+                if burst:
+                    chunks, burst = burst, None
+                elif position is not None:
+                    if position >= self.broadcaster.timeshift.written:
+                        # Caught up with live stream
+                        self.broadcaster.skipToLive(cursor)
+                        position = None
+                        continue
+                    data, position = self.broadcaster.timeshift.read(position, AceConfig.broadcastchunk)
+                    chunks = [data]
                 else:
-                    # Prevent 100% CPU usage
-                    gevent.sleep(0.5)
+                    # Blocks until the broadcaster gets new data
+                    chunks, cursor = self.broadcaster.read(cursor, 0.5)
+                for data in chunks:
+                    if not self.clientconnected:
+                        break
+                    # Buffers are sent as is, without copying them
+                    self.sendData(data)
+                    self.bytessent += len(data)
+                    if firstbyte:
+                        firstbyte = False
+                        self.stagetimer.mark('firstbyte')
+                        telemetry.tracer.finish(self.stagetimer)
+                        logger.info("Channel start timings (trace " + self.stagetimer.id + "): " +
+                                    str(self.stagetimer))
+                        telemetry.first_byte.observe(self.stagetimer.total())
+                        for stage, duration in self.stagetimer.stages:
+                            telemetry.start_stages.observe(duration, (stage, ))
+                if self.broadcaster.timeshift:
+                    # Where to continue if client reconnects
+                    self.streamposition = position if position is not None else \
+                        self.broadcaster.positionOf(cursor)
             except:
                 # Video connection dropped
                 logger.debug("Video Connection dropped")
-                self.video.close()
                 self.closeConnection()
                 gevent.sleep()
                 return
 
+    def sendPadding(self):
+        '''
+        Keep the client waiting for the channel start: MPEG-TS null packets
+        until stopPadding()
+        '''
+        logger = logging.getLogger('http_sendPadding')
+        try:
+            while self.clientconnected:
+                self.sendData(HTTPHandler.PADDING)
+                if self.paddingstop.wait(AceConfig.earlypadding):
+                    break
+        except Exception as e:
+            logger.debug("Padding stopped: " + repr(e))
+
+    def stopPadding(self):
+        '''
+        Stop padding on a packet boundary, before video data is sent
+        '''
+        if self.paddinggreenlet:
+            self.paddingstop.set()
+            self.paddinggreenlet.join()
+            self.paddinggreenlet = None
+
+    def timeshiftPosition(self):
+        '''
+        Stream position for ?offset=-<seconds> and ?offset=resume
+        requests, None for live ones
+        '''
+        timeshift = self.broadcaster.timeshift
+        offset = self.query.get('offset', [None])[0]
+        if not timeshift or not offset or self.prewarm:
+            return None
+        if offset == 'resume':
+            position = AceStuff.clientcounter.getPosition(self.path_unquoted, self.clientip)
+            if position is not None and timeshift.contains(position):
+                return position
+            return None
+        try:
+            offset = int(offset)
+        except ValueError:
+            return None
+        return timeshift.seek(offset) if offset < 0 else None
+
+    def handleHls(self):
+        '''
+        Send HLS playlist or segment of the channel
+        '''
+        key = self.reqtype + '/' + self.splittedpath[2]
+        if self.splittedpath[3] == 'index.m3u8':
+            data = AceStuff.hls.get(key).playlist(AceConfig.videotimeout)
+            contenttype = 'application/vnd.apple.mpegurl'
+            cachecontrol = 'no-cache'
+        else:
+            try:
+                sequence = int(self.splittedpath[4].split('.')[0])
+            except (IndexError, ValueError):
+                self.dieWithError(400)  # 400 Bad Request
+                return
+            # Segments of channels which are not segmented are gone
+            segmenter = AceStuff.hls.get(key, create=False)
+            data = segmenter.segment(sequence) if segmenter else None
+            contenttype = 'video/MP2T'
+            # Segments never change
+            cachecontrol = 'public, max-age=' + str(segmenter.maxAge()) if segmenter else None
+
+        if data is None:
+            telemetry.http_errors.inc(('404', 'hls'))
+            self.dieWithError(404)  # 404 Not Found
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', contenttype)
+        self.send_header('Cache-Control', cachecontrol)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        telemetry.hls_bytes_out.inc(value=len(data))
+
     def hangDetector(self):
         '''
         Detect client disconnection while in the middle of something
@@ -104,7 +263,7 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         try:
             while True:
                 logger.debug("PING...")
-                if not self.rfile.read():
+                if not self.rfile.read(4096):
                     break
         except:
             pass
@@ -112,16 +271,13 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             self.clientconnected = False
             logger.debug("Client disconnected")
             
-			#Buld CyberTV url
-            cybertv_url = 'http://' + AceConfig.CyberTV_globalIP + ':' + str(AceConfig.vlcoutport) + '/' + self.vlcid
-            logger.debug("CyberTV: url = " + cybertv_url)
-            try:
-                cybertv_addch_url = AceConfig.cybertv_add_ch + AceConfig.md5pass + '&ch_name=' + self.vlcid + '&ch_url=' + cybertv_url + '&active=' + '0'
-                cybertv_add_rez = urllib2.urlopen(cybertv_addch_url, timeout=10).read()
-                logger.debug("CyberTV: loaded add_ch close")
-            except:
-                logger.debug("CyberTV: ERROR load add_ch close")
-            
+            # Prewarm and HLS segmenter requests are not CyberTV clients
+            if not (self.prewarm or self.segmenter):
+                #Buld CyberTV url
+                cybertv_url = 'http://' + AceConfig.CyberTV_globalIP + ':' + str(self.vlcoutport) + '/' + self.vlcid
+                logger.debug("CyberTV: url = " + cybertv_url)
+                AceStuff.cybertv.addChannel(self.vlcid, cybertv_url, False)
+
             try:
                 self.requestgreenlet.kill()
                 self.proxyReadWritegreenlet.kill()
@@ -139,17 +295,27 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self.clientconnected = True
         # Don't wait videodestroydelay if error happened
         self.errorhappened = True
-        # Headers sent flag for fake headers UAs
+        # Headers sent flag for early headers
         self.headerssent = False
+        # Null packets sender while the channel starts
+        self.paddinggreenlet = None
+        self.paddingstop = gevent.event.Event()
         # Current greenlet
         self.requestgreenlet = gevent.getcurrent()
         # Connected client IP address
         self.clientip = self.request.getpeername()[0]
+        # Stream position the client got to (with timeshift enabled)
+        self.streamposition = None
+        # Video bytes sent to the client
+        self.bytessent = 0
 		
         logger.info("Accepted connection from " + self.clientip + " path " + self.path)
 
         try:
-            self.splittedpath = self.path.split('/')
+            # Query string is for plugins, e.g. playlist filters
+            path, _, query = self.path.partition('?')
+            self.query = urlparse.parse_qs(query)
+            self.splittedpath = path.split('/')
             self.reqtype = self.splittedpath[1].lower()
             # If first parameter is 'pid' or 'torrent' or it should be handled
             # by plugin
@@ -178,12 +344,6 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             self.dieWithError(400)  # 400 Bad Request
             return
 
-        # Limit concurrent connections
-        if AceConfig.maxconns > 0 and AceStuff.clientcounter.total >= AceConfig.maxconns:
-            logger.debug("Maximum connections reached, can't serve this")
-            self.dieWithError(503)  # 503 Service Unavailable
-            return
-
         # Pretend to work fine with Fake UAs
         if self.headers.get('User-Agent') and self.headers.get('User-Agent') in AceConfig.fakeuas:
             logger.debug("Got fake UA: " + self.headers.get('User-Agent'))
@@ -194,6 +354,15 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             self.closeConnection()
             return
 
+        # HLS playlist and segments are served from memory
+        if AceStuff.hls and isHlsPath(self.splittedpath):
+            self.handleHls()
+            self.closeConnection()
+            return
+
+        # Channel start timings, traced with request id. Only channel
+        # requests are traced, the ones above return right away.
+        self.stagetimer = telemetry.tracer.start(self.path, self.clientip)
         self.path_unquoted = urllib2.unquote(self.splittedpath[2])
         # Make list with parameters
         self.params = list()
@@ -203,15 +372,38 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             except IndexError:
                 self.params.append('0')
 
-        # Adding client to clientcounter
-        clients = AceStuff.clientcounter.add(self.path_unquoted, self.clientip)
-        # If we are the one client, but sucessfully got ace from clientcounter,
-        # then somebody is waiting in the videodestroydelay state
+        # Clients relayed from other workers are already counted there
+        self.relayed = self.server.relay
+        # Prewarming request of our scheduler keeps channel started, gets
+        # headers only. Relayed ones get data for the relaying worker.
+        self.prewarm = not self.relayed and self.headers.get('X-Prewarm') == AceStuff.internaltoken
+        # HLS segmenter request, not a client
+        self.segmenter = self.headers.get('X-Segmenter') == AceStuff.internaltoken
+        self.counted = not (self.relayed or self.prewarm or self.segmenter)
+        # Adding client to clientcounter, limiting concurrent connections
+        if not AceStuff.clientcounter.add(self.path_unquoted, self.clientip,
+                                          AceConfig.maxconns if self.counted else 0, self.counted):
+            logger.debug("Maximum connections reached, can't serve this")
+            telemetry.http_errors.inc(('503', 'maxconns'))
+            telemetry.tracer.finish(self.stagetimer, 'maxconns')
+            self.dieWithError(503)  # 503 Service Unavailable
+            return
+        if AceStuff.prewarmer and self.counted:
+            if AceStuff.prewarmer.request(self.reqtype + '/' + self.splittedpath[2]):
+                logger.debug("Channel is prewarmed")
+        # If we are the one client, but sucessfully got broadcaster from
+        # clientcounter, then somebody is waiting in the videodestroydelay state
+        self.broadcaster = AceStuff.clientcounter.getBroadcaster(self.path_unquoted)
         self.ace = AceStuff.clientcounter.getAce(self.path_unquoted)
-        if not self.ace:
+        if not self.broadcaster:
             shouldcreateace = True
         else:
             shouldcreateace = False
+        # URL of the worker which owns the channel, if it's not us
+        self.relayurl = None
+
+        # VLC streaming port of this channel
+        self.vlcoutport = AceConfig.vlcoutport
 
         # Use PID as VLC ID if PID requested
         # Or torrent url MD5 hash if torrent requested
@@ -220,139 +412,199 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         else:
             self.vlcid = hashlib.md5(self.path_unquoted).hexdigest()
 
-        # If we don't use VLC and we're not the first client
-        if clients != 1 and not AceConfig.vlcuse:
-            AceStuff.clientcounter.delete(self.path_unquoted, self.clientip)
-            logger.error(
-                "Not the first client, cannot continue in non-VLC mode")
-            self.dieWithError(503)  # 503 Service Unavailable
-            return
-
         if shouldcreateace:
-        # If we are the only client, create AceClient
+            # In worker mode only one worker runs engine session of the
+            # channel, others relay the stream from it
+            if AceStuff.worker:
+                owner = AceStuff.worker.claim(self.path_unquoted)
+                if owner != AceStuff.worker.index and not self.relayed:
+                    # Query is per client, relayed stream is shared
+                    self.relayurl = AceStuff.worker.relayUrl(owner) + self.path.partition('?')[0]
+                    logger.debug("Relaying from worker " + str(owner))
+
+            # On-disk copy of the channel for timeshifted clients
+            timeshift = None
+            if AceConfig.timeshiftsize:
+                try:
+                    # File name is a hash: the id comes from the client
+                    timeshift = streamer.TimeshiftRing(
+                        os.path.join(AceConfig.timeshiftpath,
+                                     hashlib.md5(self.vlcid).hexdigest() + '-' + str(os.getpid()) + '.ts'),
+                        AceConfig.timeshiftsize)
+                except streamer.TimeshiftException as e:
+                    logger.error(repr(e))
+
+            # Other clients of this channel will read from the broadcaster
+            self.broadcaster = streamer.StreamBroadcaster(
+                buffersize=AceConfig.broadcastbuffer, pool=AceStuff.bufferpool,
+                gopcache=AceConfig.broadcastgopcache, timeshift=timeshift)
+            AceStuff.clientcounter.addBroadcaster(self.path_unquoted, self.broadcaster)
+
+        # Players get headers and null packets while the channel starts,
+        # instead of waiting silently for the engine to prebuffer
+        if AceConfig.earlyheaders and self.counted and not self.broadcaster.isReady():
+            logger.debug("Sending early headers")
+            self.send_response(200)
+            self.send_header("Content-Type", "video/mpeg")
+            self.send_header('X-Trace-Id', self.stagetimer.id)
+            self.end_headers()
+            # Do not send real headers at all
+            self.headerssent = True
+            self.stagetimer.mark('headers')
+            if AceConfig.earlypadding:
+                self.paddinggreenlet = gevent.spawn(self.sendPadding)
+
+        if shouldcreateace and not self.relayurl:
+        # If we are the only client, get authenticated AceClient from
+        # the least loaded engine
             try:
-                self.ace = aceclient.AceClient(AceConfig.acehost, AceConfig.aceport, connect_timeout=AceConfig.aceconntimeout, result_timeout=AceConfig.aceresulttimeout, debug=AceConfig.debug)
+                self.ace = AceStuff.engines.get(self.path_unquoted)
+                self.stagetimer.mark('ace')
                 # Adding AceClient instance to pool
                 AceStuff.clientcounter.addAce(self.path_unquoted, self.ace)
                 logger.debug("AceClient created")
             except aceclient.AceException as e:
                 logger.error("AceClient create exception: " + repr(e))
+                self.broadcaster.close()
+                AceStuff.clientcounter.deleteBroadcaster(self.path_unquoted)
+                if AceStuff.worker:
+                    AceStuff.worker.release(self.path_unquoted)
                 AceStuff.clientcounter.delete(
-                    self.path_unquoted, self.clientip)
+                    self.path_unquoted, self.clientip, self.counted)
+                telemetry.http_errors.inc(('502', 'engine'))
+                telemetry.tracer.finish(self.stagetimer, 'engine')
+                # Padding must not write to the socket being closed
+                self.stopPadding()
                 self.dieWithError(502)  # 502 Bad Gateway
                 return
 
-        # Send fake headers if this User-Agent is in fakeheaderuas tuple
-        if self.headers.get('User-Agent') and self.headers.get('User-Agent') in AceConfig.fakeheaderuas:
-            logger.debug(
-                "Sending fake headers for " + self.headers.get('User-Agent'))
-            self.send_response(200)
-            self.send_header("Content-Type", "video/mpeg")
-            self.end_headers()
-            # Do not send real headers at all
-            self.headerssent = True
-
         try:
             self.hanggreenlet = gevent.spawn(self.hangDetector)
             logger.debug("hangDetector spawned")
             gevent.sleep()
 
-            # Initializing AceClient
-            if shouldcreateace:
-                self.ace.aceInit(
-                    gender=AceConfig.acesex, age=AceConfig.aceage,
-                    product_key=AceConfig.acekey, pause_delay=AceConfig.videopausedelay)
-                logger.debug("AceClient inited")
+            if self.ace:
+                # Starting video with AceClient
+                if shouldcreateace:
+                    if self.reqtype == 'pid':					
+                        self.ace.START(
+                            self.reqtype, {'content_id': self.path_unquoted, 'file_indexes': self.params[0]})
+                    elif self.reqtype == 'torrent':
+                        self.paramsdict = dict(
+                            zip(aceclient.acemessages.AceConst.START_TORRENT, self.params))
+                        self.paramsdict['url'] = self.path_unquoted                    
+                        self.ace.START(self.reqtype, self.paramsdict)
+                    logger.debug("START done")
+                    self.stagetimer.mark('start')                
+
+                # Getting URL
+                self.url = self.ace.getUrl(AceConfig.videotimeout)
+                self.stagetimer.mark('url')
+                self.errorhappened = False
+
+                if shouldcreateace:
+                    logger.debug("Got url " + self.url)
                 
-                if self.reqtype == 'pid':					
-                    self.ace.START(
-                        self.reqtype, {'content_id': self.path_unquoted, 'file_indexes': self.params[0]})
-                elif self.reqtype == 'torrent':
-                    self.paramsdict = dict(
-                        zip(aceclient.acemessages.AceConst.START_TORRENT, self.params))
-                    self.paramsdict['url'] = self.path_unquoted                    
-                    self.ace.START(self.reqtype, self.paramsdict)
-                logger.debug("START done")                
-
-            # Getting URL
-            self.url = self.ace.getUrl(AceConfig.videotimeout)
-            self.errorhappened = False
-
-            if shouldcreateace:
-                logger.debug("Got url " + self.url)
-                
-                # If using VLC, add this url to VLC
+                    # If using VLC, add this url to VLC
+                    if AceConfig.vlcuse:
+                        # Force ffmpeg demuxing if set in config
+                        if AceConfig.vlcforceffmpeg:
+                            self.vlcprefix = 'http/ffmpeg://'
+                        else:
+                            self.vlcprefix = ''
+
+                        # Sleeping videodelay
+                        gevent.sleep(AceConfig.videodelay)
+
+                        AceStuff.vlcpool.startBroadcast(
+                            self.vlcid, self.vlcprefix + self.url, AceConfig.vlcmux)
+                        self.stagetimer.mark('vlc')
+
+                # Building new VLC url
                 if AceConfig.vlcuse:
-                    # Force ffmpeg demuxing if set in config
-                    if AceConfig.vlcforceffmpeg:
-                        self.vlcprefix = 'http/ffmpeg://'
-                    else:
-                        self.vlcprefix = ''
-
-                    # Sleeping videodelay
-                    gevent.sleep(AceConfig.videodelay)
-
-                    AceStuff.vlcclient.startBroadcast(
-                        self.vlcid, self.vlcprefix + self.url, AceConfig.vlcmux)
-                    # Sleep a bit, because sometimes VLC doesn't open port in
-                    # time
-                    gevent.sleep(0.5)
-
-            # Building new VLC url
-            if AceConfig.vlcuse:
-                self.url = 'http://' + AceConfig.vlchost + \
-                    ':' + str(AceConfig.vlcoutport) + '/' + self.vlcid
-                logger.debug("VLC url " + self.url)
-				
-            #Buld CyberTV url     
-            ginfourl = self.path_unquoted			
-            if self.reqtype == 'pid':
-                self.ace.LOADASYNC('pid', self.vlcid) 
-            elif self.reqtype == 'torrent':
-                self.ace.LOADASYNC('torrent', ginfourl)
+                    # Broadcast runs on one of the pool instances. Joining
+                    # clients don't read from VLC and the broadcast may be
+                    # still starting, they keep the default output port then
+                    instance = AceStuff.vlcpool.getInstance(self.vlcid)
+                    if instance:
+                        self.vlcoutport = instance.out_port
+                    if shouldcreateace:
+                        self.url = AceStuff.vlcpool.outputUrl(self.vlcid)
+                        logger.debug("VLC url " + self.url)
 				
-            cybertv_url = 'http://' + AceConfig.CyberTV_globalIP + ':' + str(AceConfig.vlcoutport) + '/' + self.vlcid
-            logger.debug("CyberTV: url = " + cybertv_url)
-            gevent.sleep(0.5)
-            pidinfoa = str(self.ace.getLOADRESP())
-            pidinfo = urllib.unquote((self.ace.getLOADRESP()).encode('utf-8')).decode('utf-8');
-
-            try:
-                cybertv_addch_url = AceConfig.cybertv_add_ch + AceConfig.md5pass + '&ch_name=' + pidinfoa + '&ch_url=' + cybertv_url + '&active=' + '1'
-                cybertv_add_rez = urllib2.urlopen(cybertv_addch_url, timeout=10).read()
-                logger.debug('CyberTV: loaded add_ch: ' + pidinfo)
-            except:
-                logger.debug("CyberTV: ERROR load add_ch: " + pidinfo)
-
-			# Sending client headers to videostream
-            self.video = urllib2.Request(self.url)
-            for key in self.headers.dict:
-                self.video.add_header(key, self.headers.dict[key])
+                # Getting content info, from cache if we've seen this content
+                contentkey = self.reqtype + '/' + self.path_unquoted
+                contentinfo = AceStuff.contentcache.get(contentkey)
+                if contentinfo is None:
+                    try:
+                        contentinfo = self.ace.LOADASYNC(self.reqtype, self.path_unquoted)
+                        AceStuff.contentcache.set(contentkey, contentinfo)
+                    except aceclient.AceException as e:
+                        logger.error("Can't get content info: " + repr(e))
+                    self.stagetimer.mark('loadasync')
+
+                #Buld CyberTV url
+                cybertv_url = 'http://' + AceConfig.CyberTV_globalIP + ':' + str(self.vlcoutport) + '/' + self.vlcid
+                logger.debug("CyberTV: url = " + cybertv_url)
+                pidinfoa = aceclient.AceClient.contentName(contentinfo) or self.vlcid
+                pidinfo = urllib2.unquote(pidinfoa.encode('utf-8')).decode('utf-8')
+
+                AceStuff.cybertv.addChannel(pidinfoa.encode('utf-8'), cybertv_url, True)
+                logger.debug(u'CyberTV: add_ch queued: ' + pidinfo)
+                self.stagetimer.mark('cybertv')
+            else:
+                # Engine session runs in the owner worker
+                self.url = self.relayurl
+                self.errorhappened = False
 
-            self.video = urllib2.urlopen(self.video)
+            if shouldcreateace:
+                # Sending client headers to videostream as soon as it's
+                # readable (VLC may open port a bit later)
+                try:
+                    self.video = streamer.openWhenReady(
+                        self.url, self.headers.dict, AceConfig.videotimeout)
+                except:
+                    self.broadcaster.close()
+                    raise
+
+                videoheaders = dict(self.video.headers)
+                for key in ('connection', 'server', 'transfer-encoding', 'keep-alive'):
+                    if videoheaders.has_key(key):
+                        del videoheaders[key]
+
+                # Start reading videostream for all the clients
+                self.broadcaster.start(self.video, self.video.code, videoheaders)
+            else:
+                # Wait for the first client to connect to videostream
+                self.broadcaster.waitReady(AceConfig.videotimeout)
+            self.stagetimer.mark('upstream')
 
             # Sending videostream headers to client
             if not self.headerssent:
-                self.send_response(self.video.getcode())
-                if self.video.info().dict.has_key('connection'):
-                    del self.video.info().dict['connection']
-                if self.video.info().dict.has_key('server'):
-                    del self.video.info().dict['server']
-                if self.video.info().dict.has_key('transfer-encoding'):
-                    del self.video.info().dict['transfer-encoding']
-                if self.video.info().dict.has_key('keep-alive'):
-                    del self.video.info().dict['keep-alive']
-
-                for key in self.video.info().dict:
-                    self.send_header(key, self.video.info().dict[key])
+                self.send_response(self.broadcaster.code)
+                for key in self.broadcaster.headers:
+                    self.send_header(key, self.broadcaster.headers[key])
+                self.send_header('X-Trace-Id', self.stagetimer.id)
                 # End headers. Next goes video data
                 self.end_headers()
                 logger.debug("Headers sent")
+                self.stagetimer.mark('headers')
+            elif self.broadcaster.code != 200:
+                # Client got 200 already, error page is not a video
+                raise streamer.BroadcastException("Upstream code " + str(self.broadcaster.code))
 
             if not AceConfig.vlcuse:
                 # Sleeping videodelay
                 gevent.sleep(AceConfig.videodelay)
 
+            if self.prewarm:
+                telemetry.tracer.finish(self.stagetimer, 'prewarm')
+                # Channel stays started until the scheduler disconnects
+                self.hanggreenlet.join()
+                return
+
+            # Real data goes right after the last null packet
+            self.stopPadding()
             # Spawning proxyReadWrite greenlet
             self.proxyReadWritegreenlet = gevent.spawn(self.proxyReadWrite)
 
@@ -360,9 +612,11 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             gevent.joinall((self.proxyReadWritegreenlet, self.hanggreenlet))
             logger.debug("Greenlets joined")
 
-        except (aceclient.AceException, vlcclient.VlcException, urllib2.URLError) as e:
+        except (aceclient.AceException, vlcclient.VlcException, streamer.BroadcastException,
+                streamer.UpstreamException, urllib2.URLError) as e:
             logger.error("Exception: " + repr(e))
             self.errorhappened = True
+            telemetry.http_errors.inc(('500', e.__class__.__name__))
             self.dieWithError()
         except gevent.GreenletExit:
             # hangDetector told us about client disconnection
@@ -371,27 +625,83 @@ class HTTPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             # Unknown exception
             logger.error("Unknown exception: " + repr(e))
             self.errorhappened = True
+            telemetry.http_errors.inc(('500', 'unknown'))
             self.dieWithError()
         finally:
             logger.debug("END REQUEST")
-            AceStuff.clientcounter.delete(self.path_unquoted, self.clientip)
+            self.stopPadding()
+            # Pairs with "Accepted connection" for session lengths in the log
+            logger.info("Closed connection from " + self.clientip + " path " + self.path +
+                        " after %.1f s" % (time.time() - self.stagetimer.started))
+            # Channel start failed or client left before the first byte
+            telemetry.tracer.finish(self.stagetimer, 'error' if self.errorhappened else 'disconnected')
+            if self in telemetry.clients:
+                telemetry.clients.discard(self)
+                telemetry.clients_total.inc()
+                telemetry.bytes_out.inc(value=self.bytessent)
+            if self.streamposition is not None:
+                AceStuff.clientcounter.setPosition(self.path_unquoted, self.clientip, self.streamposition)
+            AceStuff.clientcounter.delete(self.path_unquoted, self.clientip, self.counted)
             if not self.errorhappened and not AceStuff.clientcounter.get(self.path_unquoted):
                 # If no error happened and we are the only client
                 logger.debug("Sleeping for " + str(
                     AceConfig.videodestroydelay) + " seconds")
                 gevent.sleep(AceConfig.videodestroydelay)
             if not AceStuff.clientcounter.get(self.path_unquoted):
-                logger.debug("That was the last client, destroying AceClient")
-                if AceConfig.vlcuse:
-                    try:
-                        AceStuff.vlcclient.stopBroadcast(self.vlcid)
-                    except:
-                        pass
-                self.ace.destroy()
-                AceStuff.clientcounter.deleteAce(self.path_unquoted)
+                logger.debug("That was the last client, releasing AceClient")
+                broadcaster = AceStuff.clientcounter.getBroadcaster(self.path_unquoted)
+                if broadcaster:
+                    broadcaster.close()
+                    AceStuff.clientcounter.deleteBroadcaster(self.path_unquoted)
+                if self.ace:
+                    if AceConfig.vlcuse:
+                        try:
+                            AceStuff.vlcpool.stopBroadcast(self.vlcid)
+                        except:
+                            pass
+                    # STOP and return session to the engine pool
+                    AceStuff.engines.release(self.path_unquoted, self.ace)
+                    AceStuff.clientcounter.deleteAce(self.path_unquoted)
+                    if AceStuff.worker:
+                        AceStuff.worker.release(self.path_unquoted)
+
+
+class GeventHTTPHandler(geventhttp.GeventRequestHandler, HTTPHandler):
+
+    '''
+    HTTPHandler for gevent front end. Connection stays alive after plugin
+    responses, video streams close it.
+    '''
+
+    def closeConnection(self):
+        if self.keepalive and not self.wfile.closed:
+            self.clientconnected = False
+            return
+        HTTPHandler.closeConnection(self)
+
+    def do_GET(self):
+        try:
+            splittedpath = self.path.partition('?')[0].split('/')
+            self.keepalive = splittedpath[1].lower() in AceStuff.pluginshandlers or \
+                (AceStuff.hls is not None and isHlsPath(splittedpath))
+        except IndexError:
+            self.keepalive = False
+        if not self.keepalive:
+            # Video streams end when the connection is closed
+            self.close_connection = True
+        HTTPHandler.do_GET(self)
 
 
 class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    # Share listening port with other worker processes
+    reuse_port = False
+    # Server for clients relayed from other workers
+    relay = False
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        BaseHTTPServer.HTTPServer.server_bind(self)
 
     def handle_error(self, request, client_address):
         # Do not print HTTP tracebacks
@@ -432,45 +742,121 @@ for i in pluginslist:
         AceStuff.pluginshandlers[j] = plugininstance
     AceStuff.pluginlist.append(plugininstance)
 
-server = HTTPServer((AceConfig.httphost, AceConfig.httpport), HTTPHandler)
+# Marks our own prewarming and segmenter requests, the same for all workers
+AceStuff.internaltoken = hashlib.md5(os.urandom(16)).hexdigest()
+
+# Pre-fork worker mode
+AceStuff.worker = None
+if AceConfig.workers > 1:
+    workerindex = multiworker.forkWorkers(AceConfig.workers, AceConfig.workersocket)
+    try:
+        AceStuff.worker = multiworker.WorkerClient(
+            AceConfig.workersocket, workerindex, '127.0.0.1', AceConfig.workerrelayport)
+    except multiworker.WorkerException as e:
+        print repr(e)
+        quit()
+
+# Choosing HTTP front end
+if AceConfig.httpfrontend == 'gevent':
+    ServerClass, HandlerClass = geventhttp.GeventHTTPServer, GeventHTTPHandler
+else:
+    ServerClass, HandlerClass = HTTPServer, HTTPHandler
+
+if AceStuff.worker:
+    # All workers accept clients on the same port
+    ServerClass.reuse_port = True
+
+server = ServerClass((AceConfig.httphost, AceConfig.httpport), HandlerClass)
 logger = logging.getLogger('HTTP')
 
-# Creating ClientCounter
-AceStuff.clientcounter = ClientCounter()
+if AceStuff.worker:
+    # Other workers relay channels we own from this server
+    relayserver = ServerClass(('127.0.0.1', AceStuff.worker.relayPort()), HandlerClass)
+    relayserver.relay = True
+    gevent.spawn(relayserver.serve_forever)
+
+# Creating ClientCounter (shared by all workers in worker mode)
+AceStuff.clientcounter = ClientCounter(AceStuff.worker)
+# Creating CyberTV registry notifier
+AceStuff.cybertv = cybertv.CyberTVNotifier(
+    AceConfig.cybertv_add_ch, AceConfig.cybertv_add_serv, AceConfig.md5pass, timeout=AceConfig.cybertvtimeout)
+# Creating content info cache
+AceStuff.contentcache = aceclient.ContentCache(AceConfig.contentcachesize, AceConfig.contentcachettl)
+# Preallocated buffers for channel broadcasters
+AceStuff.bufferpool = streamer.BufferPool(AceConfig.broadcastchunk)
+# Creating Ace Stream engines with pools of authenticated sessions
+AceStuff.engines = aceclient.EngineScheduler(
+    AceConfig.aceengines or ((AceConfig.acehost, AceConfig.aceport), ),
+    size=AceConfig.acepoolsize, idle_timeout=AceConfig.acepoolidle,
+    connect_timeout=AceConfig.aceconntimeout, result_timeout=AceConfig.aceresulttimeout, debug=AceConfig.debug,
+    gender=AceConfig.acesex, age=AceConfig.aceage, product_key=AceConfig.acekey, pause_delay=AceConfig.videopausedelay)
 
 if AceConfig.vlcuse:
-    # Creating VLC VLM Client
+    # Creating pool of VLC VLM Clients
     try:
-        AceStuff.vlcclient = vlcclient.VlcClient(
-            host=AceConfig.vlchost, port=AceConfig.vlcport, password=AceConfig.vlcpass,
-            out_port=AceConfig.vlcoutport, debug=AceConfig.vlcdebug)
+        AceStuff.vlcpool = vlcclient.VlcPool(
+            AceConfig.vlcinstances or ((AceConfig.vlchost, AceConfig.vlcport, AceConfig.vlcoutport), ),
+            password=AceConfig.vlcpass, balance=AceConfig.vlcbalance, debug=AceConfig.vlcdebug)
     except vlcclient.VlcException as e:
         print repr(e)
         quit()
 
+# Our own URL for local channel requests
+AceStuff.localurl = 'http://' + (AceConfig.httphost if AceConfig.httphost not in ('', '0.0.0.0') else '127.0.0.1') + \
+    ':' + str(AceConfig.httpport) + '/'
+
+# Creating channel prewarming scheduler, in the first worker only
+AceStuff.prewarmer = None
+if AceConfig.prewarmchannels and (not AceStuff.worker or AceStuff.worker.index == 0):
+    def prewarmSpeed(key):
+        ace = AceStuff.clientcounter.getAce(urllib2.unquote(key.split('/', 1)[1]))
+        return ace.getSpeedDown() if ace else 0
+
+    AceStuff.prewarmer = prewarm.PrewarmScheduler(
+        AceStuff.localurl, AceConfig.prewarmchannels,
+        bandwidth=AceConfig.prewarmbandwidth, policy=AceConfig.prewarmpolicy,
+        min_requests=AceConfig.prewarmminrequests, timeout=AceConfig.videotimeout,
+        token=AceStuff.internaltoken, speed=prewarmSpeed)
+
+# Creating HLS segmenters manager
+AceStuff.hls = None
+if AceConfig.hlsuse and AceStuff.worker:
+    # Playlist and segment requests may land on different workers
+    logger.warning("HLS is disabled with several workers")
+elif AceConfig.hlsuse:
+    AceStuff.hls = streamer.HlsManager(
+        AceStuff.localurl, {'X-Segmenter': AceStuff.internaltoken}, target=AceConfig.hlssegment,
+        window=AceConfig.hlswindow, idle=AceConfig.hlsidle, timeout=AceConfig.videotimeout)
+
+# Only the first worker registers the server in CyberTV
+cybertv_register = not AceStuff.worker or AceStuff.worker.index == 0
 
 try:
     logger.info("Server started.")
     cybertv_serv = AceConfig.CyberTV_globalIP + ':' + str(AceConfig.httpport)
-    cybertv_addserv_url = AceConfig.cybertv_add_serv + AceConfig.md5pass + '&serv_addr=' + cybertv_serv + '&serv_active=' + '1'
-    try:
-        cybertv_addserv_rez = urllib2.urlopen(cybertv_addserv_url, timeout=10).read()
-        logger.info("CyberTV:server added.")
-    except:
-        logger.debug("CyberTV: server ERROR")
+    if cybertv_register:
+        AceStuff.cybertv.addServer(cybertv_serv, True)
 
     server.serve_forever()
 except KeyboardInterrupt:
     logger.info("Stopping server...")
     server.shutdown()
     server.server_close()
-    cybertv_serv = AceConfig.CyberTV_globalIP + ':' + str(AceConfig.httpport)
-    cybertv_addserv_url = AceConfig.cybertv_add_serv + AceConfig.md5pass + '&serv_addr=' + cybertv_serv + '&serv_active=' + '0'
-    try:
-        cybertv_addserv_rez = urllib2.urlopen(cybertv_addserv_url, timeout=10).read()
-        logger.info("CyberTV:server deleted.")
-    except:
-        logger.debug("CyberTV: server ERROR")		
-   
+    if cybertv_register:
+        AceStuff.cybertv.addServer(cybertv_serv, False)
+        if AceStuff.cybertv.flush(AceConfig.cybertvtimeout):
+            logger.info("CyberTV:server deleted.")
+        else:
+            logger.debug("CyberTV: server ERROR")
+    AceStuff.cybertv.destroy()
+    if AceStuff.prewarmer:
+        AceStuff.prewarmer.destroy()
+    if AceStuff.hls:
+        AceStuff.hls.destroy()
+
+    AceStuff.engines.destroy()
+    if AceConfig.vlcuse:
+        AceStuff.vlcpool.destroy()
+
     for i in AceStuff.pluginlist:
         del i
@@ -0,0 +1,220 @@
+'''
+Fake Ace Stream engine for load testing.
+Speaks the engine side of the AceMessage dialogue (HELLOTS, AUTH, START,
+STATE/STATUS, LOADRESP) and serves a synthetic MPEG-TS stream of the given
+bitrate on its HTTP port. Prebuffering time and errors are scriptable.
+
+Usage: python fakeace.py --port 62062 --http-port 6878 --prebuffer 3 --bitrate 4000
+'''
+
+import gevent
+import gevent.server
+import argparse
+import itertools
+import json
+import logging
+import random
+import time
+from tsgen import TsGenerator
+
+
+class FakeSession(object):
+
+    '''
+    One control connection (one AceClient)
+    '''
+
+    _ids = itertools.count(1)
+
+    def __init__(self, engine, socket):
+        self.id = next(FakeSession._ids)
+        self._engine = engine
+        self._socket = socket
+        self._file = socket.makefile('rb')
+        # STATUS sender of the started content
+        self._statusgreenlet = None
+        # HTTP stream connections of this session
+        self.streams = set()
+
+    def write(self, message):
+        self._socket.sendall(message + '\r\n')
+
+    def run(self):
+        logger = logging.getLogger('FakeSession_run')
+        try:
+            while True:
+                line = self._file.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if line:
+                    self._handle(line)
+        except Exception as e:
+            logger.debug('Session ' + str(self.id) + ' closed: ' + repr(e))
+        finally:
+            self.stop()
+            self._socket.close()
+
+    def _handle(self, line):
+        options = self._engine.options
+        command = line.split(' ', 1)[0]
+        if command == 'HELLOBG':
+            self.write('HELLOTS version=3.1.16 ' + ('key=' + options.key + ' ' if options.key else '') +
+                       'http_port=' + str(options.http_port))
+        elif command == 'READY':
+            if random.random() < options.auth_error_rate:
+                self.write('NOTREADY')
+            else:
+                self.write('AUTH 1')
+        elif command == 'LOADASYNC':
+            requestid = line.split()[1]
+            self.write('LOADRESP ' + requestid + ' ' + json.dumps(
+                {'status': 1, 'infohash': '0' * 40, 'checksum': '0' * 40,
+                 'files': [['Benchmark%20channel%20' + str(self.id), 0]]}))
+        elif command == 'START':
+            self.stop()
+            self._statusgreenlet = gevent.spawn(self._start)
+        elif command == 'STOP':
+            self.stop()
+            self.write('STATE 0')
+        elif command == 'SHUTDOWN':
+            self.stop()
+            self.write('SHUTDOWN')
+        # USERDATA and others need no answer
+
+    def _start(self):
+        options = self._engine.options
+        self.write('STATE 1')
+        self.write('STATUS main:starting')
+        if random.random() < options.error_rate:
+            gevent.sleep(random.uniform(0, options.prebuffer))
+            self.write('STATUS main:err;0;Benchmark injected error')
+            return
+
+        prebuffer = max(random.gauss(options.prebuffer, options.prebuffer_jitter), 0)
+        started = time.time()
+        while time.time() - started < prebuffer:
+            progress = int((time.time() - started) * 100 / prebuffer)
+            self.write('STATUS main:prebuf;' + str(progress) + ';' + str(int(prebuffer)) +
+                       ';0;0;' + str(options.bitrate / 8) + ';0;0;12;0;0;0;0')
+            gevent.sleep(min(options.status_interval, prebuffer))
+
+        self.write('START http://' + options.host + ':' + str(options.http_port) + '/content/' +
+                   str(self.id) + '/' + str(random.random()) + ' stream=1')
+        self.write('STATE 2')
+        while True:
+            self.write('STATUS main:dl;0;0;' + str(options.bitrate / 8) + ';0;0;12;0;0;0;0')
+            gevent.sleep(options.status_interval)
+
+    def stop(self):
+        if self._statusgreenlet:
+            self._statusgreenlet.kill(block=False)
+            self._statusgreenlet = None
+        for stream in list(self.streams):
+            stream.close()
+        self.streams.clear()
+
+
+class FakeEngine(object):
+
+    def __init__(self, options):
+        self.options = options
+        # Session id -> FakeSession
+        self.sessions = dict()
+        self._control = gevent.server.StreamServer((options.host, options.port), self._handleControl)
+        self._http = gevent.server.StreamServer((options.host, options.http_port), self._handleHttp)
+
+    def start(self):
+        self._control.start()
+        self._http.start()
+
+    def serve_forever(self):
+        self.start()
+        self._http.serve_forever()
+
+    def stop(self):
+        self._control.stop()
+        self._http.stop()
+
+    def _handleControl(self, socket, address):
+        session = FakeSession(self, socket)
+        self.sessions[session.id] = session
+        try:
+            session.run()
+        finally:
+            del self.sessions[session.id]
+
+    def _handleHttp(self, socket, address):
+        logger = logging.getLogger('FakeEngine_handleHttp')
+        request = socket.makefile('rb')
+        line = request.readline()
+        # Skipping request headers
+        while request.readline().strip():
+            pass
+        try:
+            path = line.split()[1].split('/')
+            session = self.sessions[int(path[2])]
+        except (IndexError, ValueError, KeyError):
+            socket.sendall('HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            socket.close()
+            return
+
+        session.streams.add(socket)
+        options = self.options
+        # Stream is cut at a random moment of its life
+        deadline = time.time() + random.expovariate(1.0 / options.drop_after) \
+            if random.random() < options.drop_rate else None
+        try:
+            socket.sendall('HTTP/1.1 200 OK\r\nContent-Type: video/mpeg\r\nConnection: close\r\n\r\n')
+            generator = TsGenerator(options.bitrate, options.gop)
+            # Paced in chunks of TS packets
+            chunks = max(int(options.gop / options.interval), 1)
+            sent = 0
+            started = time.time()
+            while deadline is None or time.time() < deadline:
+                gop = generator.nextGop()
+                step = len(gop) / chunks + 1
+                for i in xrange(0, len(gop), step):
+                    socket.sendall(gop[i:i + step])
+                    sent += min(step, len(gop) - i)
+                    delay = started + sent * 8 / (options.bitrate * 1000.0) - time.time()
+                    if delay > 0:
+                        gevent.sleep(delay)
+            logger.debug('Dropping stream of session ' + str(session.id))
+        except Exception as e:
+            logger.debug('Stream of session ' + str(session.id) + ' closed: ' + repr(e))
+        finally:
+            session.streams.discard(socket)
+            socket.close()
+
+
+def parseArgs(args=None):
+    parser = argparse.ArgumentParser(description='Fake Ace Stream engine')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=62062, help='control (API) port')
+    parser.add_argument('--http-port', type=int, default=6878, help='stream port')
+    parser.add_argument('--key', default=None, help='request key sent in HELLOTS, proxy needs acekey then')
+    parser.add_argument('--prebuffer', type=float, default=3.0, help='mean prebuffering time, seconds')
+    parser.add_argument('--prebuffer-jitter', type=float, default=0.5, help='prebuffering time deviation')
+    parser.add_argument('--bitrate', type=int, default=4000, help='stream bitrate, kbit/s')
+    parser.add_argument('--gop', type=float, default=1.0, help='keyframe interval, seconds')
+    parser.add_argument('--interval', type=float, default=0.1, help='stream write interval, seconds')
+    parser.add_argument('--status-interval', type=float, default=1.0, help='STATUS interval, seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of STARTs ending with main:err')
+    parser.add_argument('--auth-error-rate', type=float, default=0.0, help='share of READYs answered NOTREADY')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='share of streams cut by the engine')
+    parser.add_argument('--drop-after', type=float, default=30.0, help='mean stream life when cut, seconds')
+    parser.add_argument('--debug', action='store_true')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    options = parseArgs()
+    logging.basicConfig(level=logging.DEBUG if options.debug else logging.INFO,
+                        format='%(asctime)s %(name)-24s %(levelname)-8s %(message)s')
+    logging.getLogger('FakeEngine').info('Fake engine on ' + options.host + ':' + str(options.port) +
+                                         ', stream port ' + str(options.http_port))
+    try:
+        FakeEngine(options).serve_forever()
+    except KeyboardInterrupt:
+        pass
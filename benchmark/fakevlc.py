@@ -0,0 +1,170 @@
+'''
+Fake VLC VLM telnet interface for load testing.
+Answers the commands VlcClient sends with the responses VlcMessage.response
+expects and serves every broadcast on its HTTP output port by relaying
+the broadcast input, like VLC does with #http{mux=ts}.
+
+Usage: python fakevlc.py --port 4212 --out-port 38083 --password admin
+'''
+
+import gevent
+import gevent.server
+import gevent.socket
+import argparse
+import logging
+import random
+import os
+import re
+import sys
+import urlparse
+
+# Only the messages, without the client and its dependencies
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vlcclient'))
+from vlcmessages import VlcMessage
+
+# VLM commands VlcClient sends
+NEW = re.compile(r'^new "(?P<name>[^"]+)" broadcast input "(?P<input>[^"]+)" output (?P<output>\S+) enabled$')
+DEL = re.compile(r'^del "(?P<name>[^"]+)"$')
+CONTROL = re.compile(r'^control "(?P<name>[^"]+)" (?P<command>\w+)$')
+
+
+class FakeVlc(object):
+
+    def __init__(self, options):
+        self.options = options
+        # Broadcast name -> input URL
+        self.broadcasts = dict()
+        self._telnet = gevent.server.StreamServer((options.host, options.port), self._handleTelnet)
+        self._http = gevent.server.StreamServer((options.host, options.out_port), self._handleHttp)
+
+    def start(self):
+        self._telnet.start()
+        self._http.start()
+
+    def serve_forever(self):
+        self.start()
+        self._http.serve_forever()
+
+    def stop(self):
+        self._telnet.stop()
+        self._http.stop()
+
+    def _handleTelnet(self, socket, address):
+        logger = logging.getLogger('FakeVlc_handleTelnet')
+        request = socket.makefile('rb')
+        try:
+            socket.sendall('VLC media player 2.2.8 Weatherwax\r\nPassword: ')
+            if request.readline().strip() != self.options.password:
+                socket.sendall('\r\n' + VlcMessage.response.WRONGPASS + '\r\n')
+                return
+            socket.sendall('\r\n' + VlcMessage.response.AUTHOK + '\r\n> ')
+            while True:
+                line = request.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                if line == VlcMessage.request.SHUTDOWN:
+                    socket.sendall(VlcMessage.response.SHUTDOWN + '\r\n')
+                    break
+                if self.options.delay:
+                    gevent.sleep(self.options.delay)
+                socket.sendall(self._command(line) + '\r\n> ')
+        except Exception as e:
+            logger.debug('Telnet connection closed: ' + repr(e))
+        finally:
+            socket.close()
+
+    def _command(self, line):
+        logger = logging.getLogger('FakeVlc_command')
+        logger.debug(line)
+        if random.random() < self.options.error_rate:
+            return VlcMessage.response.SYNTAXERR
+        match = NEW.match(line)
+        if match:
+            if match.group('name') in self.broadcasts:
+                return VlcMessage.response.BROADCASTEXISTS
+            # Demuxer prefix, e.g. http/ffmpeg://
+            url = match.group('input')
+            if '/' in url.split('://')[0]:
+                url = 'http://' + url.split('://', 1)[1]
+            self.broadcasts[match.group('name')] = url
+            return VlcMessage.response.STARTOK
+        match = DEL.match(line)
+        if match:
+            if self.broadcasts.pop(match.group('name'), None) is None:
+                return VlcMessage.response.STOPERR
+            return VlcMessage.response.STOPOK
+        match = CONTROL.match(line)
+        if match:
+            if match.group('name') not in self.broadcasts:
+                return VlcMessage.response.STOPERR
+            return VlcMessage.response.CONTROLOK
+        return VlcMessage.response.SYNTAXERR
+
+    def _handleHttp(self, socket, address):
+        logger = logging.getLogger('FakeVlc_handleHttp')
+        request = socket.makefile('rb')
+        line = request.readline()
+        while request.readline().strip():
+            pass
+        try:
+            url = self.broadcasts[line.split()[1].strip('/')]
+        except (IndexError, KeyError):
+            socket.sendall('HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            socket.close()
+            return
+
+        upstream = None
+        try:
+            url = urlparse.urlsplit(url)
+            upstream = gevent.socket.create_connection((url.hostname, url.port or 80), self.options.timeout)
+            upstream.sendall('GET ' + (url.path or '/') + (('?' + url.query) if url.query else '') +
+                             ' HTTP/1.0\r\nHost: ' + url.netloc + '\r\n\r\n')
+            # Unbuffered, the stream is read from the socket after headers
+            response = upstream.makefile('rb', 0)
+            if response.readline().split()[1] != '200':
+                raise Exception('Input is not available')
+            while response.readline().strip():
+                pass
+            # Output headers like VLC http access output
+            socket.sendall('HTTP/1.0 200 OK\r\nContent-type: application/octet-stream\r\n'
+                           'Cache-Control: no-cache\r\n\r\n')
+            while True:
+                data = upstream.recv(self.options.readsize)
+                if not data:
+                    break
+                socket.sendall(data)
+        except Exception as e:
+            logger.debug('Output closed: ' + repr(e))
+        finally:
+            if upstream:
+                upstream.close()
+            socket.close()
+
+
+def parseArgs(args=None):
+    parser = argparse.ArgumentParser(description='Fake VLC VLM telnet interface')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4212, help='telnet port')
+    parser.add_argument('--out-port', type=int, default=38083, help='broadcast HTTP output port')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--delay', type=float, default=0.0, help='VLM command response delay, seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of commands failing')
+    parser.add_argument('--readsize', type=int, default=188 * 64)
+    parser.add_argument('--timeout', type=float, default=10.0, help='input connection timeout')
+    parser.add_argument('--debug', action='store_true')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    options = parseArgs()
+    logging.basicConfig(level=logging.DEBUG if options.debug else logging.INFO,
+                        format='%(asctime)s %(name)-24s %(levelname)-8s %(message)s')
+    logging.getLogger('FakeVlc').info('Fake VLC on ' + options.host + ':' + str(options.port) +
+                                      ', output port ' + str(options.out_port))
+    try:
+        FakeVlc(options).serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,104 @@
+'''
+Benchmark of the AceClient receive loop.
+A local engine stand-in sends a burst of STATE/STATUS messages like the
+engine does for active sessions, the real AceClient parses them. Reports
+messages per second and CPU time per message. Works on older revisions
+too, run it on both and compare the JSON results.
+
+Usage: python linebench.py --sessions 200 --messages 2000 --output linebench.json
+'''
+
+import gevent.monkey
+# Older AceClient revisions use telnetlib on blocking sockets
+gevent.monkey.patch_all()
+import gevent
+import gevent.event
+import gevent.server
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from loadgen import percentiles, revision
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from aceclient import AceClient
+
+
+def messages(count):
+    '''
+    STATUS of downloading sessions with some prebuffering and state changes
+    '''
+    lines = list()
+    for i in xrange(count):
+        if i % 50 == 0:
+            lines.append('STATE ' + str(2 + i / 50 % 2))
+        elif i % 10 == 0:
+            lines.append('STATUS main:prebuf;' + str(i % 100) + ';5;0;0;' + str(300 + i % 7) +
+                         ';0;12;25;0;0;0;0|main:dl;0;0;300;0;12;25;0;0;0;0')
+        else:
+            lines.append('STATUS main:dl;0;0;' + str(400 + i % 13) + ';0;35;28;0;524288;0;1048576')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def run(options):
+    data = messages(options.messages)
+    # Session connections closed by the client after SHUTDOWN
+    done = list()
+
+    def engine(socket, address):
+        finished = gevent.event.Event()
+        done.append(finished)
+        socket.sendall(data + 'SHUTDOWN\r\n')
+        while socket.recv(4096):
+            pass
+        socket.close()
+        finished.set()
+
+    server = gevent.server.StreamServer(('127.0.0.1', 0), engine)
+    server.start()
+    # Connect first, so only message parsing is measured
+    clients = list()
+    started = time.time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    for i in xrange(options.sessions):
+        clients.append(AceClient('127.0.0.1', server.server_port))
+    gevent.sleep(0.1)
+    for finished in done:
+        finished.wait()
+    elapsed = time.time() - started
+    cpu = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = cpu.ru_utime + cpu.ru_stime - usage.ru_utime - usage.ru_stime
+    server.stop()
+
+    total = options.sessions * (options.messages + 1)
+    return {'revision': options.label or revision(),
+            'params': {'sessions': options.sessions, 'messages': options.messages},
+            'messages': total, 'seconds': round(elapsed, 3), 'cpu_seconds': round(cpu, 3),
+            'messages_per_second': int(total / elapsed),
+            'cpu_us_per_message': round(cpu * 1000000 / total, 3)}
+
+
+def parseArgs(args=None):
+    parser = argparse.ArgumentParser(description='AceClient receive loop benchmark')
+    parser.add_argument('--sessions', type=int, default=200, help='concurrent engine sessions')
+    parser.add_argument('--messages', type=int, default=2000, help='messages per session')
+    parser.add_argument('--rounds', type=int, default=3, help='rounds, the best one is reported')
+    parser.add_argument('--label', default=None, help='result label, git revision by default')
+    parser.add_argument('--output', default=None, help='JSON results file')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    options = parseArgs()
+    logging.basicConfig(level=logging.CRITICAL)
+    results = [run(options) for i in xrange(options.rounds)]
+    result = min(results, key=lambda result: result['cpu_seconds'])
+    result['cpu_us_per_message_rounds'] = percentiles([r['cpu_us_per_message'] for r in results])
+    body = json.dumps(result, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(body + '\n')
+    print body
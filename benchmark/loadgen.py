@@ -0,0 +1,301 @@
+'''
+Load generator for AceProxy.
+Opens N concurrent /pid/ clients spread over M channels, measures time to
+first byte, time to the first video packet and sustained throughput,
+samples CPU and memory of the proxy processes and saves the results as
+JSON for comparing revisions.
+
+Usage: python loadgen.py --url http://127.0.0.1:38082 --clients 100 --channels 10 \
+           --duration 60 --pid <proxy pid> --output results.json
+       python loadgen.py --compare old.json new.json
+'''
+
+import gevent
+import gevent.socket
+import argparse
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import urlparse
+
+
+def percentiles(values):
+    '''
+    Nearest rank percentiles, like the proxy trace percentiles
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    count = len(values)
+    result = {'count': count, 'min': round(values[0], 6), 'max': round(values[-1], 6),
+              'mean': round(sum(values) / count, 6)}
+    for p in (50, 90, 99):
+        result['p' + str(p)] = round(values[min(count * p / 100, count - 1)], 6)
+    return result
+
+
+class ProcessSampler(object):
+
+    '''
+    CPU time and RSS of a process and its children (proxy workers) from /proc
+    '''
+
+    def __init__(self, pid, interval=1.0):
+        self._pid = pid
+        self._interval = interval
+        self._ticks = float(os.sysconf('SC_CLK_TCK'))
+        self.baseline = None
+        self.peak = 0
+        self.cpustart = None
+        self.cpu = None
+        self._greenlet = None
+
+    def _pids(self):
+        pids = [self._pid]
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    # ppid is the 2nd field after the command name
+                    if int(open('/proc/' + entry + '/stat').read().rsplit(')', 1)[1].split()[1]) == self._pid:
+                        pids.append(int(entry))
+                except (IOError, IndexError, ValueError):
+                    pass
+        return pids
+
+    def sample(self):
+        '''
+        (CPU seconds, RSS bytes) of the process tree
+        '''
+        cpu = 0
+        rss = 0
+        for pid in self._pids():
+            try:
+                fields = open('/proc/' + str(pid) + '/stat').read().rsplit(')', 1)[1].split()
+                # utime and stime
+                cpu += (int(fields[11]) + int(fields[12])) / self._ticks
+                rss += int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+            except (IOError, IndexError, ValueError):
+                pass
+        return cpu, rss
+
+    def start(self):
+        self.cpustart, self.baseline = self.sample()
+        self._greenlet = gevent.spawn(self._run)
+
+    def _run(self):
+        while True:
+            gevent.sleep(self._interval)
+            self.cpu, rss = self.sample()
+            self.peak = max(self.peak, rss)
+
+    def stop(self):
+        self._greenlet.kill()
+        self.cpu, rss = self.sample()
+        self.peak = max(self.peak, rss)
+
+
+class LoadClient(object):
+
+    '''
+    One streaming client reading until the test ends
+    '''
+
+    def __init__(self, host, port, path, timeout):
+        self._host = host
+        self._port = port
+        self._path = path
+        self._timeout = timeout
+        self.ttfb = None
+        # Time to the first video packet, proxy may send null packets
+        # while the channel starts
+        self.ttfv = None
+        # First and last byte times
+        self.firstbyte = None
+        self.finished = None
+        self.bytes = 0
+        self.error = None
+        self.code = None
+
+    def run(self, deadline):
+        sock = None
+        started = time.time()
+        try:
+            sock = gevent.socket.create_connection((self._host, self._port), self._timeout)
+            sock.settimeout(self._timeout)
+            sock.sendall('GET ' + self._path + ' HTTP/1.1\r\nHost: ' + self._host + ':' + str(self._port) +
+                         '\r\nUser-Agent: AceProxy loadgen\r\nConnection: close\r\n\r\n')
+            data = ''
+            while '\r\n\r\n' not in data:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    raise EOFError('Connection closed before headers')
+                data += chunk
+            headers, data = data.split('\r\n\r\n', 1)
+            self.code = int(headers.split()[1])
+            if self.code != 200:
+                self.error = 'http_' + str(self.code)
+                return
+            while not data:
+                data = sock.recv(65536)
+                if not data:
+                    raise EOFError('Connection closed before the first byte')
+            self.firstbyte = time.time()
+            self.ttfb = self.firstbyte - started
+            self.bytes = 0
+            while True:
+                if self.ttfv is None and self.isVideo(data):
+                    self.ttfv = time.time() - started
+                self.bytes += len(data)
+                if time.time() >= deadline:
+                    break
+                data = sock.recv(65536)
+                if not data:
+                    self.error = 'closed'
+                    break
+        except gevent.socket.timeout:
+            self.error = 'timeout'
+        except Exception as e:
+            self.error = e.__class__.__name__
+        finally:
+            self.finished = time.time()
+            if sock:
+                sock.close()
+
+    @staticmethod
+    def isVideo(data):
+        '''
+        data has a TS packet which is not a null packet (PID 0x1FFF).
+        Null packets are 0xFF after the header and chunked transfer sizes
+        are lowercase hex, so every sync byte in padding is a packet start.
+        '''
+        i = data.find('\x47')
+        while i != -1 and i + 2 < len(data):
+            if (ord(data[i + 1]) & 0x1F, data[i + 2]) != (0x1F, '\xff'):
+                return True
+            i = data.find('\x47', i + 1)
+        return False
+
+
+def contentIds(options):
+    if options.ids:
+        ids = [line.strip() for line in open(options.ids) if line.strip()]
+    else:
+        # Any id works with the fake engine
+        ids = [hashlib.sha1('aceproxy-benchmark-' + str(i)).hexdigest() for i in xrange(options.channels)]
+    return ids[:options.channels]
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(options):
+    logger = logging.getLogger('loadgen')
+    url = urlparse.urlsplit(options.url)
+    ids = contentIds(options)
+    sampler = ProcessSampler(options.pid) if options.pid else None
+
+    clients = [LoadClient(url.hostname, url.port or 80, '/pid/' + ids[i % len(ids)] + '/stream.mp4',
+                          options.timeout) for i in xrange(options.clients)]
+    if sampler:
+        sampler.start()
+    started = time.time()
+    deadline = started + options.ramp + options.duration
+    greenlets = list()
+    for i, client in enumerate(clients):
+        # Clients are started evenly during the ramp up
+        greenlets.append(gevent.spawn_later(options.ramp * i / max(len(clients), 1), client.run, deadline))
+
+    # Sustained throughput is measured after all clients are started
+    gevent.sleep(options.ramp)
+    logger.info(str(len(clients)) + ' clients started')
+    rampbytes = sum(client.bytes for client in clients)
+    rampcpu = sampler.sample()[0] if sampler else None
+    steadystart = time.time()
+    gevent.joinall(greenlets, timeout=max(deadline - time.time(), 0) + options.timeout)
+    steady = max(min(time.time(), deadline) - steadystart, 0.001)
+    steadybytes = sum(client.bytes for client in clients) - rampbytes
+    if sampler:
+        sampler.stop()
+
+    ok = [client for client in clients if client.ttfb is not None]
+    errors = dict()
+    for client in clients:
+        if client.error:
+            errors[client.error] = errors.get(client.error, 0) + 1
+    mbps = steadybytes * 8 / steady / 1000000
+    result = {
+        'revision': options.label or revision(),
+        'started': started,
+        'params': {'url': options.url, 'clients': options.clients, 'channels': len(ids),
+                   'ramp': options.ramp, 'duration': options.duration},
+        'clients': {'total': len(clients), 'started': len(ok), 'errors': errors},
+        'ttfb': percentiles([client.ttfb for client in ok]),
+        'ttfv': percentiles([client.ttfv for client in ok if client.ttfv is not None]),
+        'throughput': {'bytes': steadybytes, 'seconds': round(steady, 3), 'mbps': round(mbps, 3),
+                       'client_mbps': percentiles([client.bytes * 8 / max(client.finished - client.firstbyte, 0.001) /
+                                                   1000000 for client in ok])},
+    }
+    if sampler:
+        cpu = (sampler.cpu - rampcpu) / steady
+        result['process'] = {'cpu_seconds': round(sampler.cpu - sampler.cpustart, 3),
+                             'cpu_percent': round(cpu * 100, 2),
+                             'cpu_percent_per_mbps': round(cpu * 100 / mbps, 4) if mbps else None,
+                             'rss_baseline': sampler.baseline, 'rss_peak': sampler.peak,
+                             'rss_per_client': (sampler.peak - sampler.baseline) / len(ok) if ok else None}
+    return result
+
+
+# Metrics compared between results
+COMPARED = (('ttfb', 'p50'), ('ttfb', 'p90'), ('ttfb', 'p99'), ('ttfv', 'p50'), ('ttfv', 'p90'),
+            ('ttfv', 'p99'), ('throughput', 'mbps'),
+            ('process', 'cpu_percent_per_mbps'), ('process', 'rss_per_client'))
+
+
+def compare(old, new):
+    lines = ['%-36s %14s %14s %9s' % ('metric (' + str(old.get('revision')) + ' -> ' +
+                                      str(new.get('revision')) + ')', 'old', 'new', 'change')]
+    for section, key in COMPARED:
+        a = (old.get(section) or {}).get(key)
+        b = (new.get(section) or {}).get(key)
+        change = '%+.1f%%' % ((b - a) * 100.0 / a) if a and b is not None else '-'
+        lines.append('%-36s %14s %14s %9s' % (section + '.' + key, a, b, change))
+    return '\n'.join(lines)
+
+
+def parseArgs(args=None):
+    parser = argparse.ArgumentParser(description='AceProxy load generator')
+    parser.add_argument('--url', default='http://127.0.0.1:38082', help='proxy URL')
+    parser.add_argument('--clients', type=int, default=50, help='concurrent clients')
+    parser.add_argument('--channels', type=int, default=5, help='channels the clients are spread over')
+    parser.add_argument('--ids', default=None, help='file with content ids, one per line')
+    parser.add_argument('--ramp', type=float, default=10.0, help='ramp up time, seconds')
+    parser.add_argument('--duration', type=float, default=60.0, help='steady state time, seconds')
+    parser.add_argument('--timeout', type=float, default=60.0, help='client socket timeout, seconds')
+    parser.add_argument('--pid', type=int, default=None, help='proxy (master) process id for CPU and memory')
+    parser.add_argument('--label', default=None, help='result label, git revision by default')
+    parser.add_argument('--output', default=None, help='JSON results file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two results files')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    options = parseArgs()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)-10s %(levelname)-8s %(message)s')
+    if options.compare:
+        print compare(json.load(open(options.compare[0])), json.load(open(options.compare[1])))
+        sys.exit(0)
+    result = run(options)
+    body = json.dumps(result, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(body + '\n')
+    print body
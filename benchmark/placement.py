@@ -0,0 +1,102 @@
+'''
+Engine placement check for EngineScheduler.
+Starts two fake engines in this process and walks through the scheduling
+cases: channels go to the engine with fewer sessions, a released session
+frees its engine, a dead engine is skipped, and it's used again after
+the retry interval. Exits with status 1 if a channel lands on a wrong
+engine.
+
+Usage: python placement.py --ports 62162 62163 --http-ports 6978 6979
+'''
+
+import gevent.monkey
+gevent.monkey.patch_all()
+import gevent
+import argparse
+import logging
+import os
+import sys
+import fakeace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from aceclient import EngineScheduler, AceException
+
+
+def run(options):
+    logger = logging.getLogger('placement')
+    engines = list()
+    for port, httpport in zip(options.ports, options.http_ports):
+        engine = fakeace.FakeEngine(fakeace.parseArgs(['--port', str(port), '--http-port', str(httpport)]))
+        engine.start()
+        engines.append(engine)
+    names = ['127.0.0.1:' + str(port) for port in options.ports]
+    scheduler = EngineScheduler([('127.0.0.1', port) for port in options.ports],
+                                retry_interval=options.retry_interval, size=0,
+                                connect_timeout=2, result_timeout=5)
+    # Channel -> session
+    sessions = dict()
+    failures = list()
+
+    def place(channel, expected):
+        try:
+            sessions[channel] = scheduler.get(channel)
+            engine = scheduler._pinned[channel].name()
+        except AceException as e:
+            engine = repr(e)
+        result = 'ok' if engine == names[expected] else 'WRONG'
+        logger.info(channel + ' -> ' + engine + ', expected ' + names[expected] + ': ' + result)
+        if result != 'ok':
+            failures.append(channel)
+
+    def release(channel):
+        scheduler.release(channel, sessions.pop(channel))
+        logger.info(channel + ' released')
+
+    try:
+        logger.info('Least loaded engine')
+        place('channel1', 0)
+        place('channel2', 1)
+        place('channel3', 0)
+        place('channel4', 1)
+        release('channel3')
+        place('channel5', 0)
+
+        logger.info('Engine ' + names[0] + ' goes down')
+        engines[0].stop()
+        place('channel6', 1)
+        # Not tried again until the retry interval passes
+        place('channel7', 1)
+
+        logger.info('Engine ' + names[0] + ' is back')
+        engines[0] = fakeace.FakeEngine(engines[0].options)
+        engines[0].start()
+        place('channel8', 1)
+        gevent.sleep(options.retry_interval)
+        # Fewer sessions there after the failover
+        place('channel9', 0)
+
+        for stats in scheduler.stats():
+            logger.info('Engine stats ' + repr(stats))
+    finally:
+        for channel in list(sessions):
+            release(channel)
+        scheduler.destroy()
+        for engine in engines:
+            engine.stop()
+    return not failures
+
+
+def parseArgs(args=None):
+    parser = argparse.ArgumentParser(description='EngineScheduler placement check with two fake engines')
+    parser.add_argument('--ports', type=int, nargs=2, default=[62162, 62163], help='engine control ports')
+    parser.add_argument('--http-ports', type=int, nargs=2, default=[6978, 6979], help='engine stream ports')
+    parser.add_argument('--retry-interval', type=float, default=2.0, help='dead engine retry interval, seconds')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    options = parseArgs()
+    # Engine failures are logged as errors, the rest is quiet
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s %(name)-10s %(levelname)-8s %(message)s')
+    logging.getLogger('placement').setLevel(logging.INFO)
+    sys.exit(0 if run(options) else 1)
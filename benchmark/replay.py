@@ -0,0 +1,285 @@
+'''
+Replay of real traffic from acehttp.log.
+Viewer sessions are rebuilt from "Accepted connection" and "Closed
+connection" lines, profiled (concurrent viewers per channel, session
+lengths, zap bursts) and replayed against a proxy at 1x or accelerated
+speed, e.g. with fakeace.py and fakevlc.py behind it.
+
+Usage: python replay.py acehttp.log --profile
+       python replay.py acehttp.log.1 acehttp.log --from 19:00 --to 23:00 --speed 10 \
+           --url http://127.0.0.1:38082 --pid <proxy pid> --output replay.json
+'''
+
+import gevent
+import argparse
+import datetime
+import json
+import logging
+import re
+import sys
+import time
+from loadgen import LoadClient, ProcessSampler, percentiles, revision, compare
+
+# acehttp.log lines, default AceProxy log format
+TIMESTAMP = r'^(?P<time>\d\d\.\d\d\.\d{4} \d\d:\d\d:\d\d) \w+ \S+: '
+ACCEPTED = re.compile(TIMESTAMP + r'Accepted connection from (?P<ip>\S+) path (?P<path>\S+)')
+CLOSED = re.compile(TIMESTAMP + r'Closed connection from (?P<ip>\S+) path (?P<path>\S+) after (?P<after>[\d.]+) s')
+
+
+class Session(object):
+    __slots__ = ('start', 'ip', 'path', 'duration', 'stream')
+
+    def __init__(self, start, ip, path):
+        self.start = start
+        self.ip = ip
+        self.path = path
+        self.duration = None
+        # Video stream, not a playlist, plugin or HLS request
+        splittedpath = path.split('?')[0].split('/')
+        self.stream = len(splittedpath) > 2 and splittedpath[1].lower() in ('pid', 'torrent') and \
+            not (len(splittedpath) > 3 and splittedpath[3] in ('index.m3u8', 'hls'))
+
+    def channel(self):
+        return '/'.join(self.path.split('?')[0].split('/')[1:3])
+
+
+def parseTime(value):
+    return time.mktime(time.strptime(value, '%d.%m.%Y %H:%M:%S'))
+
+
+def parseLogs(files, defaultlength=600):
+    '''
+    Sessions from the log files, oldest first. Logs written before closing
+    lines were added end sessions by the next request of the same client
+    (a zap), or after defaultlength.
+    '''
+    sessions = list()
+    # (ip, path) -> sessions without closing line yet, oldest first
+    opened = dict()
+    # ip -> last streaming session
+    lastbyip = dict()
+    end = None
+    for name in files:
+        for line in open(name):
+            match = ACCEPTED.match(line)
+            if match:
+                session = Session(parseTime(match.group('time')), match.group('ip'), match.group('path'))
+                sessions.append(session)
+                if not session.stream:
+                    session.duration = 0.0
+                    continue
+                opened.setdefault((session.ip, session.path), list()).append(session)
+                previous = lastbyip.get(session.ip)
+                if previous and previous.duration is None:
+                    previous.duration = -(session.start - previous.start)
+                lastbyip[session.ip] = session
+                end = session.start
+                continue
+            match = CLOSED.match(line)
+            if match:
+                pending = opened.get((match.group('ip'), match.group('path')))
+                if pending:
+                    # Closing line wins over zap guess
+                    pending.pop(0).duration = float(match.group('after'))
+                end = parseTime(match.group('time'))
+
+    for session in sessions:
+        if session.duration is None:
+            session.duration = min(max((end or session.start) - session.start, 0), defaultlength)
+        elif session.duration < 0:
+            # Ended by the next request of the same client
+            session.duration = -session.duration
+    sessions.sort(key=lambda session: session.start)
+    return sessions
+
+
+def inWindow(session, start, stop):
+    '''
+    Session starts between HH:MM start and stop (may wrap midnight)
+    '''
+    if not start and not stop:
+        return True
+    clock = time.strftime('%H:%M', time.localtime(session.start))
+    start = start or '00:00'
+    stop = stop or '24:00'
+    if start <= stop:
+        return start <= clock < stop
+    return clock >= start or clock < stop
+
+
+def profile(sessions, zap=10.0, burstwindow=60.0):
+    '''
+    Traffic shape of the sessions
+    '''
+    streams = [session for session in sessions if session.stream]
+    if not streams:
+        return {'sessions': 0, 'requests': len(sessions)}
+
+    # Concurrent viewers, total and per channel
+    events = list()
+    for session in streams:
+        events.append((session.start, 1, session.channel()))
+        events.append((session.start + session.duration, -1, session.channel()))
+    events.sort()
+    viewers = 0
+    peak = (0, None)
+    channels = dict()
+    channelpeaks = dict()
+    activepeak = 0
+    for moment, change, channel in events:
+        viewers += change
+        channels[channel] = channels.get(channel, 0) + change
+        if channels[channel] > channelpeaks.get(channel, 0):
+            channelpeaks[channel] = channels[channel]
+        if not channels[channel]:
+            del channels[channel]
+        activepeak = max(activepeak, len(channels))
+        if viewers > peak[0]:
+            peak = (viewers, moment)
+
+    # Arrivals in a sliding window
+    burst = (0, None)
+    first = 0
+    for i, session in enumerate(streams):
+        while session.start - streams[first].start >= burstwindow:
+            first += 1
+        if i - first + 1 > burst[0]:
+            burst = (i - first + 1, streams[first].start)
+
+    hours = dict()
+    for session in streams:
+        hour = time.strftime('%H', time.localtime(session.start))
+        hours[hour] = hours.get(hour, 0) + 1
+
+    def clock(moment):
+        return datetime.datetime.fromtimestamp(moment).strftime('%Y-%m-%d %H:%M:%S') if moment else None
+
+    return {
+        'from': clock(streams[0].start), 'to': clock(streams[-1].start),
+        'sessions': len(streams), 'requests': len(sessions) - len(streams),
+        'clients': len(set(session.ip for session in streams)),
+        'channels': len(set(session.channel() for session in streams)),
+        'session_seconds': percentiles([session.duration for session in streams]),
+        'zap_share': round(sum(1 for session in streams if session.duration < zap) / float(len(streams)), 4),
+        'peak_viewers': peak[0], 'peak_viewers_at': clock(peak[1]),
+        'peak_active_channels': activepeak,
+        'peak_channel_viewers': dict(sorted(channelpeaks.items(), key=lambda item: item[1], reverse=True)[:10]),
+        'burst_arrivals': burst[0], 'burst_window': burstwindow, 'burst_at': clock(burst[1]),
+        'arrivals_by_hour': hours,
+    }
+
+
+def replay(sessions, options):
+    '''
+    Start every session at its time, scaled by speed
+    '''
+    logger = logging.getLogger('replay')
+    host, _, port = options.url.split('://', 1)[-1].rstrip('/').partition(':')
+    port = int(port or 80)
+    sampler = ProcessSampler(options.pid) if options.pid else None
+    if sampler:
+        sampler.start()
+
+    clients = list()
+    greenlets = list()
+    first = sessions[0].start
+    started = time.time()
+    for session in sessions:
+        length = min(session.duration, options.max_session) / options.speed
+        client = LoadClient(host, port, session.path, options.timeout)
+        client.session = session
+        clients.append(client)
+        delay = (session.start - first) / options.speed
+        # Deadline is set when the client starts
+        greenlets.append(gevent.spawn_later(delay, lambda client=client, length=length:
+                                            client.run(time.time() + length)))
+    logger.info('Replaying ' + str(len(sessions)) + ' sessions over ' +
+                str(int((sessions[-1].start - first) / options.speed)) + ' s')
+
+    # Concurrently streaming clients
+    running = [0]
+
+    def monitor():
+        while True:
+            gevent.sleep(1)
+            running[0] = max(running[0], sum(1 for client in clients
+                                             if client.firstbyte and not client.finished))
+    monitorgreenlet = gevent.spawn(monitor)
+    gevent.joinall(greenlets)
+    monitorgreenlet.kill()
+    elapsed = time.time() - started
+    if sampler:
+        sampler.stop()
+
+    streams = [client for client in clients if client.session.stream]
+    ok = [client for client in streams if client.ttfb is not None]
+    errors = dict()
+    for client in clients:
+        if client.error and client.error != 'closed':
+            errors[client.error] = errors.get(client.error, 0) + 1
+    totalbytes = sum(client.bytes for client in streams)
+    mbps = totalbytes * 8 / elapsed / 1000000
+    result = {
+        'revision': options.label or revision(),
+        'started': started,
+        'params': {'logs': options.logs, 'from': options.start, 'to': options.stop, 'speed': options.speed,
+                   'url': options.url, 'max_session': options.max_session},
+        'profile': profile(sessions, options.zap, options.burst_window),
+        'clients': {'total': len(streams), 'started': len(ok), 'errors': errors,
+                    'requests': len(clients) - len(streams), 'peak_streaming': running[0]},
+        'ttfb': percentiles([client.ttfb for client in ok]),
+        'ttfv': percentiles([client.ttfv for client in ok if client.ttfv is not None]),
+        'throughput': {'bytes': totalbytes, 'seconds': round(elapsed, 3), 'mbps': round(mbps, 3)},
+    }
+    if sampler:
+        cpu = (sampler.cpu - sampler.cpustart) / elapsed
+        result['process'] = {'cpu_seconds': round(sampler.cpu - sampler.cpustart, 3),
+                             'cpu_percent': round(cpu * 100, 2),
+                             'cpu_percent_per_mbps': round(cpu * 100 / mbps, 4) if mbps else None,
+                             'rss_baseline': sampler.baseline, 'rss_peak': sampler.peak,
+                             'rss_per_client': (sampler.peak - sampler.baseline) / running[0]
+                             if running[0] else None}
+    return result
+
+
+def parseArgs(args=None):
+    parser = argparse.ArgumentParser(description='Replay acehttp.log traffic against AceProxy')
+    parser.add_argument('logs', nargs='*', help='acehttp.log files, oldest first')
+    parser.add_argument('--profile', action='store_true', help='only print the traffic profile')
+    parser.add_argument('--from', dest='start', default=None, help='sessions starting from HH:MM')
+    parser.add_argument('--to', dest='stop', default=None, help='sessions starting before HH:MM')
+    parser.add_argument('--limit', type=int, default=None, help='replay only the first N sessions')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 10 is 10x faster')
+    parser.add_argument('--max-session', type=float, default=3600.0, help='session length cap, log seconds')
+    parser.add_argument('--default-length', type=float, default=600.0,
+                        help='length of sessions without closing line or zap, seconds')
+    parser.add_argument('--zap', type=float, default=10.0, help='sessions shorter than that are zaps, seconds')
+    parser.add_argument('--burst-window', type=float, default=60.0, help='zap burst window, seconds')
+    parser.add_argument('--url', default='http://127.0.0.1:38082', help='proxy URL')
+    parser.add_argument('--timeout', type=float, default=60.0, help='client socket timeout, seconds')
+    parser.add_argument('--pid', type=int, default=None, help='proxy (master) process id for CPU and memory')
+    parser.add_argument('--label', default=None, help='result label, git revision by default')
+    parser.add_argument('--output', default=None, help='JSON results file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two results files')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    options = parseArgs()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)-10s %(levelname)-8s %(message)s')
+    if options.compare:
+        print compare(json.load(open(options.compare[0])), json.load(open(options.compare[1])))
+        sys.exit(0)
+    sessions = [session for session in parseLogs(options.logs, options.default_length)
+                if inWindow(session, options.start, options.stop)][:options.limit]
+    if not sessions:
+        sys.exit('No sessions in the logs')
+    if options.profile:
+        result = profile(sessions, options.zap, options.burst_window)
+    else:
+        result = replay(sessions, options)
+    body = json.dumps(result, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(body + '\n')
+    print body
@@ -0,0 +1,84 @@
+'''
+Synthetic MPEG-TS stream for the fake engine.
+One H.264 program: PAT, PMT and a keyframe (random access point with PTS)
+at the start of every GOP, followed by plain video payload packets.
+'''
+
+import struct
+
+TSPACKET = 188
+PMTPID = 0x1000
+VIDEOPID = 0x100
+# PTS clock rate and wrap around
+PTSRATE = 90000
+PTSWRAP = 1 << 33
+
+
+def crc32mpeg(data):
+    crc = 0xFFFFFFFF
+    for byte in bytearray(data):
+        crc ^= byte << 24
+        for i in xrange(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+            crc &= 0xFFFFFFFF
+    return crc
+
+
+def _section(table):
+    return table + struct.pack('>I', crc32mpeg(table))
+
+
+def _packet(pid, cc, payload, pusi=False, adaptation=''):
+    header = struct.pack('>BHB', 0x47, (0x4000 if pusi else 0) | pid,
+                         (0x30 if adaptation else 0x10) | (cc & 0x0F))
+    packet = header + adaptation + payload
+    return packet + '\xff' * (TSPACKET - len(packet))
+
+
+def _pts(pts):
+    # '0010' marker, 33 bits with marker bits
+    return struct.pack('>BHH', 0x21 | ((pts >> 29) & 0x0E), ((pts >> 14) & 0xFFFE) | 1, ((pts << 1) & 0xFFFE) | 1)
+
+
+def _pcr(pts):
+    # 33 bit base, 6 reserved bits, 9 bit extension
+    return struct.pack('>IH', (pts >> 1) & 0xFFFFFFFF, ((pts & 1) << 15) | 0x7E00)
+
+
+# Program association and program map sections
+PAT = _section(struct.pack('>BHHBBBHH', 0x00, 0xB000 | 13, 1, 0xC1, 0, 0, 1, 0xE000 | PMTPID))
+PMT = _section(struct.pack('>BHHBBBHHBHH', 0x02, 0xB000 | 18, 1, 0xC1, 0, 0, 0xE000 | VIDEOPID, 0xF000,
+                           0x1B, 0xE000 | VIDEOPID, 0xF000))
+
+
+class TsGenerator(object):
+
+    '''
+    Stream of GOPs of the given bitrate (kbit/s) and duration (seconds)
+    '''
+
+    def __init__(self, bitrate=4000, gop=1.0):
+        self.gop = gop
+        # Video packets of one GOP, so that continuity counters of the next
+        # keyframe continue where this GOP ends
+        packets = max(int(bitrate * 1000 * gop / 8 / TSPACKET) - 2, 16)
+        packets -= packets % 16
+        self._payload = ''.join(_packet(VIDEOPID, cc, '\x00' * 184) for cc in xrange(1, packets))
+        self._cc = 0
+        self._pts = 0
+
+    def nextGop(self):
+        '''
+        PAT, PMT, keyframe and the rest of the GOP
+        '''
+        pts = self._pts
+        self._pts = (self._pts + int(self.gop * PTSRATE)) % PTSWRAP
+        cc = self._cc
+        self._cc += 1
+        # PES with PTS, access unit delimiter and IDR slice NAL units
+        pes = '\x00\x00\x01\xe0\x00\x00\x80\x80\x05' + _pts(pts) + \
+            '\x00\x00\x00\x01\x09\xf0\x00\x00\x00\x01\x65\x88\x84'
+        # Random access indicator and PCR
+        adaptation = '\x07\x50' + _pcr(pts)
+        return _packet(0, cc, '\x00' + PAT, True) + _packet(PMTPID, cc, '\x00' + PMT, True) + \
+            _packet(VIDEOPID, 0, pes, True, adaptation) + self._payload
@@ -0,0 +1 @@
+from notifier import *
@@ -0,0 +1,139 @@
+'''
+CyberTV registry notifier.
+Sends channel and server updates in background.
+'''
+
+import gevent
+import gevent.event
+import gevent.pool
+import logging
+import time
+import urllib2
+from collections import OrderedDict
+
+
+class CyberTVNotifier(object):
+
+    '''
+    Background notifier class.
+    Updates for the same channel or server are coalesced, only the last
+    one is sent.
+    '''
+
+    def __init__(self, add_ch_url, add_serv_url, md5pass, batch_size=10, flush_interval=1,
+                 retry_delay=5, max_retry_delay=300, max_attempts=10, timeout=10):
+        self._add_ch_url = add_ch_url
+        self._add_serv_url = add_serv_url
+        self._md5pass = md5pass
+        # Maximum number of concurrent requests
+        self._batchsize = batch_size
+        # Delay to collect updates before sending them
+        self._flushinterval = flush_interval
+        # First retry delay, doubled on every failure
+        self._retrydelay = retry_delay
+        self._maxretrydelay = max_retry_delay
+        # Give up after that many failures
+        self._maxattempts = max_attempts
+        # Request timeout
+        self._timeout = timeout
+        # Pending updates: key -> [url, failed attempts, not before]
+        self._pending = OrderedDict()
+        # Updates being sent: key -> url
+        self._sending = dict()
+        # New update event
+        self._wakeup = gevent.event.Event()
+        # Queue is empty event
+        self._empty = gevent.event.Event()
+        self._empty.set()
+        # Counters
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+
+        self._sendergreenlet = gevent.spawn(self._sender)
+
+    def addChannel(self, name, url, active):
+        '''
+        Add or update channel in CyberTV registry
+        '''
+        self._put(('ch', url), self._add_ch_url + self._md5pass + '&ch_name=' + name +
+                  '&ch_url=' + url + '&active=' + ('1' if active else '0'))
+
+    def addServer(self, addr, active):
+        '''
+        Add or update server in CyberTV registry
+        '''
+        self._put(('serv', addr), self._add_serv_url + self._md5pass + '&serv_addr=' + addr +
+                  '&serv_active=' + ('1' if active else '0'))
+
+    def qsize(self):
+        '''
+        Number of updates waiting to be sent
+        '''
+        return len(self._pending) + len(self._sending)
+
+    def flush(self, timeout=None):
+        '''
+        Wait until all the updates are sent (or given up)
+        '''
+        self._wakeup.set()
+        return self._empty.wait(timeout)
+
+    def destroy(self):
+        self._sendergreenlet.kill(block=False)
+
+    def _put(self, key, url):
+        if key in self._pending:
+            del self._pending[key]
+            self.coalesced += 1
+        self._pending[key] = [url, 0, 0]
+        self._empty.clear()
+        self._wakeup.set()
+
+    def _sender(self):
+        '''
+        Sender method for greenlet
+        '''
+        logger = logging.getLogger('CyberTVNotifier_sender')
+        pool = gevent.pool.Pool(self._batchsize)
+
+        while True:
+            self._wakeup.wait(self._flushinterval)
+            self._wakeup.clear()
+            # Collect more updates for the same channels
+            gevent.sleep(self._flushinterval)
+
+            now = time.time()
+            batch = [key for key in self._pending if self._pending[key][2] <= now]
+            for key in batch[:self._batchsize]:
+                url, attempts, notbefore = self._pending.pop(key)
+                self._sending[key] = url
+                pool.spawn(self._send, key, url, attempts)
+            pool.join()
+
+            if not self._pending and not self._sending:
+                self._empty.set()
+            elif len(batch) > self._batchsize:
+                self._wakeup.set()
+            logger.debug("Queue depth " + str(self.qsize()))
+
+    def _send(self, key, url, attempts):
+        logger = logging.getLogger('CyberTVNotifier_send')
+
+        try:
+            urllib2.urlopen(url, timeout=self._timeout).read()
+            self.sent += 1
+            logger.debug("CyberTV: sent " + url)
+        except Exception as e:
+            self.failed += 1
+            attempts += 1
+            if attempts >= self._maxattempts:
+                logger.error("CyberTV: ERROR " + repr(e) + ", giving up " + url)
+                return
+            delay = min(self._retrydelay * 2 ** (attempts - 1), self._maxretrydelay)
+            logger.debug("CyberTV: ERROR " + repr(e) + ", retry in " + str(delay) + " seconds")
+            # Retry only if there is no newer update
+            if key not in self._pending:
+                self._pending[key] = [url, attempts, time.time() + delay]
+        finally:
+            del self._sending[key]
@@ -0,0 +1,299 @@
+'''
+HTTP front end on gevent StreamServer.
+Keeps HTTP/1.1 connections alive (closes them when idle), uses chunked
+transfer for kept alive responses without Content-Length and limits
+per-connection buffers.
+Request handlers have the same interface as BaseHTTPRequestHandler.
+'''
+
+import gevent
+import gevent.server
+import gevent.socket
+import logging
+import socket
+import BaseHTTPServer
+
+
+class RequestHeaders(object):
+
+    '''
+    Request headers. Names in dict are lowercase, like in mimetools.Message.
+    '''
+
+    def __init__(self):
+        self.dict = dict()
+        self.headers = list()
+
+    def get(self, name, default=None):
+        return self.dict.get(name.lower(), default)
+
+    getheader = get
+
+    def __getitem__(self, name):
+        return self.dict[name.lower()]
+
+    def __contains__(self, name):
+        return name.lower() in self.dict
+
+    def __str__(self):
+        return ''.join(self.headers)
+
+
+class ResponseWriter(object):
+
+    '''
+    wfile for GeventRequestHandler.
+    Writes chunks if response uses chunked transfer. Buffer objects are
+    sent without copying.
+    '''
+
+    def __init__(self, handler):
+        self._handler = handler
+        self.closed = False
+
+    def write(self, data):
+        if not data:
+            return
+        sock = self._handler.connection
+        if self._handler.chunked:
+            sock.sendall('%x\r\n' % len(data))
+            sock.sendall(data)
+            sock.sendall('\r\n')
+        else:
+            sock.sendall(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._handler.close_connection = True
+            try:
+                self._handler.connection.shutdown(socket.SHUT_RDWR)
+            except:
+                pass
+
+
+class GeventRequestHandler(object):
+
+    '''
+    Request handler class.
+    Use it as the first base class together with a BaseHTTPRequestHandler
+    subclass which has do_GET.
+    '''
+
+    protocol_version = 'HTTP/1.1'
+    # Maximum request line and header line length
+    MAXLINE = 8192
+    # Maximum number of request headers
+    MAXHEADERS = 100
+    # Read buffer size
+    RBUFSIZE = 8192
+    # Seconds to wait for the next request on a kept alive connection
+    # (and for the request headers), idle connections are closed then
+    KEEPALIVETIMEOUT = 15
+
+    def __init__(self, sock, client_address, server):
+        self.request = self.connection = sock
+        self.client_address = client_address
+        self.server = server
+        self.rfile = sock.makefile('rb', self.RBUFSIZE)
+        self.wfile = ResponseWriter(self)
+        self.close_connection = True
+        try:
+            self.handle()
+        finally:
+            try:
+                self.rfile.close()
+                sock.close()
+            except:
+                pass
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        # Response state
+        self.chunked = False
+        self._responsestarted = False
+        self._headersdone = False
+        self._contentlength = None
+        self._responseheaders = list()
+        self.close_connection = True
+
+        # rfile has its own socket object, its timeout can't be changed
+        timeout = gevent.Timeout(self.KEEPALIVETIMEOUT)
+        timeout.start()
+        try:
+            requestline = self.rfile.readline(self.MAXLINE + 1)
+            if not requestline:
+                return
+            if len(requestline) > self.MAXLINE:
+                self.send_error(414)
+                return
+            if not self.parse_request(requestline):
+                return
+        except gevent.Timeout as e:
+            if e is not timeout:
+                raise
+            # Idle connection
+            return
+        except socket.error:
+            return
+        finally:
+            # Responses (video streams) may take any time
+            timeout.cancel()
+
+        if self.command != 'GET':
+            self.send_error(501, "Unsupported method (%r)" % self.command)
+            return
+
+        self.do_GET()
+        self.finishResponse()
+
+    def parse_request(self, requestline):
+        self.requestline = requestline.rstrip('\r\n')
+        words = self.requestline.split()
+        if len(words) == 3:
+            self.command, self.path, self.request_version = words
+        elif len(words) == 2:
+            self.command, self.path = words
+            self.request_version = 'HTTP/0.9'
+        else:
+            self.request_version = 'HTTP/1.0'
+            self.send_error(400, "Bad request syntax (%r)" % self.requestline)
+            return False
+
+        self.headers = RequestHeaders()
+        while True:
+            line = self.rfile.readline(self.MAXLINE + 1)
+            if len(line) > self.MAXLINE or len(self.headers.headers) >= self.MAXHEADERS:
+                self.send_error(431)
+                return False
+            if line in ('\r\n', '\n', ''):
+                break
+            self.headers.headers.append(line)
+            name, sep, value = line.partition(':')
+            if sep:
+                self.headers.dict[name.strip().lower()] = value.strip()
+
+        connection = self.headers.get('Connection', '').lower()
+        if self.request_version == 'HTTP/1.1':
+            self.close_connection = connection == 'close'
+        else:
+            self.close_connection = connection != 'keep-alive'
+        return True
+
+    def send_response(self, code, message=None):
+        if message is None:
+            message = self.responses[code][0] if code in self.responses else ''
+        self._responsestarted = True
+        self._responsecode = code
+        self._responseheaders = ['%s %d %s\r\n' % (self.protocol_version, code, message)]
+        self.send_header('Server', self.version_string())
+        self.send_header('Date', self.date_time_string())
+
+    def send_header(self, keyword, value):
+        key = keyword.lower()
+        if key == 'content-length':
+            self._contentlength = int(value)
+        elif key in ('connection', 'transfer-encoding', 'keep-alive'):
+            # Connection handling is ours
+            return
+        self._responseheaders.append('%s: %s\r\n' % (keyword, value))
+
+    def end_headers(self):
+        if self._headersdone or not self._responsestarted:
+            return
+        self._headersdone = True
+
+        if self._contentlength is None and self._responsecode not in (204, 304):
+            if self.request_version == 'HTTP/1.1' and not self.close_connection:
+                self.chunked = True
+                self._responseheaders.append('Transfer-Encoding: chunked\r\n')
+            else:
+                # Length is unknown, the body ends when the connection is
+                # closed
+                self.close_connection = True
+
+        self._responseheaders.append('Connection: ' + ('close' if self.close_connection else 'keep-alive') + '\r\n')
+        self._responseheaders.append('\r\n')
+        self.connection.sendall(''.join(self._responseheaders))
+        self._responseheaders = list()
+
+    def send_error(self, code, message=None):
+        short, explain = self.responses.get(code, ('???', '???'))
+        if message is None:
+            message = short
+        body = self.error_message_format % {'code': code, 'message': message, 'explain': explain}
+        self.send_response(code, message)
+        self.send_header('Content-Type', self.error_content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.connection.sendall(body)
+
+    def finishResponse(self):
+        '''
+        Complete response so the connection can be used again
+        '''
+        if self.wfile.closed:
+            self.close_connection = True
+            return
+        if not self._headersdone:
+            # Handler didn't respond at all
+            self.close_connection = True
+        elif self.chunked:
+            try:
+                self.connection.sendall('0\r\n\r\n')
+            except socket.error:
+                self.close_connection = True
+            self.chunked = False
+
+    def sendData(self, data):
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.getLogger('GeventRequestHandler').debug(
+            self.client_address[0] + ' ' + format % args)
+
+
+class GeventHTTPServer(object):
+
+    '''
+    HTTP server on gevent StreamServer
+    '''
+
+    # Share listening port with other worker processes
+    reuse_port = False
+    # Server for clients relayed from other workers
+    relay = False
+
+    def __init__(self, server_address, RequestHandlerClass, backlog=256):
+        self.server_address = server_address
+        self.RequestHandlerClass = RequestHandlerClass
+        self.socket = gevent.socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(server_address)
+        self.socket.listen(backlog)
+        self._server = gevent.server.StreamServer(self.socket, self._handle)
+
+    def _handle(self, sock, address):
+        try:
+            self.RequestHandlerClass(sock, address, self)
+        except Exception as e:
+            logging.getLogger('GeventHTTPServer').debug("Handler error " + repr(e))
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def shutdown(self):
+        self._server.stop()
+
+    def server_close(self):
+        self._server.close()
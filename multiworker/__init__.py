@@ -0,0 +1 @@
+from coordinator import *
@@ -0,0 +1,227 @@
+'''
+Shared state for pre-fork worker mode.
+Master process runs Coordinator on a unix socket, workers talk to it
+with WorkerClient.
+'''
+
+import gevent
+import gevent.coros
+import gevent.server
+import logging
+import os
+import signal
+import socket
+import urllib2
+
+
+class WorkerException(Exception):
+
+    '''
+    Exception from WorkerClient
+    '''
+    pass
+
+
+class Coordinator(object):
+
+    '''
+    Decides which worker owns each channel and keeps the global client
+    count.
+    Line protocol, one request and one response line:
+    CLAIM <channel>    -> owner worker index
+    RELEASE <channel>  -> OK
+    ADD <limit>        -> new total, or 0 if limit reached
+    DEL                -> new total
+    TOTAL              -> total
+    '''
+
+    def __init__(self, path):
+        self._path = path
+        # Channel -> owner worker index
+        self.owners = dict()
+        # Worker index -> client count
+        self.clients = dict()
+
+        if os.path.exists(path):
+            os.unlink(path)
+        # Workers may connect before the master starts serving
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(path)
+        self._listener.listen(64)
+        self._server = gevent.server.StreamServer(self._listener, self._handle)
+
+    def start(self):
+        self._server.start()
+
+    def detach(self):
+        '''
+        Close inherited listener in a worker process
+        '''
+        self._listener.close()
+
+    def stop(self):
+        self._server.stop()
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
+
+    def total(self):
+        return sum(self.clients.itervalues())
+
+    def _handle(self, sock, address):
+        logger = logging.getLogger('Coordinator_handle')
+
+        sockfile = sock.makefile()
+        worker = None
+        try:
+            line = sockfile.readline().split()
+            if len(line) != 2 or line[0] != 'HELLO':
+                return
+            worker = int(line[1])
+            self.clients[worker] = 0
+            logger.debug("Worker " + str(worker) + " connected")
+
+            while True:
+                line = sockfile.readline()
+                if not line:
+                    break
+                command, sep, arg = line.strip().partition(' ')
+                if command == 'CLAIM':
+                    response = self.owners.setdefault(arg, worker)
+                elif command == 'RELEASE':
+                    if self.owners.get(arg) == worker:
+                        del self.owners[arg]
+                    response = 'OK'
+                elif command == 'ADD':
+                    if int(arg) > 0 and self.total() >= int(arg):
+                        response = 0
+                    else:
+                        self.clients[worker] += 1
+                        response = self.total()
+                elif command == 'DEL':
+                    self.clients[worker] = max(self.clients[worker] - 1, 0)
+                    response = self.total()
+                elif command == 'TOTAL':
+                    response = self.total()
+                else:
+                    response = 'ERROR'
+                sockfile.write(str(response) + '\n')
+                sockfile.flush()
+        except Exception as e:
+            logger.error("Worker connection error " + repr(e))
+        finally:
+            if worker is not None:
+                # Worker is gone with all its clients and channels
+                logger.debug("Worker " + str(worker) + " disconnected")
+                self.clients.pop(worker, None)
+                for channel in [channel for channel in self.owners if self.owners[channel] == worker]:
+                    del self.owners[channel]
+            sock.close()
+
+
+class WorkerClient(object):
+
+    '''
+    Worker side of the shared state
+    '''
+
+    def __init__(self, path, index, relay_host, relay_port):
+        # Worker index
+        self.index = index
+        # Every worker serves relayed clients on its own port
+        self._relayhost = relay_host
+        self._relayport = relay_port
+        # One request at a time
+        self._lock = gevent.coros.Semaphore()
+
+        try:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(path)
+            self._file = self._socket.makefile()
+            self._file.write('HELLO ' + str(index) + '\n')
+            self._file.flush()
+        except socket.error as e:
+            raise WorkerException("Can't connect to coordinator " + repr(e))
+
+    def _request(self, line):
+        self._lock.acquire()
+        try:
+            self._file.write(line + '\n')
+            self._file.flush()
+            response = self._file.readline()
+        except socket.error as e:
+            raise WorkerException("Coordinator request error " + repr(e))
+        finally:
+            self._lock.release()
+
+        if not response:
+            raise WorkerException("Coordinator is gone")
+        return response.strip()
+
+    def relayPort(self, index=None):
+        return self._relayport + (self.index if index is None else index)
+
+    def relayUrl(self, index):
+        '''
+        Base URL of worker's relay server
+        '''
+        return 'http://' + self._relayhost + ':' + str(self.relayPort(index))
+
+    def claim(self, channel):
+        '''
+        Claim channel ownership. Returns index of the owner worker.
+        '''
+        return int(self._request('CLAIM ' + urllib2.quote(channel, '')))
+
+    def release(self, channel):
+        self._request('RELEASE ' + urllib2.quote(channel, ''))
+
+    def add(self, limit=0):
+        '''
+        Add client if global limit is not reached. Returns new total or 0.
+        '''
+        return int(self._request('ADD ' + str(limit)))
+
+    def delete(self):
+        return int(self._request('DEL'))
+
+    def total(self):
+        return int(self._request('TOTAL'))
+
+
+def forkWorkers(count, path):
+    '''
+    Fork worker processes. Returns worker index in workers. Master runs
+    coordinator until interrupted and exits.
+    '''
+    logger = logging.getLogger('multiworker_forkWorkers')
+
+    coordinator = Coordinator(path)
+    pids = list()
+    for index in xrange(count):
+        pid = gevent.fork()
+        if pid == 0:
+            coordinator.detach()
+            return index
+        pids.append(pid)
+
+    coordinator.start()
+    logger.info("Started " + str(count) + " workers")
+    try:
+        while pids:
+            gevent.sleep(1)
+            for pid in list(pids):
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    pids.remove(pid)
+                    logger.info("Worker " + str(pid) + " exited")
+    except KeyboardInterrupt:
+        logger.info("Stopping workers...")
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGINT)
+            except OSError:
+                pass
+    finally:
+        coordinator.stop()
+    raise SystemExit(0)
@@ -0,0 +1,158 @@
+'''
+Channel index for playlist plugins.
+Playlist is parsed once per download, then filtered by group, title
+prefix and paged without touching the whole playlist text.
+
+Query parameters:
+    ?group=Sport      channels of the group, case insensitive
+    ?q=disc           channels with title words starting with 'disc'
+    ?offset=0&limit=100  page of the result
+'''
+import re
+import urllib2
+from bisect import bisect_left
+
+PIDRE = re.compile('^[0-9a-f]{40}$')
+WORDRE = re.compile(r'\w+', re.UNICODE)
+GROUPRE = re.compile(r'group-title="([^"]*)"')
+
+
+class Channel(object):
+    __slots__ = ('title', 'group', 'url', 'position', 'extinf', 'directives')
+
+    def __init__(self, title, group, url, position, extinf=None, directives=None):
+        self.title = title
+        self.group = group
+        self.url = url
+        self.position = position
+        # Original #EXTINF line with all its attributes
+        self.extinf = extinf
+        # Other directive lines of the channel (#EXTGRP, #EXTVLCOPT...)
+        self.directives = directives
+
+    def render(self, hostport):
+        extinf = self.extinf
+        if not extinf:
+            extinf = '#EXTINF:-1' + (' group-title="' + self.group + '"' if self.group else '') + ',' + self.title
+        if PIDRE.match(self.url):
+            url = 'http://' + hostport + '/pid/' + self.url
+        elif self.url.startswith('http'):
+            # For .acelive URLs
+            url = 'http://' + hostport + '/torrent/' + urllib2.quote(self.url, '')
+        else:
+            url = self.url
+        if self.directives:
+            extinf += '\n' + '\n'.join(self.directives)
+        return extinf + '\n' + url + '\n'
+
+
+class ChannelIndex(object):
+
+    def __init__(self, channels, header='#EXTM3U'):
+        # Channels in playlist order
+        self.channels = channels
+        # Playlist header line with its attributes (url-tvg...)
+        self.header = header
+        # Lowercase group -> channel positions
+        self._groups = dict()
+        # PID/infohash/URL -> channel
+        self._ids = dict()
+        # Sorted (title word, position) pairs for prefix lookups
+        self._words = list()
+
+        for channel in channels:
+            self._ids[channel.url] = channel
+            if channel.group:
+                self._groups.setdefault(self._key(channel.group), list()).append(channel.position)
+            for word in set(WORDRE.findall(self._key(channel.title))):
+                self._words.append((word, channel.position))
+        self._words.sort()
+
+    @staticmethod
+    def _key(text):
+        return text.decode('utf-8', 'ignore').lower()
+
+    @classmethod
+    def fromM3U(cls, playlist):
+        channels = list()
+        header = '#EXTM3U'
+        extinf = None
+        directives = list()
+        for line in playlist.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('#EXTM3U'):
+                header = line
+            elif line.startswith('#EXTINF'):
+                extinf = line
+            elif line.startswith('#'):
+                directives.append(line)
+            elif extinf:
+                group = GROUPRE.search(extinf)
+                title = extinf.split(',', 1)[1] if ',' in extinf else ''
+                channels.append(Channel(title, group.group(1) if group else None, line, len(channels), extinf,
+                                        directives or None))
+                extinf = None
+                directives = list()
+        return cls(channels, header)
+
+    def get(self, id):
+        '''
+        Channel by PID, infohash or URL
+        '''
+        return self._ids.get(id)
+
+    def groups(self):
+        return sorted(set(channel.group for channel in self.channels if channel.group))
+
+    def byGroup(self, group):
+        return self._groups.get(self._key(group), list())
+
+    def byPrefix(self, prefix):
+        '''
+        Positions of channels with title word starting with prefix
+        '''
+        positions = set()
+        i = bisect_left(self._words, (prefix, -1))
+        while i < len(self._words) and self._words[i][0].startswith(prefix):
+            positions.add(self._words[i][1])
+            i += 1
+        return positions
+
+    def select(self, group=None, q=None, offset=0, limit=None):
+        if not group and not q:
+            channels = self.channels
+        else:
+            positions = None
+            if group:
+                positions = set(self.byGroup(group))
+            if q:
+                # Every query word should match
+                for word in WORDRE.findall(self._key(q)):
+                    found = self.byPrefix(word)
+                    positions = found if positions is None else positions & found
+            channels = [self.channels[i] for i in sorted(positions or ())]
+
+        if limit is None:
+            return channels[offset:]
+        return channels[offset:offset + limit]
+
+    def render(self, hostport, group=None, q=None, offset=0, limit=None):
+        return self.header + '\n' + ''.join(channel.render(hostport) for channel in self.select(group, q, offset, limit))
+
+    @staticmethod
+    def queryParams(query):
+        '''
+        (group, q, offset, limit) from parsed query string,
+        ValueError if paging parameters are wrong
+        '''
+        group = query.get('group', [None])[0]
+        q = query.get('q', [None])[0]
+        offset = int(query.get('offset', [0])[0])
+        limit = query.get('limit', [None])[0]
+        if limit is not None:
+            limit = int(limit)
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError('Negative offset or limit')
+        return group, q, offset, limit
@@ -0,0 +1,89 @@
+'''
+Cache of rendered playlist responses for playlist plugins.
+Every variant is rendered and gzipped once per playlist download and
+served with ETag/Last-Modified validators.
+'''
+import gzip
+import hashlib
+import time
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from StringIO import StringIO
+
+
+class PlaylistResponse(object):
+
+    def __init__(self, body, modified):
+        self.body = body
+        self.modified = modified
+        self.lastmodified = formatdate(modified, usegmt=True)
+        self.etag = '"' + hashlib.md5(body).hexdigest()[:16] + '"'
+        compressed = StringIO()
+        gzfile = gzip.GzipFile(fileobj=compressed, mode='wb', compresslevel=9, mtime=modified)
+        gzfile.write(body)
+        gzfile.close()
+        self.gzipped = compressed.getvalue()
+
+
+class PlaylistCache(object):
+
+    def __init__(self, contenttype='application/x-mpegurl', maxvariants=256):
+        self.contenttype = contenttype
+        # Query variants are client controlled, keep their number bounded
+        self.maxvariants = maxvariants
+        # Variant key -> PlaylistResponse
+        self._responses = dict()
+        # Playlist download time the responses were rendered from
+        self._version = None
+
+    def get(self, key, version, render):
+        '''
+        Get response for variant key, render() it if it's not cached for
+        this playlist version
+        '''
+        if version != self._version or len(self._responses) >= self.maxvariants:
+            self._responses = dict()
+            self._version = version
+
+        response = self._responses.get(key)
+        if response is None:
+            response = PlaylistResponse(render(), version or int(time.time()))
+            self._responses[key] = response
+        return response
+
+    def send(self, connection, response):
+        '''
+        Send response to client, 304 if client has it already
+        '''
+        if self.notModified(connection, response):
+            connection.send_response(304)
+            connection.send_header('ETag', response.etag)
+            connection.send_header('Last-Modified', response.lastmodified)
+            connection.end_headers()
+            return
+
+        body = response.body
+        connection.send_response(200)
+        connection.send_header('Content-type', self.contenttype)
+        connection.send_header('ETag', response.etag)
+        connection.send_header('Last-Modified', response.lastmodified)
+        connection.send_header('Vary', 'Accept-Encoding')
+        if 'gzip' in connection.headers.get('Accept-Encoding', ''):
+            body = response.gzipped
+            connection.send_header('Content-Encoding', 'gzip')
+        connection.send_header('Content-Length', str(len(body)))
+        connection.end_headers()
+        connection.wfile.write(body)
+
+    @staticmethod
+    def notModified(connection, response):
+        etags = connection.headers.get('If-None-Match')
+        if etags:
+            return response.etag in etags or etags.strip() == '*'
+
+        since = connection.headers.get('If-Modified-Since')
+        if since:
+            try:
+                return mktime_tz(parsedate_tz(since)) >= response.modified
+            except (TypeError, ValueError, OverflowError):
+                pass
+        return False
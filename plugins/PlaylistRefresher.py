@@ -0,0 +1,133 @@
+'''
+Background refresh scheduler for playlist plugins.
+Playlists are refreshed before they expire, old copy is served while
+refreshing, only one download per source runs at a time.
+'''
+import gevent
+import logging
+import time
+
+
+class PlaylistSource(object):
+
+    def __init__(self, name, fetch, ttl, refreshahead, retrydelay, maxretrydelay):
+        self.name = name
+        # Download method, returns True on success
+        self.fetch = fetch
+        # Playlist lifetime
+        self.ttl = ttl
+        # Refresh that long before expiration
+        self.refreshahead = refreshahead
+        # First retry delay, doubled on every failure
+        self.retrydelay = retrydelay
+        self.maxretrydelay = maxretrydelay
+        # Playlist was downloaded at least once
+        self.loaded = False
+        # Next refresh time
+        self.nextrefresh = 0
+        # Refresh greenlet, only one at a time
+        self.greenlet = None
+        # Metrics
+        self.refreshes = 0
+        self.failures = 0
+        self.consecutivefailures = 0
+        self.lastsuccess = None
+        self.lastduration = 0
+        self.maxduration = 0
+        self.totalduration = 0
+
+    def stats(self):
+        return {'name': self.name, 'loaded': self.loaded, 'refreshing': self.greenlet is not None,
+                'refreshes': self.refreshes, 'failures': self.failures,
+                'age': int(time.time() - self.lastsuccess) if self.lastsuccess else None,
+                'last_duration': self.lastduration, 'max_duration': self.maxduration,
+                'avg_duration': self.totalduration / self.refreshes if self.refreshes else 0}
+
+
+class RefreshScheduler(object):
+
+    def __init__(self, interval=5):
+        # Scheduler check interval
+        self._interval = interval
+        self.sources = list()
+        self._greenlet = None
+
+    def add(self, name, fetch, ttl=60 * 60, refreshahead=5 * 60, retrydelay=30, maxretrydelay=15 * 60):
+        source = PlaylistSource(name, fetch, ttl, refreshahead, retrydelay, maxretrydelay)
+        self.sources.append(source)
+        return source
+
+    def stats(self):
+        return [source.stats() for source in self.sources]
+
+    def ensure(self, source, timeout=15):
+        '''
+        Make sure source has a playlist. Waits only if it was never
+        downloaded, otherwise old copy is used while refreshing.
+        '''
+        # Started on the first request, not in the process which loads
+        # plugins before forking workers
+        if self._greenlet is None:
+            self._greenlet = gevent.spawn(self._scheduler)
+
+        if source.loaded:
+            if time.time() >= source.nextrefresh:
+                self.refresh(source)
+            return True
+
+        greenlet = self.refresh(source)
+        if greenlet:
+            greenlet.join(timeout)
+        return source.loaded
+
+    def refresh(self, source):
+        '''
+        Start background refresh if it's not running already
+        '''
+        if source.greenlet is None and time.time() >= source.nextrefresh:
+            source.greenlet = gevent.spawn(self._refresh, source)
+        return source.greenlet
+
+    def _refresh(self, source):
+        logger = logging.getLogger('RefreshScheduler_refresh')
+
+        start = time.time()
+        try:
+            success = source.fetch()
+        except Exception as e:
+            logger.error("Can't refresh " + source.name + ": " + repr(e))
+            success = False
+        finally:
+            source.greenlet = None
+
+        now = time.time()
+        duration = now - start
+        source.refreshes += 1
+        source.lastduration = duration
+        source.maxduration = max(source.maxduration, duration)
+        source.totalduration += duration
+
+        if success:
+            source.loaded = True
+            source.lastsuccess = now
+            source.consecutivefailures = 0
+            source.nextrefresh = now + max(source.ttl - source.refreshahead, 0)
+            logger.debug(source.name + " refreshed in " + '%.3f' % duration + " seconds")
+        else:
+            source.failures += 1
+            source.consecutivefailures += 1
+            delay = min(source.retrydelay * 2 ** (source.consecutivefailures - 1), source.maxretrydelay)
+            source.nextrefresh = now + delay
+            logger.error(source.name + " refresh failed, retry in " + str(delay) + " seconds")
+
+    def _scheduler(self):
+        while True:
+            gevent.sleep(self._interval)
+            for source in self.sources:
+                # Sources nobody asked for yet are loaded on demand
+                if source.loaded or source.consecutivefailures:
+                    self.refresh(source)
+
+
+# Shared by all playlist plugins
+scheduler = RefreshScheduler()
@@ -0,0 +1,69 @@
+'''
+Prometheus metrics plugin
+
+To use it, scrape http://127.0.0.1:8000/metrics
+'''
+import telemetry
+from PluginInterface import AceProxyPlugin
+
+
+class Metrics(AceProxyPlugin):
+    handlers = ('metrics', )
+
+    def __init__(self, AceConfig, AceStuff):
+        self.config = AceConfig
+        self.stuff = AceStuff
+
+        # Collected from the proxy state on every scrape
+        telemetry.Gauge('aceproxy_clients', 'Connected clients',
+                        callback=lambda: {(): self.stuff.clientcounter.getTotal()})
+        telemetry.Gauge('aceproxy_channel_clients', 'Connected clients of the channel', ('channel', ),
+                        callback=lambda: dict(((channel, ), clients[0])
+                                              for channel, clients in self.stuff.clientcounter.clients.items()))
+        telemetry.CallbackCounter('aceproxy_channel_bytes_in', 'Bytes read from the channel upstream', ('channel', ),
+                                  callback=lambda: dict(((channel, ), broadcaster.position) for channel, broadcaster
+                                                        in self.stuff.clientcounter.broadcasters.items()))
+        telemetry.CallbackCounter('aceproxy_client_bytes_out', 'Bytes sent to the connected client',
+                                  ('channel', 'client'), callback=self.clientBytes)
+        telemetry.Gauge('aceproxy_engine_sessions', 'Active engine sessions', ('engine', ),
+                        callback=lambda: self.engineStats('sessions'))
+        telemetry.Gauge('aceproxy_engine_healthy', 'Engine is healthy', ('engine', ),
+                        callback=lambda: self.engineStats('healthy'))
+        telemetry.Gauge('aceproxy_engine_speed_down_kibps', 'Engine download speed', ('engine', ),
+                        callback=lambda: self.engineStats('speed_down'))
+        telemetry.Gauge('aceproxy_channel_peers', 'Peers of the channel engine session', ('channel', ),
+                        callback=lambda: self.channelStatus('peers'))
+        telemetry.Gauge('aceproxy_channel_speed_down_kibps', 'Download speed of the channel engine session',
+                        ('channel', ), callback=lambda: self.channelStatus('speeddown'))
+        telemetry.Gauge('aceproxy_vlc_broadcasts', 'Active VLC broadcasts', ('instance', ),
+                        callback=self.vlcBroadcasts)
+        telemetry.Gauge('aceproxy_hls_channels', 'Channels being segmented for HLS',
+                        callback=lambda: {(): len(self.stuff.hls.segmenters) if self.stuff.hls else 0})
+
+    def clientBytes(self):
+        return dict(((client.path_unquoted, client.client_address[0] + ':' + str(client.client_address[1])),
+                     client.bytessent) for client in telemetry.clients)
+
+    def engineStats(self, key):
+        return dict(((i['engine'], ), int(i[key])) for i in self.stuff.engines.stats())
+
+    def channelStatus(self, key):
+        result = dict()
+        for channel, ace in self.stuff.clientcounter.aces.items():
+            status = ace.getStatus()
+            if status and getattr(status, key) is not None:
+                result[(channel, )] = getattr(status, key)
+        return result
+
+    def vlcBroadcasts(self):
+        if not self.config.vlcuse:
+            return dict()
+        return dict(((i['instance'], ), i['broadcasts']) for i in self.stuff.vlcpool.stats())
+
+    def handle(self, connection):
+        body = telemetry.REGISTRY.render()
+        connection.send_response(200)
+        connection.send_header('Content-Type', 'text/plain; version=0.0.4')
+        connection.send_header('Content-Length', str(len(body)))
+        connection.end_headers()
+        connection.wfile.write(body)
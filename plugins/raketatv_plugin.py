@@ -2,6 +2,7 @@
 Raketa-tv.com Playlist Downloader Plugin
 Original code by tohm
 http://ip:port/raketatv
+http://ip:port/raketatv?q=news&offset=0&limit=100
 '''
 import re
 import logging
@@ -12,6 +13,9 @@ import time
 import json
 from base64 import b64decode
 from PluginInterface import AceProxyPlugin
+from PlaylistCache import PlaylistCache
+from PlaylistRefresher import scheduler
+from ChannelIndex import Channel, ChannelIndex
 import raketatv_config
 
 
@@ -24,8 +28,13 @@ class Raketatv(AceProxyPlugin):
     tokenurl = 'https://raketa-tv.com/connect'
     loginurl = 'https://raketa-tv.com/login_check'
     watchurl = 'http://raketa-tv.com/watch'
-    playlist = None
+    index = None
     playlisttime = None
+    cache = PlaylistCache()
+    source = None
+
+    def __init__(self, AceConfig, AceStuff):
+        Raketatv.source = scheduler.add('raketatv', self.downloadPlaylist)
 
     def downloadPlaylist(self):
         try:
@@ -38,14 +47,14 @@ class Raketatv(AceProxyPlugin):
 
         try:
             jsonplaylist = json.loads(playlist)['channels']
-            playlist = "#EXTM3U\n"
+            channels = list()
             for channel in jsonplaylist:
                 title = channel['title'].encode('utf-8')
                 pid = channel['id'].replace('|', 'M').replace('?', 'L')
                 pid = b64decode(pid)
-                playlist += '#EXTINF:-1,' + title + "\n" + pid + "\n"
+                channels.append(Channel(title, None, pid, len(channels)))
 
-            Raketatv.playlist = playlist
+            Raketatv.index = ChannelIndex(channels)
             Raketatv.playlisttime = playlisttime
         except Exception as e:
             Raketatv.logger.error("Can't parse playlist! " + repr(e))
@@ -54,10 +63,16 @@ class Raketatv(AceProxyPlugin):
         return True
 
     def handle(self, connection):
-        if not Raketatv.playlist or (int(time.time()) - Raketatv.playlisttime > 60 * 60):
-            if not self.downloadPlaylist():
-                connection.dieWithError()
-                return
+        # Waits only for the first download, refreshed in background later
+        if not scheduler.ensure(Raketatv.source):
+            connection.dieWithError()
+            return
+
+        try:
+            params = ChannelIndex.queryParams(connection.query)
+        except ValueError:
+            connection.dieWithError(400)  # 400 Bad Request
+            return
 
         if Raketatv.host:
             hostport = Raketatv.host
@@ -71,7 +86,7 @@ class Raketatv(AceProxyPlugin):
         except:
             pass
 
-        connection.send_response(200)
-        connection.send_header('Content-type', 'application/x-mpegurl')
-        connection.end_headers()
-        connection.wfile.write(re.sub('([0-9a-f]{40})', 'http://' + hostport + '/pid/\\1', Raketatv.playlist))
+        # Rendered once per playlist download for every hostport and query
+        response = Raketatv.cache.get((hostport, ) + params, Raketatv.playlisttime,
+                                      lambda: Raketatv.index.render(hostport, *params))
+        Raketatv.cache.send(connection, response)
@@ -0,0 +1,42 @@
+'''
+Engine sessions plugin, STATUS stats of the channels
+
+http://ip:port/sessions - all channels of this process
+http://ip:port/sessions/<channel id> - one channel
+Use ?history=1 to get the recent STATUS history too
+'''
+import json
+import urllib2
+from PluginInterface import AceProxyPlugin
+
+
+class Sessions(AceProxyPlugin):
+    handlers = ('sessions', )
+
+    def __init__(self, AceConfig, AceStuff):
+        self.stuff = AceStuff
+
+    def channelStats(self, id, stats):
+        stats['clients'] = self.stuff.clientcounter.get(id) or 0
+        return stats
+
+    def handle(self, connection):
+        history = connection.query.get('history', ['0'])[0] not in ('0', '')
+        clientcounter = self.stuff.clientcounter
+        if len(connection.splittedpath) > 2 and connection.splittedpath[2]:
+            id = urllib2.unquote(connection.splittedpath[2])
+            stats = clientcounter.getStatus(id, history)
+            if stats is None:
+                connection.dieWithError(404)  # 404 Not Found
+                return
+            data = self.channelStats(id, stats)
+        else:
+            data = dict((id, self.channelStats(id, stats))
+                        for id, stats in clientcounter.statuses(history).items())
+
+        body = json.dumps(data, indent=1)
+        connection.send_response(200)
+        connection.send_header('Content-Type', 'application/json')
+        connection.send_header('Content-Length', str(len(body)))
+        connection.end_headers()
+        connection.wfile.write(body)
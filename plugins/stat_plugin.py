@@ -4,6 +4,7 @@ Simple statistics plugin
 To use it, go to http://127.0.0.1:8000/stat
 '''
 from PluginInterface import AceProxyPlugin
+from PlaylistRefresher import scheduler
 
 
 class Stat(AceProxyPlugin):
@@ -18,9 +19,37 @@ class Stat(AceProxyPlugin):
         connection.send_header('Content-type', 'text/html')
         connection.end_headers()
         connection.wfile.write(
-            '<html><body><h4>Connected clients: ' + str(self.stuff.clientcounter.total) + '</h4>')
+            '<html><body><h4>Connected clients: ' + str(self.stuff.clientcounter.getTotal()) + '</h4>')
         connection.wfile.write(
             '<h5>Concurrent connections limit: ' + str(self.config.maxconns) + '</h5>')
+        connection.wfile.write(
+            '<h5>CyberTV queue: ' + str(self.stuff.cybertv.qsize()) + '</h5>')
+        if self.stuff.hls:
+            connection.wfile.write(
+                '<h5>HLS channels: ' + str(len(self.stuff.hls.segmenters)) + '</h5>')
+        for i in self.stuff.engines.stats():
+            connection.wfile.write('Engine ' + i['engine'] + ' : ' + ('healthy' if i['healthy'] else 'failed') +
+                                   ', sessions ' + str(i['sessions']) + ', download ' + str(i['speed_down']) +
+                                   ' KiB/s, started ' + str(i['started']) + ', failures ' + str(i['failures']) + '<br>')
+        if self.config.vlcuse:
+            for i in self.stuff.vlcpool.stats():
+                connection.wfile.write('VLC ' + i['instance'] + ' : ' + ('alive' if i['alive'] else 'dead') +
+                                       ', broadcasts ' + str(i['broadcasts']) + ', started ' + str(i['started']) +
+                                       ', failures ' + str(i['failures']) + '<br>')
+        if self.stuff.prewarmer:
+            prewarm = self.stuff.prewarmer.stats()
+            connection.wfile.write('<h5>Prewarm hits: ' + str(prewarm['hits']) + ', misses ' + str(prewarm['misses']) +
+                                   ', hit rate ' + '%.2f' % prewarm['hitrate'] + ', evicted ' +
+                                   str(prewarm['evicted']) + '</h5>')
+            for i in prewarm['channels']:
+                connection.wfile.write('Prewarmed ' + i['key'] + ' : ' + ('ready' if i['ready'] else 'starting') +
+                                       ', score ' + '%.1f' % i['score'] + ', age ' + str(i['age']) + '<br>')
+        for i in scheduler.stats():
+            connection.wfile.write('Playlist ' + i['name'] + ' : ' + ('loaded' if i['loaded'] else 'not loaded') +
+                                   (', refreshing' if i['refreshing'] else '') + ', age ' + str(i['age']) +
+                                   ', refreshes ' + str(i['refreshes']) + ', failures ' + str(i['failures']) +
+                                   ', last ' + '%.3f' % i['last_duration'] + 's, max ' + '%.3f' % i['max_duration'] +
+                                   's, avg ' + '%.3f' % i['avg_duration'] + 's<br>')
         for i in self.stuff.clientcounter.clients:
             connection.wfile.write(str(i) + ' : ' + str(self.stuff.clientcounter.clients[i][0]) + ' ' +
                                    str(self.stuff.clientcounter.clients[i][1]) + '<br>')
@@ -0,0 +1,46 @@
+'''
+Channel start traces plugin
+
+http://ip:port/trace/recent - recent traces, newest first
+http://ip:port/trace/slowest - slowest recent traces
+http://ip:port/trace/stages - stage duration percentiles
+Use ?limit= to get more or less traces
+'''
+import json
+import telemetry
+from PluginInterface import AceProxyPlugin
+
+
+class Trace(AceProxyPlugin):
+    handlers = ('trace', )
+
+    def __init__(self, AceConfig, AceStuff):
+        pass
+
+    def handle(self, connection):
+        try:
+            view = connection.splittedpath[2].lower()
+        except IndexError:
+            view = 'recent'
+        try:
+            limit = int(connection.query.get('limit', [0])[0])
+        except ValueError:
+            connection.dieWithError(400)  # 400 Bad Request
+            return
+
+        if view == 'recent':
+            data = telemetry.tracer.recent(limit or 50)
+        elif view == 'slowest':
+            data = telemetry.tracer.slowest(limit or 10)
+        elif view == 'stages':
+            data = telemetry.tracer.percentiles()
+        else:
+            connection.dieWithError(404)  # 404 Not Found
+            return
+
+        body = json.dumps(data, indent=1)
+        connection.send_response(200)
+        connection.send_header('Content-Type', 'application/json')
+        connection.send_header('Content-Length', str(len(body)))
+        connection.end_headers()
+        connection.wfile.write(body)
@@ -1,12 +1,16 @@
 '''
 Torrent-tv.ru Playlist Downloader Plugin
 http://ip:port/ttvplaylist
+http://ip:port/ttvplaylist?group=Sport&q=news&offset=0&limit=100
 '''
 import re
 import logging
 import urllib2
 import time
 from PluginInterface import AceProxyPlugin
+from PlaylistCache import PlaylistCache
+from PlaylistRefresher import scheduler
+from ChannelIndex import ChannelIndex
 import ttvplaylist_config
 
 
@@ -16,31 +20,44 @@ class Ttvplaylist(AceProxyPlugin):
     logger = logging.getLogger('plugin_ttvplaylist')
     url = ttvplaylist_config.url
     host = ttvplaylist_config.host
-    playlist = None
+    index = None
     playlisttime = None
+    cache = PlaylistCache()
+    source = None
+
+    def __init__(self, AceConfig, AceStuff):
+        Ttvplaylist.source = scheduler.add('ttvplaylist', self.downloadPlaylist)
 
     def downloadPlaylist(self):
         try:
             Ttvplaylist.logger.debug('Trying to download playlist')
-            Ttvplaylist.playlist = urllib2.urlopen(
-                Ttvplaylist.url, timeout=10).read()
-            Ttvplaylist.playlisttime = int(time.time())
+            playlist = urllib2.urlopen(Ttvplaylist.url, timeout=10).read()
+            playlisttime = int(time.time())
         except:
             Ttvplaylist.logger.error("Can't download playlist!")
             return False
 
         try:
-            Ttvplaylist.playlist = re.sub(r',(\S.+) \((.+)\)', r' group-title="\2",\1', Ttvplaylist.playlist)
+            playlist = re.sub(r',(\S.+) \((.+)\)', r' group-title="\2",\1', playlist)
         except Exception as e:
             Ttvplaylist.logger.error("Can't parse playlist groups! " + repr(e))
 
+        # Old playlist is served until the new one is ready
+        Ttvplaylist.index = ChannelIndex.fromM3U(playlist)
+        Ttvplaylist.playlisttime = playlisttime
         return True
 
     def handle(self, connection):
-        if not Ttvplaylist.playlist or (int(time.time()) - Ttvplaylist.playlisttime > 60 * 60):
-            if not self.downloadPlaylist():
-                connection.dieWithError()
-                return
+        # Waits only for the first download, refreshed in background later
+        if not scheduler.ensure(Ttvplaylist.source):
+            connection.dieWithError()
+            return
+
+        try:
+            params = ChannelIndex.queryParams(connection.query)
+        except ValueError:
+            connection.dieWithError(400)  # 400 Bad Request
+            return
 
         if Ttvplaylist.host:
             hostport = Ttvplaylist.host
@@ -54,13 +71,7 @@ class Ttvplaylist(AceProxyPlugin):
         except:
             pass
 
-        connection.send_response(200)
-        connection.send_header('Content-type', 'application/x-mpegurl')
-        connection.end_headers()
-        
-        # For .acelive URLs
-        playlist = re.sub('^(http.+)$', lambda match: 'http://' + hostport + '/torrent/' + \
-            urllib2.quote(match.group(0), ''), Ttvplaylist.playlist, flags=re.MULTILINE)
-        # For PIDs
-        playlist = re.sub('^([0-9a-f]{40})$', 'http://' + hostport + '/pid/\\1', playlist, flags=re.MULTILINE)
-        connection.wfile.write(playlist)
+        # Rendered once per playlist download for every hostport and query
+        response = Ttvplaylist.cache.get((hostport, ) + params, Ttvplaylist.playlisttime,
+                                         lambda: Ttvplaylist.index.render(hostport, *params))
+        Ttvplaylist.cache.send(connection, response)
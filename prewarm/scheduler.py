@@ -0,0 +1,208 @@
+'''
+Channel prewarming scheduler.
+Learns how often channels are requested at every hour of the day and
+keeps the most popular ones started, so clients attach to them without
+waiting for engine prebuffering.
+'''
+
+import gevent
+import logging
+import time
+import streamer
+
+
+class PrewarmChannel(object):
+
+    '''
+    Prewarmed channel holder. Keeps the channel started with a local
+    request which gets headers only.
+    '''
+
+    def __init__(self, key, url, headers, timeout):
+        self.key = key
+        self.started = time.time()
+        # Channel is started and ready for clients
+        self.ready = False
+        # Holder is finished (evicted or channel failed)
+        self.finished = False
+        self._stream = None
+        self._greenlet = gevent.spawn(self._hold, url, headers, timeout)
+
+    def _hold(self, url, headers, timeout):
+        logger = logging.getLogger('PrewarmChannel_hold')
+        try:
+            self._stream = streamer.UpstreamStream(url, headers, timeout)
+            if self._stream.code != 200:
+                logger.error("Can't prewarm " + self.key + ", code " + str(self._stream.code))
+                return
+            self.ready = True
+            logger.debug("Prewarmed " + self.key)
+            # Nothing is sent after headers, returns when channel is stopped
+            self._stream.readinto(bytearray(4096), 4096)
+        except streamer.UpstreamException as e:
+            logger.error("Can't prewarm " + self.key + ": " + repr(e))
+        finally:
+            self.ready = False
+            self.finished = True
+            if self._stream:
+                self._stream.close()
+
+    def stop(self):
+        self._greenlet.kill()
+
+
+class PrewarmScheduler(object):
+
+    '''
+    Prewarming scheduler class.
+    Request counts are kept per hour of the day and halved every day, so
+    old habits fade out.
+    '''
+
+    def __init__(self, baseurl, channels, bandwidth=0, policy='lfu', min_requests=3, interval=60,
+                 timeout=40, token=None, speed=None, decay=0.5):
+        # Local proxy URL, e.g. http://127.0.0.1:8000/
+        self._baseurl = baseurl
+        # Maximum number of prewarmed channels
+        self._channels = channels
+        # Download bandwidth budget in KiB/s, 0 - unlimited
+        self._bandwidth = bandwidth
+        # 'lfu' - drop least requested at this hour, 'lru' - least recently requested
+        self._policy = policy
+        self._minrequests = min_requests
+        self._interval = interval
+        self._timeout = timeout
+        # Headers marking prewarming requests
+        self._headers = {'X-Prewarm': token}
+        # speed(key) returns channel download speed in KiB/s
+        self._speed = speed
+        self._decay = decay
+        # Request counts: hour -> {key: count}
+        self._hours = [dict() for i in xrange(24)]
+        # Day number the hour counts were last updated
+        self._days = [None] * 24
+        # Last request time of every key
+        self._lastseen = dict()
+        # Prewarmed channels: key -> PrewarmChannel
+        self._held = dict()
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        self._schedulergreenlet = gevent.spawn(self._scheduler)
+
+    def request(self, key):
+        '''
+        Record client request of the channel, key is 'pid/<id>' or
+        'torrent/<url>' as in request path. Returns True if the channel
+        was prewarmed.
+        '''
+        now = time.localtime()
+        hour = now.tm_hour
+        day = now.tm_yday
+        counts = self._hours[hour]
+        if self._days[hour] != day:
+            # New day for this hour, fading old counts
+            if self._days[hour] is not None:
+                for k in counts.keys():
+                    counts[k] *= self._decay
+                    if counts[k] < 0.1:
+                        del counts[k]
+            self._days[hour] = day
+        counts[key] = counts.get(key, 0) + 1
+        self._lastseen[key] = time.time()
+
+        channel = self._held.get(key)
+        if channel and channel.ready:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def isPrewarmed(self, key):
+        channel = self._held.get(key)
+        return bool(channel and channel.ready)
+
+    def stats(self):
+        scores = self._scores()
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hitrate': float(self.hits) / total if total else 0.0, 'evicted': self.evicted,
+                'channels': [{'key': key, 'ready': channel.ready, 'score': scores.get(key, 0),
+                              'age': int(time.time() - channel.started)}
+                             for key, channel in self._held.items()]}
+
+    def _scores(self):
+        '''
+        Popularity of channels for the current hour. Next hour counts
+        are added with half weight to start channels a bit in advance.
+        '''
+        hour = time.localtime().tm_hour
+        scores = dict(self._hours[hour])
+        for key, count in self._hours[(hour + 1) % 24].iteritems():
+            scores[key] = scores.get(key, 0) + count / 2.0
+        return scores
+
+    def _usedBandwidth(self):
+        if not self._speed:
+            return 0
+        return sum(self._speed(key) for key in self._held)
+
+    def _overBudget(self, extra=0):
+        if len(self._held) + extra > self._channels:
+            return True
+        return bool(self._bandwidth) and self._usedBandwidth() > self._bandwidth
+
+    def _victim(self, scores):
+        if not self._held:
+            return None
+        if self._policy == 'lru':
+            return min(self._held, key=lambda key: self._lastseen.get(key, 0))
+        return min(self._held, key=lambda key: scores.get(key, 0))
+
+    def _start(self, key):
+        self._held[key] = PrewarmChannel(key, self._baseurl + key, self._headers, self._timeout)
+
+    def _evict(self, key):
+        logging.getLogger('PrewarmScheduler_evict').debug("Evicting " + key)
+        self._held.pop(key).stop()
+        self.evicted += 1
+
+    def rebalance(self):
+        scores = self._scores()
+
+        for key in self._held.keys():
+            # Failed channels and channels which are not popular at this hour
+            if self._held[key].finished or scores.get(key, 0) < self._minrequests:
+                self._evict(key)
+
+        candidates = sorted((key for key in scores if scores[key] >= self._minrequests and key not in self._held),
+                            key=lambda key: scores[key], reverse=True)
+        for key in candidates:
+            if self._overBudget(1):
+                victim = self._victim(scores)
+                # Don't replace channels which are more popular
+                if victim is None or scores.get(victim, 0) >= scores[key]:
+                    break
+                self._evict(victim)
+                if self._overBudget(1):
+                    break
+            self._start(key)
+
+        while self._held and self._overBudget():
+            self._evict(self._victim(scores))
+
+    def _scheduler(self):
+        logger = logging.getLogger('PrewarmScheduler_scheduler')
+        while True:
+            gevent.sleep(self._interval)
+            try:
+                self.rebalance()
+            except Exception as e:
+                logger.error("Rebalance failed: " + repr(e))
+
+    def destroy(self):
+        self._schedulergreenlet.kill()
+        for key in self._held.keys():
+            self._evict(key)
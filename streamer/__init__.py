@@ -0,0 +1,8 @@
+from broadcaster import *
+from bufferpool import *
+from gopcache import *
+from hls import *
+from linereader import *
+from upstream import *
+from readiness import *
+from timeshift import *
@@ -0,0 +1,334 @@
+'''
+Per-channel stream broadcaster for AceProxy.
+One upstream reader fills a shared ring buffer and every client reads
+from it with its own cursor.
+'''
+
+import gevent
+import gevent.event
+import logging
+from bufferpool import BufferPool
+from gopcache import GopCache
+
+
+class BroadcastException(Exception):
+
+    '''
+    Exception from StreamBroadcaster
+    '''
+    pass
+
+
+class BroadcastCursor(object):
+
+    '''
+    Client position in the broadcaster and the chunks it is sending
+    '''
+    __slots__ = ('seq', 'held')
+
+    def __init__(self, seq):
+        # Sequence number of the next chunk to read
+        self.seq = seq
+        # Ring buffers of the last read() batch
+        self.held = ()
+
+
+class StreamBroadcaster(object):
+
+    '''
+    Stream broadcaster class
+    '''
+
+    # MPEG-TS packet size
+    TSPACKET = 188
+    # Smallest upstream read size
+    MINCHUNK = TSPACKET * 8
+    # Read size step when adapting to the stream bitrate
+    CHUNKSTEP = TSPACKET * 8
+
+    def __init__(self, buffersize=256, pool=None, gopcache=0, timeshift=None):
+        # Pool with preallocated buffers
+        self._pool = pool or BufferPool(StreamBroadcaster.TSPACKET * 64)
+        # Ring buffer with chunks
+        self._ring = [None] * buffersize
+        # Data lengths of the ring buffer chunks
+        self._lengths = [0] * buffersize
+        # Stream positions of the ring buffer chunks
+        self._positions = [0] * buffersize
+        # Bytes read from upstream
+        self.position = 0
+        # Ring buffer size (in chunks)
+        self._buffersize = buffersize
+        # Clients lagging more than that skip to the newer chunks
+        self._maxlag = max(buffersize / 2, 1)
+        # Attached client cursors, the ring goes back to the pool when the
+        # broadcaster is closed and all of them are detached
+        self._cursors = set()
+        # id(buffer) -> [buffer, clients sending it, replaced in the ring].
+        # The reader never refills a buffer which is being sent, it puts a
+        # new one to the ring and the old one goes to the pool on release
+        self._held = dict()
+        # Largest upstream read size (TS aligned)
+        self._maxchunk = self._pool.buffersize - self._pool.buffersize % StreamBroadcaster.TSPACKET
+        # Current upstream read size, adapts to the stream bitrate
+        self._chunksize = min(StreamBroadcaster.TSPACKET * 32, self._maxchunk)
+        # Sequence number of the next chunk written to the ring
+        self._head = 0
+        # Upstream video stream
+        self._video = None
+        # Upstream reader greenlet
+        self._readergreenlet = None
+        # New data event, replaced on every chunk
+        self._newdata = gevent.event.Event()
+        # Upstream connected event
+        self._ready = gevent.event.Event()
+        # Closed flag
+        self._closed = gevent.event.Event()
+        # Latest keyframe aligned part of the stream for new clients
+        # (maximum size in bytes, 0 disables it)
+        self._gopcache = GopCache(gopcache) if gopcache or timeshift else None
+        # On-disk copy of the stream for timeshifted clients (TimeshiftRing)
+        self.timeshift = timeshift
+        # Upstream response code and headers for the clients
+        self.code = None
+        self.headers = dict()
+
+    def start(self, video, code=200, headers=None):
+        '''
+        Start reading from upstream video stream.
+        video should have readinto(buffer, size) method.
+        '''
+        if self._closed.isSet():
+            video.close()
+            raise BroadcastException("Broadcaster is closed")
+
+        self._video = video
+        self.code = code
+        self.headers = headers or dict()
+        for i in xrange(self._buffersize):
+            self._ring[i] = self._pool.get()
+        self._readergreenlet = gevent.spawn(self._readUpstream)
+        self._ready.set()
+
+    def close(self):
+        '''
+        Stop upstream reader and wake up all the clients
+        '''
+        if self._closed.isSet():
+            return
+
+        logger = logging.getLogger('StreamBroadcaster_close')
+        logger.debug("Closing broadcaster")
+        self._closed.set()
+        # Wake up clients waiting for upstream
+        self._ready.set()
+        self._newdata.set()
+        if self._readergreenlet:
+            self._readergreenlet.kill(block=False)
+        if self._video:
+            try:
+                self._video.close()
+            except:
+                pass
+        if not self._cursors:
+            self._freeRing()
+        if self._gopcache:
+            self._gopcache.reset()
+        if self.timeshift:
+            self.timeshift.close()
+
+    def isClosed(self):
+        return self._closed.isSet()
+
+    def isReady(self):
+        '''
+        Upstream stream is connected (or broadcaster is closed)
+        '''
+        return self._ready.isSet()
+
+    def waitReady(self, timeout=None):
+        '''
+        Wait until the upstream stream is connected
+        '''
+        if not self._ready.wait(timeout):
+            raise BroadcastException("Upstream connection timeout")
+        if self._closed.isSet():
+            raise BroadcastException("Broadcaster is closed")
+
+    def attach(self):
+        '''
+        Return cursor for a new client (starts at the live tail).
+        Clients must detach() it when they stop reading.
+        '''
+        cursor = BroadcastCursor(self._head)
+        self._cursors.add(cursor)
+        return cursor
+
+    def detach(self, cursor):
+        '''
+        Release the chunks of the client
+        '''
+        self._release(cursor)
+        self._cursors.discard(cursor)
+        if self._closed.isSet() and not self._cursors:
+            self._freeRing()
+
+    def skipToLive(self, cursor):
+        '''
+        Move the cursor to the live tail
+        '''
+        self._release(cursor)
+        cursor.seq = self._head
+
+    def burst(self):
+        '''
+        Data to send to a new client before reading from attach() cursor:
+        latest PAT, PMT and the stream since the last keyframe.
+        Empty list if there is nothing cached.
+        '''
+        if self._gopcache and not self._closed.isSet():
+            return self._gopcache.burst()
+        return []
+
+    def streamHeaders(self):
+        '''
+        Latest PAT and PMT packets for clients starting from timeshift
+        '''
+        if self._gopcache and not self._closed.isSet():
+            return self._gopcache.streamHeaders()
+        return []
+
+    def positionOf(self, cursor):
+        '''
+        Stream position of the cursor, None if the chunk is gone
+        '''
+        if cursor.seq >= self._head:
+            return self.position
+        if self._head - cursor.seq > self._buffersize:
+            return None
+        return self._positions[cursor.seq % self._buffersize]
+
+    def read(self, cursor, timeout=None):
+        '''
+        Get chunks from cursor position.
+        Blocks until new data arrives.
+        Returns (list of read-only buffers, cursor). Buffers are valid
+        until the client asks for the next chunks or detaches.
+        '''
+        logger = logging.getLogger('StreamBroadcaster_read')
+
+        # Previous chunks are sent
+        self._release(cursor)
+        if cursor.seq == self._head:
+            if self._closed.isSet():
+                raise BroadcastException("Broadcaster is closed")
+            self._newdata.wait(timeout)
+            if cursor.seq == self._head:
+                if self._closed.isSet():
+                    raise BroadcastException("Broadcaster is closed")
+                return [], cursor
+
+        if self._closed.isSet():
+            raise BroadcastException("Broadcaster is closed")
+
+        if self._head - cursor.seq > self._maxlag:
+            # Client is too slow, skipping to the oldest chunk we still have
+            logger.warning("Client is too slow, skipping " +
+                           str(self._head - cursor.seq - self._maxlag) + " chunks")
+            cursor.seq = self._head - self._maxlag
+
+        head = self._head
+        chunks = list()
+        held = list()
+        for i in xrange(cursor.seq, head):
+            i %= self._buffersize
+            buf = self._ring[i]
+            chunks.append(buffer(buf, 0, self._lengths[i]))
+            held.append(buf)
+            entry = self._held.get(id(buf))
+            if entry:
+                entry[1] += 1
+            else:
+                self._held[id(buf)] = [buf, 1, False]
+        cursor.held = held
+        cursor.seq = head
+        return chunks, cursor
+
+    def _release(self, cursor):
+        '''
+        Client doesn't send the chunks of the last read() anymore
+        '''
+        for buf in cursor.held:
+            entry = self._held[id(buf)]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._held[id(buf)]
+                if entry[2]:
+                    # Replaced in the ring or the ring is freed already
+                    self._pool.put(buf)
+        cursor.held = ()
+
+    def _freeRing(self):
+        '''
+        Give ring buffers back to the pool
+        '''
+        for i in xrange(self._buffersize):
+            buf = self._ring[i]
+            if buf is not None:
+                entry = self._held.get(id(buf))
+                if entry:
+                    entry[2] = True
+                else:
+                    self._pool.put(buf)
+                self._ring[i] = None
+
+    def _readUpstream(self):
+        '''
+        Upstream reader method for greenlet
+        '''
+        logger = logging.getLogger('StreamBroadcaster_readUpstream')
+        logger.debug("Started")
+
+        try:
+            while True:
+                i = self._head % self._buffersize
+                entry = self._held.get(id(self._ring[i]))
+                if entry:
+                    # Slow client is still sending this buffer
+                    entry[2] = True
+                    self._ring[i] = self._pool.get()
+                # Blocks until the upstream socket is readable
+                n = self._video.readinto(self._ring[i], self._chunksize)
+                if not n:
+                    logger.debug("Upstream stream ended")
+                    break
+                self._lengths[i] = n
+                self._positions[i] = self.position
+                data = buffer(self._ring[i], 0, n)
+                keyframe = self._gopcache.feed(data) if self._gopcache else None
+                if self.timeshift:
+                    self.timeshift.write(data, keyframe)
+                self.position += n
+                self._head += 1
+                self._adaptChunkSize(n)
+                # Wake up clients
+                newdata = self._newdata
+                self._newdata = gevent.event.Event()
+                newdata.set()
+        except gevent.GreenletExit:
+            return
+        except Exception as e:
+            logger.debug("Upstream connection dropped " + repr(e))
+
+        self._readergreenlet = None
+        self.close()
+
+    def _adaptChunkSize(self, n):
+        '''
+        Bigger reads for high bitrate streams, smaller for low bitrate ones
+        '''
+        if n == self._chunksize:
+            if self._chunksize < self._maxchunk:
+                self._chunksize = min(self._chunksize + StreamBroadcaster.CHUNKSTEP, self._maxchunk)
+        elif n < self._chunksize / 4 and self._chunksize > StreamBroadcaster.MINCHUNK:
+            self._chunksize = max(self._chunksize - StreamBroadcaster.CHUNKSTEP, StreamBroadcaster.MINCHUNK)
@@ -0,0 +1,36 @@
+'''
+Pool of preallocated buffers for the stream read path.
+'''
+
+
+class BufferPool(object):
+
+    '''
+    Buffer pool class
+    '''
+
+    def __init__(self, buffersize, maxfree=4096):
+        # Size of every buffer
+        self.buffersize = buffersize
+        # Maximum number of free buffers kept in the pool
+        self._maxfree = maxfree
+        # Free buffers
+        self._free = list()
+
+    def get(self):
+        '''
+        Get a buffer from the pool or allocate a new one
+        '''
+        if self._free:
+            return self._free.pop()
+        return bytearray(self.buffersize)
+
+    def put(self, buf):
+        '''
+        Return a buffer to the pool
+        '''
+        if len(self._free) < self._maxfree:
+            self._free.append(buf)
+
+    def free(self):
+        return len(self._free)
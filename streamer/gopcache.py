@@ -0,0 +1,288 @@
+'''
+Keyframe aligned MPEG-TS cache for channel broadcasters.
+Keeps the latest PAT, PMT and the stream since the last random access
+point, so new clients get a picture without waiting for the next keyframe.
+'''
+
+import struct
+
+TSPACKET = 188
+# Most packet headers unpacked at once
+MAXBATCH = 256
+# Packet count -> struct of their first 6 bytes
+HEADERS = dict()
+SYNCBYTE = '\x47'
+STARTCODE = '\x00\x00\x01'
+NULLPID = 0x1FFF
+# Null packet, players skip it
+NULLPACKET = SYNCBYTE + '\x1f\xff\x10' + '\xff' * (TSPACKET - 4)
+
+# PMT stream types of video streams
+MPEG2VIDEO = (0x01, 0x02)
+H264VIDEO = (0x1B, )
+HEVCVIDEO = (0x24, )
+VIDEOTYPES = MPEG2VIDEO + H264VIDEO + HEVCVIDEO + (0x10, )
+
+# NAL unit types starting a decodable picture (SPS, IDR)
+H264KEYNALS = (5, 7)
+# VPS, SPS, IDR, CRA
+HEVCKEYNALS = (16, 17, 18, 19, 20, 21, 32, 33)
+# MPEG-2 sequence header
+MPEG2SEQHEADER = 0xB3
+
+
+class GopCache(object):
+
+    '''
+    GOP cache class.
+    Stream chunks are fed as they come from upstream, chunks don't have
+    to be TS packet aligned.
+    '''
+
+    def __init__(self, maxsize=4 * 1024 * 1024):
+        # Cache is dropped if GOP is bigger than that, 0 - keyframes are
+        # only detected, not cached
+        self._maxsize = maxsize
+        # Latest PAT packet
+        self._pat = None
+        # PMT PID -> latest PMT packet
+        self._pmts = dict()
+        # Video PID -> stream type
+        self._video = dict()
+        # Stream since the last keyframe, None until we see one
+        self._gop = None
+        self._size = 0
+        # Incomplete packet from the end of the previous chunk
+        self._leftover = ''
+        # Parse position in the current chunk
+        self._pos = 0
+        # PTS of the last keyframe (90 kHz), None if it's unknown
+        self.keyframepts = None
+        # Counters
+        self.keyframes = 0
+        self.overflows = 0
+
+    def feed(self, chunk):
+        '''
+        Returns offset of the last keyframe packet from the chunk start
+        (negative if it started in the previous chunk) or None.
+        chunk may be a buffer of a reused bytearray, it's parsed in place
+        and only copied if it's kept in the cache.
+        '''
+        leftover = self._leftover
+        skip = len(leftover)
+        keyframe = None
+        data = chunk
+        pos = 0
+
+        if leftover:
+            if leftover[0] != SYNCBYTE or len(chunk) < TSPACKET - skip:
+                # Sync is lost or the chunk is tiny, both are rare
+                data = leftover + chunk[:]
+            else:
+                # Packet started in the previous chunk
+                pos = TSPACKET - skip
+                if self._parse(leftover + chunk[:pos], 0, 0) is not None:
+                    keyframe = -skip
+        last = self._parse(data, pos, len(data) - TSPACKET)
+        if last is not None:
+            keyframe = last if data is chunk else last - skip
+        pos = self._pos
+        self._leftover = data[pos:] if pos < len(data) else ''
+
+        if keyframe is not None:
+            # New GOP starts, previous chunks are not needed anymore
+            self.keyframes += 1
+            if self._maxsize:
+                if keyframe >= 0:
+                    self._gop = [chunk[keyframe:]]
+                else:
+                    self._gop = [leftover[keyframe + skip:] + chunk[:]]
+                self._size = len(self._gop[0])
+        elif self._gop is not None:
+            self._gop.append(chunk[:])
+            self._size += len(chunk)
+            if self._size > self._maxsize:
+                self.overflows += 1
+                self._gop = None
+
+        return keyframe
+
+    def _parse(self, data, pos, end):
+        '''
+        Parse packets from pos up to end (last packet start), returns
+        position of the last keyframe packet or None. Position after the
+        last parsed packet is left in self._pos.
+        '''
+        keyframe = None
+        while pos <= end:
+            if data[pos] != SYNCBYTE:
+                pos = self._sync(data, pos + 1)
+                continue
+
+            # Headers of all the packets are unpacked at once
+            count = min((end - pos) / TSPACKET + 1, MAXBATCH)
+            headers = HEADERS.get(count)
+            if not headers:
+                headers = HEADERS[count] = struct.Struct('>' + '6B182x' * count)
+            fields = headers.unpack_from(data, pos)
+            for i in xrange(0, count * 6, 6):
+                sync, b1, b2, b3, aflen, afflags = fields[i:i + 6]
+                if sync != 0x47:
+                    break
+                pid = ((b1 & 0x1F) << 8) | b2
+                if not (b1 & 0x40 or (b3 & 0x20 and aflen and afflags & 0x40)):
+                    # Tables and keyframes start with PUSI or RAI
+                    continue
+                if pid == NULLPID or (pid and pid not in self._pmts and
+                                      (pid not in self._video if self._video else not b3 & 0x20)):
+                    continue
+                start = pos + i / 6 * TSPACKET
+                # Only the packets we look into are copied
+                packet = data[start:start + TSPACKET]
+                if self._packet(packet, pid, b1 & 0x40, (b3 >> 4) & 3):
+                    keyframe = start
+            else:
+                pos += count * TSPACKET
+                continue
+            # Sync is lost
+            pos += i / 6 * TSPACKET
+
+        self._pos = pos
+        return keyframe
+
+    def _packet(self, packet, pid, pusi, afc):
+        '''
+        Look into table or video packet, True if it's a keyframe
+        '''
+        payload = 4
+        rai = False
+        if afc & 2:
+            aflen = ord(packet[4])
+            rai = aflen and ord(packet[5]) & 0x40
+            payload += 1 + aflen
+
+        if pid == 0:
+            if pusi and payload < TSPACKET:
+                self._pat = packet
+                self._parsePat(packet, payload, TSPACKET)
+        elif pid in self._pmts:
+            if pusi and payload < TSPACKET:
+                self._pmts[pid] = packet
+                self._parsePmt(packet, payload, TSPACKET)
+        elif pid in self._video or (not self._video and rai):
+            pes = pusi and afc & 1 and payload < TSPACKET
+            if rai or (pes and self._isKeyframe(packet, payload, TSPACKET, self._video.get(pid))):
+                self.keyframepts = self._pts(packet, payload, TSPACKET) if pes else None
+                return True
+        return False
+
+    def burst(self):
+        '''
+        Data for a new client, ends right after the last fed chunk.
+        Empty list if there is no keyframe in the cache.
+        '''
+        if self._gop is None:
+            return []
+        burst = list()
+        if self._pat:
+            burst.append(self._pat)
+        burst.extend(pmt for pmt in self._pmts.itervalues() if pmt)
+        burst.extend(self._gop)
+        return burst
+
+    def streamHeaders(self):
+        '''
+        Latest PAT and PMT packets
+        '''
+        headers = [self._pat] if self._pat else []
+        headers.extend(pmt for pmt in self._pmts.itervalues() if pmt)
+        return headers
+
+    def reset(self):
+        self._gop = None
+        self._size = 0
+        self._leftover = ''
+
+    @staticmethod
+    def _sync(data, pos):
+        '''
+        Find next packet start after a sync loss
+        '''
+        # Buffers can't be searched, sync loss is rare
+        tail = data[pos:]
+        i = 0
+        while True:
+            i = tail.find(SYNCBYTE, i)
+            if i == -1:
+                return len(data)
+            if i + TSPACKET >= len(tail) or tail[i + TSPACKET] == SYNCBYTE:
+                return pos + i
+            i += 1
+
+    def _section(self, data, payload, end):
+        '''
+        Table section start and end (without CRC) in the packet
+        '''
+        start = payload + 1 + ord(data[payload])
+        if start + 3 > end:
+            return None, None
+        length = ((ord(data[start + 1]) & 0x0F) << 8) | ord(data[start + 2])
+        return start, min(start + 3 + length - 4, end)
+
+    def _parsePat(self, data, payload, end):
+        start, stop = self._section(data, payload, end)
+        if start is None or data[start] != '\x00':
+            return
+        pmtpids = set()
+        for i in xrange(start + 8, stop - 3, 4):
+            program = (ord(data[i]) << 8) | ord(data[i + 1])
+            # Program 0 is NIT
+            if program:
+                pmtpids.add(((ord(data[i + 2]) & 0x1F) << 8) | ord(data[i + 3]))
+        if pmtpids and pmtpids != set(self._pmts):
+            self._pmts = dict((pid, self._pmts.get(pid)) for pid in pmtpids)
+            self._video = dict()
+
+    def _parsePmt(self, data, payload, end):
+        start, stop = self._section(data, payload, end)
+        if start is None or data[start] != '\x02' or start + 12 > stop:
+            return
+        i = start + 12 + (((ord(data[start + 10]) & 0x0F) << 8) | ord(data[start + 11]))
+        while i + 5 <= stop:
+            streamtype = ord(data[i])
+            pid = ((ord(data[i + 1]) & 0x1F) << 8) | ord(data[i + 2])
+            if streamtype in VIDEOTYPES:
+                self._video[pid] = streamtype
+            i += 5 + (((ord(data[i + 3]) & 0x0F) << 8) | ord(data[i + 4]))
+
+    @staticmethod
+    def _pts(data, payload, end):
+        '''
+        PTS from PES header
+        '''
+        if data[payload:payload + 3] != STARTCODE or payload + 14 > end or not ord(data[payload + 7]) & 0x80:
+            return None
+        b = [ord(c) for c in data[payload + 9:payload + 14]]
+        return ((b[0] >> 1) & 7) << 30 | b[1] << 22 | (b[2] >> 1) << 15 | b[3] << 7 | b[4] >> 1
+
+    @staticmethod
+    def _isKeyframe(data, payload, end, streamtype):
+        '''
+        Look for SPS/IDR or sequence header at the start of video PES
+        '''
+        if data[payload:payload + 3] != STARTCODE or payload + 9 > end:
+            return False
+        i = data.find(STARTCODE, payload + 9 + ord(data[payload + 8]), end)
+        while i != -1 and i + 3 < end:
+            unit = ord(data[i + 3])
+            if streamtype in H264VIDEO:
+                if unit & 0x1F in H264KEYNALS:
+                    return True
+            elif streamtype in HEVCVIDEO:
+                if (unit >> 1) & 0x3F in HEVCKEYNALS:
+                    return True
+            elif unit == MPEG2SEQHEADER:
+                return True
+            i = data.find(STARTCODE, i + 3, end)
+        return False
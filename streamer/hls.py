@@ -0,0 +1,250 @@
+'''
+HLS output for AceProxy.
+Channel stream is cut into keyframe aligned segments kept in memory and
+served with a sliding playlist.
+'''
+
+import gevent
+import gevent.event
+import logging
+import math
+import time
+from collections import deque
+from gopcache import GopCache, TSPACKET
+from upstream import UpstreamStream, UpstreamException
+
+# PTS clock rate and wrap around
+PTSRATE = 90000.0
+PTSWRAP = 1 << 33
+
+
+class HlsSegment(object):
+    __slots__ = ('sequence', 'duration', 'data')
+
+    def __init__(self, sequence, duration, data):
+        self.sequence = sequence
+        self.duration = duration
+        self.data = data
+
+
+class HlsSegmenter(object):
+
+    '''
+    Segmenter of one channel. Reads the channel stream from url.
+    '''
+
+    # Upstream read size
+    READSIZE = TSPACKET * 64
+
+    def __init__(self, url, headers=None, target=4, window=6, timeout=40, maxsegment=16 * 1024 * 1024):
+        # Segment duration
+        self._target = target
+        # Segments in the playlist
+        self._window = window
+        # Segment is cut without keyframe if it's bigger than that
+        self._maxsegment = maxsegment
+        # Finished segments, oldest first
+        self._segments = deque()
+        # Sequence number of the segment being filled
+        self._sequence = 0
+        # Parts of the segment being filled
+        self._parts = list()
+        self._size = 0
+        # Start time and PTS of the segment being filled
+        self._segmentstart = None
+        self._segmentpts = None
+        self._started = time.time()
+        # Keyframe detector
+        self._keyframes = GopCache(0)
+        # Set and replaced on every new segment
+        self._newsegment = gevent.event.Event()
+        self.closed = False
+        # Last client request time
+        self.lastaccess = time.time()
+        self._video = None
+        self._readergreenlet = gevent.spawn(self._read, url, headers, timeout)
+
+    def _read(self, url, headers, timeout):
+        logger = logging.getLogger('HlsSegmenter_read')
+        try:
+            self._video = UpstreamStream(url, headers, timeout)
+            if self._video.code != 200:
+                raise UpstreamException("Upstream code " + str(self._video.code))
+            buf = bytearray(HlsSegmenter.READSIZE)
+            carry = ''
+            while True:
+                n = self._video.readinto(buf, HlsSegmenter.READSIZE)
+                if not n:
+                    logger.debug("Upstream stream ended")
+                    break
+                # Keeping segment boundaries on TS packets
+                data = carry + str(buffer(buf, 0, n))
+                aligned = len(data) - len(data) % TSPACKET
+                carry = data[aligned:]
+                if aligned:
+                    data = data[:aligned]
+                    self._append(data, self._keyframes.feed(data))
+        except gevent.GreenletExit:
+            pass
+        except Exception as e:
+            logger.error("Segmenting stopped: " + repr(e))
+        finally:
+            self.close()
+
+    def _append(self, data, keyframe):
+        now = time.time()
+        if self._segmentstart is None:
+            # First segment starts with keyframe, don't wait for it forever
+            if keyframe is None and now - self._started < self._target * 3:
+                return
+            self._begin(data[keyframe or 0:], now)
+            return
+
+        duration = self._duration(now)
+        if keyframe is not None and duration >= self._target:
+            self._parts.append(data[:keyframe])
+            self._finish(duration)
+            self._begin(data[keyframe:], now)
+        elif duration >= self._target * 3 or self._size >= self._maxsegment:
+            # Stream without keyframes we can find
+            self._parts.append(data)
+            self._finish(duration)
+            self._begin('', now)
+        else:
+            self._parts.append(data)
+            self._size += len(data)
+
+    def _duration(self, now):
+        '''
+        Duration of the segment being filled by keyframe PTS, by the
+        clock if there are no PTS
+        '''
+        pts = self._keyframes.keyframepts
+        if self._segmentpts is not None and pts is not None:
+            duration = ((pts - self._segmentpts) % PTSWRAP) / PTSRATE
+            if 0 < duration < self._target * 10:
+                return duration
+        return now - self._segmentstart
+
+    def _begin(self, data, now):
+        # Every segment can be decoded on its own
+        self._parts = self._keyframes.streamHeaders() + [data]
+        self._size = sum(len(part) for part in self._parts)
+        self._segmentstart = now
+        self._segmentpts = self._keyframes.keyframepts
+
+    def _finish(self, duration):
+        self._segments.append(HlsSegment(self._sequence, duration, ''.join(self._parts)))
+        self._sequence += 1
+        while len(self._segments) > self._window:
+            self._segments.popleft()
+        newsegment = self._newsegment
+        self._newsegment = gevent.event.Event()
+        newsegment.set()
+
+    def touch(self):
+        self.lastaccess = time.time()
+
+    def playlist(self, timeout=None):
+        '''
+        Sliding playlist, waits for the first segment. None on timeout.
+        '''
+        self.touch()
+        if not self._segments:
+            if self.closed:
+                return None
+            self._newsegment.wait(timeout)
+            if not self._segments:
+                return None
+
+        segments = list(self._segments)
+        playlist = '#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:' + \
+            str(int(math.ceil(max(segment.duration for segment in segments)))) + \
+            '\n#EXT-X-MEDIA-SEQUENCE:' + str(segments[0].sequence) + '\n'
+        for segment in segments:
+            playlist += '#EXTINF:' + '%.3f' % segment.duration + ',\nhls/' + str(segment.sequence) + '.ts\n'
+        return playlist
+
+    def segment(self, sequence):
+        '''
+        Segment data, waits for the segment being filled. None if there is
+        no such segment.
+        '''
+        self.touch()
+        if sequence == self._sequence and not self.closed:
+            self._newsegment.wait(self._target * 3)
+        if not self._segments:
+            return None
+        i = sequence - self._segments[0].sequence
+        if 0 <= i < len(self._segments):
+            return self._segments[i].data
+        return None
+
+    def maxAge(self):
+        '''
+        How long a segment stays in the playlist
+        '''
+        return self._target * self._window
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._newsegment.set()
+        if self._video:
+            self._video.close()
+        if gevent.getcurrent() is not self._readergreenlet:
+            self._readergreenlet.kill(block=False)
+
+
+class HlsManager(object):
+
+    '''
+    Channel segmenters. Segmenting stops when nobody requests the channel
+    for a while.
+    '''
+
+    def __init__(self, baseurl, headers=None, target=4, window=6, idle=30, timeout=40):
+        # Local proxy URL, e.g. http://127.0.0.1:8000/
+        self._baseurl = baseurl
+        # Headers marking segmenter requests
+        self._headers = headers
+        self._target = target
+        self._window = window
+        self._idle = idle
+        self._timeout = timeout
+        # Channel key ('pid/<id>' or 'torrent/<url>') -> HlsSegmenter
+        self.segmenters = dict()
+        self._reapergreenlet = gevent.spawn(self._reaper)
+
+    def get(self, key, create=True):
+        '''
+        Segmenter of the channel, started if create is set. None if it's
+        not running and create is not set.
+        '''
+        segmenter = self.segmenters.get(key)
+        if segmenter is None or segmenter.closed:
+            if not create:
+                return None
+            logging.getLogger('HlsManager_get').debug("Segmenting " + key)
+            segmenter = HlsSegmenter(self._baseurl + key, self._headers, self._target, self._window, self._timeout)
+            self.segmenters[key] = segmenter
+        return segmenter
+
+    def _reaper(self):
+        logger = logging.getLogger('HlsManager_reaper')
+        while True:
+            gevent.sleep(max(self._idle / 2, 1))
+            now = time.time()
+            for key in self.segmenters.keys():
+                segmenter = self.segmenters[key]
+                if segmenter.closed or now - segmenter.lastaccess > self._idle:
+                    logger.debug("Stopping idle segmenter " + key)
+                    segmenter.close()
+                    del self.segmenters[key]
+
+    def destroy(self):
+        self._reapergreenlet.kill()
+        for segmenter in self.segmenters.values():
+            segmenter.close()
+        self.segmenters.clear()
@@ -0,0 +1,59 @@
+'''
+Buffered line reader for the engine and VLC control connections.
+Every socket read is split into lines at once, there is no telnet option
+processing these protocols don't use.
+'''
+
+import gevent.socket
+from collections import deque
+
+
+class LineReader(object):
+
+    '''
+    Line protocol connection. Lines are returned without '\\n', '\\r' is
+    left to the caller.
+    '''
+
+    # Socket read size
+    READSIZE = 65536
+    # Incomplete line longer than that is dropped (LOADRESP of a torrent
+    # with a lot of files is long)
+    MAXLINE = 1024 * 1024
+
+    def __init__(self, host, port, timeout=5):
+        self._socket = gevent.socket.create_connection((host, port), timeout)
+        # Control connections are quiet for a long time
+        self._socket.settimeout(None)
+        # Complete lines from the last reads, oldest first
+        self._lines = deque()
+        # Incomplete line at the end of the last read
+        self._partial = ''
+
+    def readline(self):
+        '''
+        Next line, blocks until there is one. Raises EOFError when the
+        connection is closed.
+        '''
+        while not self._lines:
+            data = self._socket.recv(LineReader.READSIZE)
+            if not data:
+                raise EOFError("Connection closed")
+            lines = (self._partial + data).split('\n')
+            self._partial = lines.pop()
+            if len(self._partial) > LineReader.MAXLINE:
+                self._partial = ''
+            self._lines.extend(lines)
+        return self._lines.popleft()
+
+    def write(self, data):
+        try:
+            self._socket.sendall(data)
+        except gevent.socket.error as e:
+            raise EOFError(repr(e))
+
+    def close(self):
+        try:
+            self._socket.close()
+        except:
+            pass
@@ -0,0 +1,60 @@
+'''
+Stream readiness helpers: probing upstream instead of fixed sleeps and
+channel start stage timings.
+'''
+
+import gevent
+import logging
+import time
+from upstream import UpstreamStream, UpstreamException
+
+
+class StageTimer(object):
+
+    '''
+    Records how long every stage of channel start took
+    '''
+
+    def __init__(self):
+        self._start = self._last = time.time()
+        # List of (stage, duration)
+        self.stages = list()
+
+    def mark(self, stage):
+        now = time.time()
+        self.stages.append((stage, now - self._last))
+        self._last = now
+
+    def total(self):
+        return self._last - self._start
+
+    def __str__(self):
+        return ' '.join(stage + '=' + '%.3f' % duration for stage, duration in self.stages) + \
+            ' total=' + '%.3f' % self.total()
+
+
+def openWhenReady(url, headers=None, timeout=10, delay=0.05, maxdelay=0.5):
+    '''
+    Probe url with short backoff until it answers with 200 and return the
+    opened UpstreamStream
+    '''
+    logger = logging.getLogger('streamer_openWhenReady')
+
+    deadline = time.time() + timeout
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            stream = UpstreamStream(url, headers, max(deadline - time.time(), delay))
+            if stream.code == 200:
+                logger.debug(url + " is ready after " + str(attempts) + " attempts")
+                return stream
+            error = "HTTP " + str(stream.code)
+            stream.close()
+        except UpstreamException as e:
+            error = repr(e)
+
+        if time.time() + delay > deadline:
+            raise UpstreamException(url + " is not ready: " + error)
+        gevent.sleep(delay)
+        delay = min(delay * 2, maxdelay)
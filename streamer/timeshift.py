@@ -0,0 +1,124 @@
+'''
+On-disk timeshift ring buffer for channel broadcasters.
+Channel stream is written into a fixed size memory mapped file, clients
+can start from an earlier point and read at their own pace.
+'''
+
+import logging
+import mmap
+import os
+import time
+from collections import deque
+
+
+class TimeshiftException(Exception):
+
+    '''
+    Exception from TimeshiftRing
+    '''
+    pass
+
+
+class TimeshiftRing(object):
+
+    '''
+    Timeshift ring file class.
+    Positions are absolute stream offsets (bytes since channel start).
+    '''
+
+    # Index point every that many seconds if no keyframes are found
+    INDEXINTERVAL = 10
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        # Bytes written since channel start
+        self.written = 0
+        # (time, position) of keyframes, oldest first
+        self._index = deque()
+        # Part of the ring the writer may overwrite while the data is
+        # being sent, readers don't go there
+        self._margin = size / 8
+
+        try:
+            self._file = open(path, 'w+b')
+            self._file.truncate(size)
+            self._mmap = mmap.mmap(self._file.fileno(), size)
+        except (IOError, OSError, mmap.error) as e:
+            raise TimeshiftException("Can't create timeshift file " + path + " " + repr(e))
+        logging.getLogger('TimeshiftRing_init').debug("Created " + path)
+
+    def write(self, data, keyframe=None):
+        '''
+        Append chunk of the stream. keyframe is offset of the keyframe
+        packet from the chunk start (may be negative if the packet started
+        in the previous chunk).
+        '''
+        now = time.time()
+        if keyframe is not None:
+            self._index.append((now, max(self.written + keyframe, 0)))
+        elif not self._index or now - self._index[-1][0] >= TimeshiftRing.INDEXINTERVAL:
+            # No keyframes recently, any point is better than nothing
+            self._index.append((now, self.written))
+
+        n = len(data)
+        offset = self.written % self.size
+        first = min(n, self.size - offset)
+        self._mmap.seek(offset)
+        self._mmap.write(buffer(data, 0, first))
+        if first < n:
+            self._mmap.seek(0)
+            self._mmap.write(buffer(data, first, n - first))
+        self.written += n
+
+        oldest = self.oldest()
+        while self._index and self._index[0][1] < oldest:
+            self._index.popleft()
+
+    def oldest(self):
+        '''
+        Oldest position which is safe to read
+        '''
+        return max(self.written - self.size + self._margin, 0)
+
+    def seek(self, offset):
+        '''
+        Keyframe position offset seconds ago (offset is negative), oldest
+        one if we don't have that much. None if nothing is indexed yet.
+        '''
+        if not self._index:
+            return None
+        target = time.time() + offset
+        position = self._index[0][1]
+        for when, pos in self._index:
+            if when > target:
+                break
+            position = pos
+        return position
+
+    def contains(self, position):
+        return self.oldest() <= position <= self.written
+
+    def read(self, position, size):
+        '''
+        Read up to size bytes from position.
+        Returns (data, new position). Client which is too slow skips to
+        the oldest keyframe.
+        '''
+        if position < self.oldest():
+            logging.getLogger('TimeshiftRing_read').warning("Client is too slow, skipping " +
+                                                            str(self.oldest() - position) + " bytes")
+            position = self._index[0][1] if self._index else self.oldest()
+        size = min(size, self.written - position)
+        offset = position % self.size
+        size = min(size, self.size - offset)
+        # A copy, writer may overwrite this part while it's being sent
+        return self._mmap[offset:offset + size], position + size
+
+    def close(self):
+        try:
+            self._mmap.close()
+            self._file.close()
+            os.remove(self.path)
+        except (IOError, OSError):
+            pass
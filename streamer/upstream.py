@@ -0,0 +1,112 @@
+'''
+Minimal HTTP client for reading video streams into preallocated buffers.
+'''
+
+import gevent
+import gevent.socket
+import logging
+import urlparse
+
+
+class UpstreamException(Exception):
+
+    '''
+    Exception from UpstreamStream
+    '''
+    pass
+
+
+class UpstreamStream(object):
+
+    '''
+    Upstream video stream class
+    '''
+
+    # Maximum size of the response headers
+    MAXHEADERS = 65536
+    # Request headers we set ourselves and proxy internal ones (prewarm
+    # and HLS segmenter requests tokens)
+    SKIPHEADERS = ('host', 'connection', 'keep-alive', 'x-prewarm', 'x-segmenter')
+
+    def __init__(self, url, headers=None, timeout=10):
+        # Response code
+        self.code = None
+        # Response headers (lowercase names)
+        self.headers = dict()
+        # Body data received together with headers
+        self._pending = None
+        # Upstream socket
+        self._socket = None
+
+        logger = logging.getLogger('UpstreamStream_init')
+
+        parsed = urlparse.urlsplit(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+
+        request = 'GET ' + path + ' HTTP/1.0\r\nHost: ' + parsed.netloc + '\r\n'
+        if headers:
+            for key in headers:
+                if key.lower() not in UpstreamStream.SKIPHEADERS:
+                    request += key + ': ' + headers[key] + '\r\n'
+        request += 'Connection: close\r\n\r\n'
+
+        try:
+            self._socket = gevent.socket.create_connection(
+                (parsed.hostname, parsed.port or 80), timeout)
+            self._socket.sendall(request)
+            self._readHeaders()
+        except UpstreamException:
+            self.close()
+            raise
+        except Exception as e:
+            self.close()
+            raise UpstreamException("Can't open " + url + " " + repr(e))
+
+        # Stream may pause for a while, don't time out on it
+        self._socket.settimeout(None)
+        logger.debug("Opened " + url + " with code " + str(self.code))
+
+    def _readHeaders(self):
+        data = ''
+        while '\r\n\r\n' not in data:
+            chunk = self._socket.recv(4096)
+            if not chunk:
+                raise UpstreamException("Connection closed before headers")
+            data += chunk
+            if len(data) > UpstreamStream.MAXHEADERS:
+                raise UpstreamException("Headers are too long")
+
+        head, self._pending = data.split('\r\n\r\n', 1)
+        lines = head.split('\r\n')
+        try:
+            self.code = int(lines[0].split()[1])
+        except (IndexError, ValueError):
+            raise UpstreamException("Bad status line " + repr(lines[0]))
+
+        for line in lines[1:]:
+            key, sep, value = line.partition(':')
+            if sep:
+                self.headers[key.strip().lower()] = value.strip()
+
+    def readinto(self, buf, size):
+        '''
+        Read up to size bytes into buf.
+        Blocks until the socket is readable, returns 0 on EOF.
+        '''
+        if self._pending:
+            n = min(size, len(self._pending))
+            buf[0:n] = self._pending[:n]
+            self._pending = self._pending[n:]
+            return n
+
+        return self._socket.recv_into(buf, size)
+
+    def close(self):
+        if self._socket:
+            try:
+                self._socket.close()
+            except:
+                pass
+            self._socket = None
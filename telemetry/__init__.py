@@ -0,0 +1,3 @@
+from metrics import *
+from proxymetrics import *
+from tracing import *
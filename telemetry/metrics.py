@@ -0,0 +1,148 @@
+'''
+Minimal Prometheus style metrics.
+Updates are plain dict and list operations without locks (everything
+runs in gevent greenlets), text is rendered only when metrics are scraped.
+'''
+
+from bisect import bisect_left
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [name + '="' + _escape(value) + '"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = list()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = list()
+        for metric in self.metrics:
+            metric.render(lines)
+        return '\n'.join(lines) + '\n'
+
+
+# Registry rendered on /metrics
+REGISTRY = Registry()
+
+
+class Counter(object):
+
+    '''
+    Counter with optional labels, label values are passed as a tuple
+    '''
+
+    TYPE = 'counter'
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # Label values tuple -> value
+        self.values = dict()
+        if not labels:
+            self.values[()] = 0
+        if registry is not None:
+            registry.register(self)
+
+    def inc(self, labels=(), value=1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def samples(self):
+        return self.values.iteritems()
+
+    def render(self, lines):
+        lines.append('# HELP ' + self.name + ' ' + self.help)
+        lines.append('# TYPE ' + self.name + ' ' + self.TYPE)
+        for labels, value in self.samples():
+            lines.append(self.name + _labels(self.labels, labels) + ' ' + _number(value))
+
+
+class Gauge(Counter):
+
+    '''
+    Gauge, either set directly or collected by callback on scrape.
+    callback returns dict of label values tuple -> value.
+    '''
+
+    TYPE = 'gauge'
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY, callback=None):
+        Counter.__init__(self, name, help, labels, registry)
+        self.callback = callback
+
+    def set(self, value, labels=()):
+        self.values[labels] = value
+
+    def dec(self, labels=(), value=1):
+        self.values[labels] = self.values.get(labels, 0) - value
+
+    def samples(self):
+        if self.callback:
+            return self.callback().iteritems()
+        return self.values.iteritems()
+
+
+class CallbackCounter(Gauge):
+
+    '''
+    Counter collected by callback on scrape
+    '''
+
+    TYPE = 'counter'
+
+
+class Histogram(object):
+
+    TYPE = 'histogram'
+    # Seconds, from fast cache hits to slow engine prebuffering
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40)
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # Label values tuple -> [bucket counts (last one is +Inf), sum]
+        self.values = dict()
+        if registry is not None:
+            registry.register(self)
+
+    def observe(self, value, labels=()):
+        data = self.values.get(labels)
+        if data is None:
+            data = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        data[0][bisect_left(self.buckets, value)] += 1
+        data[1] += value
+
+    def render(self, lines):
+        lines.append('# HELP ' + self.name + ' ' + self.help)
+        lines.append('# TYPE ' + self.name + ' ' + self.TYPE)
+        for labels, (counts, total) in self.values.iteritems():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'), ), counts):
+                cumulative += count
+                lines.append(self.name + '_bucket' + _labels(self.labels, labels, 'le="' + _number(float(bound)) + '"') +
+                             ' ' + str(cumulative))
+            lines.append(self.name + '_sum' + _labels(self.labels, labels) + ' ' + _number(total))
+            lines.append(self.name + '_count' + _labels(self.labels, labels) + ' ' + str(cumulative))
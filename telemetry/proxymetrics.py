@@ -0,0 +1,22 @@
+'''
+AceProxy metrics updated by the request handlers and clients.
+Per channel and per client byte counts are kept by the broadcasters and
+handlers themselves and collected on scrape.
+'''
+
+from metrics import Counter, Histogram
+
+# Streaming clients (request handlers in proxyReadWrite), for scrape
+# time collection of their byte counters
+clients = set()
+
+bytes_out = Counter('aceproxy_client_bytes_out_finished_total',
+                    'Bytes sent to clients which are disconnected')
+hls_bytes_out = Counter('aceproxy_hls_bytes_out_total', 'HLS playlist and segment bytes sent')
+clients_total = Counter('aceproxy_clients_total', 'Streaming clients served')
+http_errors = Counter('aceproxy_http_errors_total', 'Error responses by reason', ('code', 'reason'))
+engine_transitions = Counter('aceproxy_engine_transitions_total',
+                             'Engine STATE and STATUS changes', ('kind', 'value'))
+first_byte = Histogram('aceproxy_time_to_first_byte_seconds',
+                       'Time from request to the first video byte sent')
+start_stages = Histogram('aceproxy_start_stage_seconds', 'Channel start stage durations', ('stage', ))
@@ -0,0 +1,110 @@
+'''
+Channel start tracing.
+Every channel request gets a trace with stage timings. AceClient and
+VlcClient add their stages to the trace of the current greenlet.
+Finished traces are kept in a bounded ring, stage durations are
+aggregated into percentiles.
+'''
+
+import itertools
+import os
+import time
+from collections import deque
+from gevent.local import local
+import streamer
+
+# Trace of the current request greenlet
+_current = local()
+
+
+class Trace(streamer.StageTimer):
+
+    _ids = itertools.count(1)
+
+    def __init__(self, path, client):
+        streamer.StageTimer.__init__(self)
+        # Unique in all workers
+        self.id = '%x-%x' % (os.getpid(), next(Trace._ids))
+        self.path = path
+        self.client = client
+        self.started = time.time()
+        # Nested stages, e.g. keygen inside engine authentication
+        self.substages = list()
+        self.result = None
+
+    def record(self, stage, duration):
+        self.substages.append((stage, duration))
+
+    def toDict(self):
+        return {'id': self.id, 'path': self.path, 'client': self.client, 'started': self.started,
+                'total': round(self.total(), 6), 'result': self.result,
+                'stages': [[stage, round(duration, 6)] for stage, duration in self.stages],
+                'substages': [[stage, round(duration, 6)] for stage, duration in self.substages]}
+
+
+class Tracer(object):
+
+    def __init__(self, size=200, samples=1000):
+        # Recent finished traces
+        self._traces = deque(maxlen=size)
+        # Stage -> recent durations
+        self._stages = dict()
+        self._samples = samples
+
+    def start(self, path, client):
+        trace = Trace(path, client)
+        _current.trace = trace
+        return trace
+
+    def finish(self, trace, result='ok'):
+        '''
+        Put trace to the ring, only once
+        '''
+        if trace.result is not None:
+            return
+        trace.result = result
+        self._traces.append(trace)
+        for stage, duration in trace.stages + trace.substages:
+            durations = self._stages.get(stage)
+            if durations is None:
+                durations = self._stages[stage] = deque(maxlen=self._samples)
+            durations.append(duration)
+
+    def recent(self, limit=50):
+        return [trace.toDict() for trace in reversed(list(self._traces)[-limit:])]
+
+    def slowest(self, limit=10):
+        return [trace.toDict() for trace in sorted(self._traces, key=lambda trace: trace.total(),
+                                                   reverse=True)[:limit]]
+
+    def percentiles(self):
+        result = dict()
+        for stage, durations in self._stages.iteritems():
+            durations = sorted(durations)
+            count = len(durations)
+            result[stage] = {'count': count, 'max': round(durations[-1], 6)}
+            for p in (50, 90, 99):
+                result[stage]['p' + str(p)] = round(durations[min(count * p / 100, count - 1)], 6)
+        return result
+
+
+tracer = Tracer()
+
+
+def current():
+    return getattr(_current, 'trace', None)
+
+
+def mark(stage):
+    '''
+    Mark stage of the current greenlet trace, if there is one
+    '''
+    trace = current()
+    if trace:
+        trace.mark(stage)
+
+
+def record(stage, duration):
+    trace = current()
+    if trace:
+        trace.record(stage, duration)
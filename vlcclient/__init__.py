@@ -1 +1,2 @@
 from vlcclient import *
+from vlcpool import *
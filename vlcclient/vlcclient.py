@@ -5,8 +5,11 @@ Minimal VLC VLM client for AceProxy. Client class.
 import gevent
 import gevent.event
 import gevent.coros
-import telnetlib
 import logging
+import collections
+import time
+import streamer
+import telemetry
 from vlcmessages import *
 
 
@@ -27,8 +30,6 @@ class VlcClient(object):
     def __init__(
         self, host='127.0.0.1', port=4212, password='admin', connect_timeout=5,
             result_timeout=5, out_port=8081, debug=logging.ERROR):
-        # Receive buffer
-        self._recvbuffer = None
         # Output port
         self._out_port = out_port
         # VLC socket
@@ -39,10 +40,10 @@ class VlcClient(object):
         self._shuttingDown = gevent.event.Event()
         # Authentication done event
         self._auth = gevent.event.AsyncResult()
-        # Request lock
-        self._resultlock = gevent.coros.RLock()
-        # Request result
-        self._result = gevent.event.AsyncResult()
+        # Write lock, keeps commands in the same order as pending results
+        self._writelock = gevent.coros.RLock()
+        # Pending commands: [response name, AsyncResult, timed out]
+        self._pending = collections.deque()
         # VLC version string
         self._vlcver = None
         # Saving password
@@ -53,7 +54,7 @@ class VlcClient(object):
 
         # Making connection
         try:
-            self._socket = telnetlib.Telnet(host, port, connect_timeout)
+            self._socket = streamer.LineReader(host, port, connect_timeout)
             logger.debug("Successfully connected with VLC socket!")
         except Exception as e:
             raise VlcException(
@@ -97,6 +98,12 @@ class VlcClient(object):
                 # Ignore exceptions on destroy
                 pass
 
+    def isAlive(self):
+        '''
+        Connection with VLC is alive
+        '''
+        return not self._shuttingDown.isSet()
+
     def _write(self, message):
         # Return if in the middle of destroying
         if self._shuttingDown.isSet():
@@ -108,59 +115,85 @@ class VlcClient(object):
         except EOFError as e:
             raise VlcException("Vlc Write error! ERROR: " + repr(e))
 
-    def _broadcast(self, brtype, stream_name, input=None, muxer='ts'):
-        # Start/stop broadcast with VLC
-        # Logger
-        if brtype == True:
-            broadcast = 'startBroadcast'
-        else:
-            broadcast = 'stopBroadcast'
-
-        logger = logging.getLogger("VlcClient_" + broadcast)
-        # Clear AsyncResult
-        self._result = gevent.event.AsyncResult()
-        # Get lock
-        self._resultlock.acquire()
-        # Write message to VLC socket
-        if brtype == True:
-            self._write(VlcMessage.request.startBroadcast(
-                stream_name, input, self._out_port, muxer))
-        else:
-            self._write(VlcMessage.request.stopBroadcast(stream_name))
+    def _commands(self, commands):
+        '''
+        Send VLM commands without waiting for the previous responses.
+        commands is a list of (message, response name) tuples.
+        Every command gets its own result, responses come in order.
+        '''
+        pending = list()
+        # Only writes are serialized, not the round trips
+        self._writelock.acquire()
+        try:
+            # Results are queued before writing, response may come
+            # while we're still writing
+            for message, response in commands:
+                pending.append([response, gevent.event.AsyncResult(), False])
+            self._pending.extend(pending)
+            self._write("\r\n".join(message for message, response in commands))
+        except:
+            for item in pending:
+                self._pending.remove(item)
+            raise
+        finally:
+            self._writelock.release()
 
         try:
-            gevent.sleep()
-            result = self._result.get(timeout=self._resulttimeout)
-            if result == False:
-                logger.error(broadcast + " error")
-                raise VlcException(broadcast + " error")
+            for response, result, abandoned in pending:
+                gevent.sleep()
+                if result.get(timeout=self._resulttimeout) == False:
+                    return False
         except gevent.Timeout:
-            logger.error(broadcast + " result timeout")
-            raise VlcException(broadcast + " result timeout")
-        finally:
-            self._resultlock.release()
+            # Results stay in the queue, so late responses don't shift the
+            # others. They are dropped when a newer command gets its response.
+            for item in pending:
+                item[2] = True
+            raise
+        return True
 
-        if brtype == True:
-            logger.debug("Broadcast started")
-        else:
-            logger.debug("Broadcast stopped")
+    def _command(self, name, commands):
+        logger = logging.getLogger("VlcClient_" + name)
+
+        start = time.time()
+        try:
+            if not self._commands(commands):
+                logger.error(name + " error")
+                raise VlcException(name + " error")
+        except gevent.Timeout:
+            logger.error(name + " result timeout")
+            raise VlcException(name + " result timeout")
+
+        logger.debug(name + " done")
+        telemetry.record('vlc_' + name, time.time() - start)
 
     def startBroadcast(self, stream_name, input, muxer='ts'):
-        return self._broadcast(True, stream_name, input, muxer)
+        return self._command('startBroadcast', (
+            (VlcMessage.request.startBroadcast(stream_name, input, self._out_port, muxer),
+             VlcMessage.response.STARTOK),
+            (VlcMessage.request.unPauseBroadcast(stream_name), VlcMessage.response.CONTROLOK)))
 
     def stopBroadcast(self, stream_name):
-        return self._broadcast(False, stream_name)
+        return self._command('stopBroadcast', (
+            (VlcMessage.request.stopBroadcast(stream_name), VlcMessage.response.STOPOK), ))
+
+    def controlBroadcast(self, stream_name, command):
+        return self._command('controlBroadcast', (
+            (VlcMessage.request.controlBroadcast(stream_name, command), VlcMessage.response.CONTROLOK), ))
+
+    def pauseBroadcast(self, stream_name):
+        return self.controlBroadcast(stream_name, 'pause')
+
+    def unPauseBroadcast(self, stream_name):
+        return self.controlBroadcast(stream_name, 'play')
 
     def _recvData(self):
         # Logger
         logger = logging.getLogger("VlcClient_recvData")
 
         while True:
-            gevent.sleep()
             try:
-                self._recvbuffer = self._socket.read_until("\n")
-                # Stripping "> " from VLC
-                self._recvbuffer = self._recvbuffer.lstrip("> ")
+                # Stripping "> " prompt from VLC
+                line = self._socket.readline().lstrip("> ").strip()
             except:
                 # If something happened during read, abandon reader
                 if not self._shuttingDown.isSet():
@@ -169,46 +202,70 @@ class VlcClient(object):
                 return
 
             # Parsing everything only if the string is not empty
-            if self._recvbuffer:
+            if line:
                 if not self._vlcver:
                     # First line (VLC version)
-                    self._vlcver = self._recvbuffer.strip()
+                    self._vlcver = line
                     # Send password here since PASSWORD doesn't have \n
                     self._write(self._password)
-
-                elif self._recvbuffer.startswith(VlcMessage.response.SHUTDOWN):
-                    # Exit from this loop
-                    logger.debug("Got SHUTDOWN from VLC")
-                    return
-
-                elif self._recvbuffer.startswith(VlcMessage.response.WRONGPASS):
-                    # Wrong password
-                    logger.error("Wrong VLC password!")
-                    self._auth.set(False)
-                    return
-
-                elif self._recvbuffer.startswith(VlcMessage.response.AUTHOK):
-                    # Authentication OK
-                    logger.info("Authentication successful")
-                    self._auth.set(True)
-
-                elif VlcMessage.response.BROADCASTEXISTS in self._recvbuffer:
-                    # Broadcast already exists
-                    logger.error("Broadcast already exists!")
-                    self._result.set(False)
-
-                elif VlcMessage.response.STOPERR in self._recvbuffer:
-                    # Media unknown (stopping non-existent stream)
-                    logger.error("Broadcast does not exist!")
-                    self._result.set(False)
-
-                # Do not move this before error handlers!
-                elif self._recvbuffer.startswith(VlcMessage.response.STARTOK):
-                    # Broadcast started
-                    logger.debug("Broadcast started")
-                    self._result.set(True)
-
-                elif self._recvbuffer.startswith(VlcMessage.response.STOPOK):
-                    # Broadcast stopped
-                    logger.debug("Broadcast stopped")
-                    self._result.set(True)
+                    continue
+
+                handler = VlcClient._handlers.get(line)
+                if handler:
+                    # Handler returns True when the reader should stop
+                    if handler(self):
+                        return
+                elif self._pending:
+                    self._onResponse(line)
+
+    def _onShutdown(self):
+        logging.getLogger("VlcClient_recvData").debug("Got SHUTDOWN from VLC")
+        return True
+
+    def _onWrongPass(self):
+        logging.getLogger("VlcClient_recvData").error("Wrong VLC password!")
+        self._auth.set(False)
+        return True
+
+    def _onAuthOk(self):
+        logging.getLogger("VlcClient_recvData").info("Authentication successful")
+        self._auth.set(True)
+
+    def _onResponse(self, line):
+        '''
+        VLM command response, matched to the oldest command
+        '''
+        logger = logging.getLogger("VlcClient_recvData")
+        for error in VlcMessage.response.ERRORS:
+            if error in line:
+                logger.error("VLM error: " + line)
+                # Errors have no command name, the oldest command which
+                # is still waiting gets it
+                while self._pending and self._pending[0][2]:
+                    logger.debug("Dropping timed out VLM command: " + self._pending.popleft()[0])
+                if self._pending:
+                    self._pending.popleft()[1].set(False)
+                return
+        # Do not check this before error handlers!
+        # Timed out commands may never get their responses, skip them
+        # if the response is for a newer command
+        skip = 0
+        for response, result, abandoned in self._pending:
+            if line.startswith(response):
+                break
+            if not abandoned:
+                # Unknown line, responses come in order
+                return
+            skip += 1
+        else:
+            return
+        for i in xrange(skip):
+            logger.debug("Dropping timed out VLM command: " + self._pending.popleft()[0])
+        response, result, abandoned = self._pending.popleft()
+        logger.debug("VLM response: " + response)
+        result.set(True)
+
+    # Handlers of the messages which are not command responses
+    _handlers = {VlcMessage.response.SHUTDOWN: _onShutdown,
+                 VlcMessage.response.WRONGPASS: _onWrongPass,
+                 VlcMessage.response.AUTHOK: _onAuthOk}
@@ -11,20 +11,23 @@ class VlcMessage(object):
         @staticmethod
         def startBroadcast(stream_name, input, out_port, muxer='ts'):
             return 'new "' + stream_name + '" broadcast input "' + input + '" output #http{mux=' + muxer + ',dst=:' + \
-                str(out_port) + '/' + stream_name + '} enabled' + \
-                "\r\n" + 'control "' + stream_name + '" play'
+                str(out_port) + '/' + stream_name + '} enabled'
 
         @staticmethod
         def stopBroadcast(stream_name):
             return 'del "' + stream_name + '"'
 
+        @staticmethod
+        def controlBroadcast(stream_name, command):
+            return 'control "' + stream_name + '" ' + command
+
         @staticmethod
         def pauseBroadcast(stream_name):
-            return 'control "' + stream_name + '" pause'
+            return VlcMessage.request.controlBroadcast(stream_name, 'pause')
 
         @staticmethod
         def unPauseBroadcast(stream_name):
-            return 'control "' + stream_name + '" play'
+            return VlcMessage.request.controlBroadcast(stream_name, 'play')
 
     class response(object):
         WRONGPASS = 'Wrong password'
@@ -33,5 +36,8 @@ class VlcMessage(object):
         SYNTAXERR = 'Wrong command syntax'
         STARTOK = 'new'
         STOPOK = 'del'
+        CONTROLOK = 'control'
         STOPERR = 'media unknown'
         SHUTDOWN = 'Bye-bye!'
+        # Errors in VLM command responses
+        ERRORS = (BROADCASTEXISTS, SYNTAXERR, STOPERR)
@@ -0,0 +1,199 @@
+'''
+Pool of VLC instances for AceProxy.
+Spreads broadcasts over several VLC processes (and CPU cores).
+'''
+
+import bisect
+import gevent
+import hashlib
+import logging
+from vlcclient import VlcClient, VlcException
+
+
+class VlcInstance(object):
+
+    '''
+    One VLC process of the pool
+    '''
+
+    def __init__(self, host, port, out_port):
+        self.host = host
+        self.port = port
+        self.out_port = out_port
+        # VlcClient, None if not connected
+        self.client = None
+        # Names of the broadcasts running on this instance
+        self.broadcasts = set()
+        # Counters
+        self.started = 0
+        self.failures = 0
+
+    def isAlive(self):
+        return self.client is not None and self.client.isAlive()
+
+    def name(self):
+        return self.host + ':' + str(self.port)
+
+
+class VlcPool(object):
+
+    '''
+    VLC pool class.
+    Broadcasts are assigned to instances by consistent hashing of the
+    broadcast name ('hash') or to the least loaded instance ('load').
+    '''
+
+    def __init__(self, instances, password='admin', balance='hash', replicas=64,
+                 connect_timeout=5, result_timeout=5, retry_interval=30, debug=logging.ERROR):
+        self._password = password
+        self._balance = balance
+        self._connecttimeout = connect_timeout
+        self._resulttimeout = result_timeout
+        self._retryinterval = retry_interval
+        self._debug = debug
+        # List of VlcInstance
+        self.instances = [VlcInstance(host, port, out_port) for host, port, out_port in instances]
+        # Broadcast name -> VlcInstance
+        self._assigned = dict()
+        # Consistent hashing ring: sorted hashes and instances
+        self._ringhashes = list()
+        self._ringinstances = list()
+        ring = sorted((self._hash(instance.name() + '#' + str(i)), instance)
+                      for instance in self.instances for i in xrange(replicas))
+        for ringhash, instance in ring:
+            self._ringhashes.append(ringhash)
+            self._ringinstances.append(instance)
+
+        for instance in self.instances:
+            self._connect(instance)
+        if not any(instance.isAlive() for instance in self.instances):
+            raise VlcException("Can't connect to any VLC instance")
+
+        self._checkergreenlet = gevent.spawn(self._checker)
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+    def _connect(self, instance):
+        logger = logging.getLogger('VlcPool_connect')
+
+        try:
+            instance.client = VlcClient(
+                host=instance.host, port=instance.port, password=self._password,
+                connect_timeout=self._connecttimeout, result_timeout=self._resulttimeout,
+                out_port=instance.out_port, debug=self._debug)
+            logger.info("Connected to VLC " + instance.name())
+        except VlcException as e:
+            instance.client = None
+            logger.error("Can't connect to VLC " + instance.name() + ": " + repr(e))
+
+    def _choose(self, stream_name):
+        '''
+        Choose alive instance for the new broadcast
+        '''
+        alive = [instance for instance in self.instances if instance.isAlive()]
+        if not alive:
+            raise VlcException("No alive VLC instances")
+
+        if self._balance == 'load':
+            return min(alive, key=lambda instance: len(instance.broadcasts))
+
+        # Walking the ring from the stream name hash, skipping dead instances
+        start = bisect.bisect(self._ringhashes, self._hash(stream_name))
+        for i in xrange(len(self._ringinstances)):
+            instance = self._ringinstances[(start + i) % len(self._ringinstances)]
+            if instance.isAlive():
+                return instance
+
+    def getInstance(self, stream_name):
+        '''
+        Get instance of the running broadcast (or None)
+        '''
+        return self._assigned.get(stream_name)
+
+    def outputUrl(self, stream_name):
+        instance = self._assigned.get(stream_name)
+        if not instance:
+            raise VlcException("Broadcast " + stream_name + " is not running")
+        return 'http://' + instance.host + ':' + str(instance.out_port) + '/' + stream_name
+
+    def startBroadcast(self, stream_name, input, muxer='ts'):
+        '''
+        Start broadcast on one of the instances. If the instance fails,
+        the next one is used.
+        '''
+        logger = logging.getLogger('VlcPool_startBroadcast')
+
+        while True:
+            instance = self._choose(stream_name)
+            try:
+                instance.client.startBroadcast(stream_name, input, muxer)
+            except VlcException as e:
+                instance.failures += 1
+                if instance.isAlive():
+                    raise
+                logger.error("VLC " + instance.name() + " failed: " + repr(e))
+                self._markDead(instance)
+                continue
+
+            instance.broadcasts.add(stream_name)
+            instance.started += 1
+            self._assigned[stream_name] = instance
+            logger.debug(stream_name + " started on VLC " + instance.name())
+            return instance
+
+    def stopBroadcast(self, stream_name):
+        instance = self._assigned.pop(stream_name, None)
+        if not instance:
+            raise VlcException("Broadcast " + stream_name + " is not running")
+        instance.broadcasts.discard(stream_name)
+        if instance.isAlive():
+            instance.client.stopBroadcast(stream_name)
+
+    def pauseBroadcast(self, stream_name):
+        return self._client(stream_name).pauseBroadcast(stream_name)
+
+    def unPauseBroadcast(self, stream_name):
+        return self._client(stream_name).unPauseBroadcast(stream_name)
+
+    def _client(self, stream_name):
+        instance = self._assigned.get(stream_name)
+        if not instance or not instance.isAlive():
+            raise VlcException("Broadcast " + stream_name + " is not running")
+        return instance.client
+
+    def _markDead(self, instance):
+        # Broadcasts of the dead instance are gone
+        for stream_name in instance.broadcasts:
+            self._assigned.pop(stream_name, None)
+        instance.broadcasts.clear()
+        if instance.client:
+            instance.client.destroy()
+            instance.client = None
+
+    def stats(self):
+        '''
+        Per-instance load statistics
+        '''
+        return [{'instance': instance.name(), 'out_port': instance.out_port,
+                 'alive': instance.isAlive(), 'broadcasts': len(instance.broadcasts),
+                 'started': instance.started, 'failures': instance.failures}
+                for instance in self.instances]
+
+    def destroy(self):
+        self._checkergreenlet.kill(block=False)
+        for instance in self.instances:
+            if instance.client:
+                instance.client.destroy()
+
+    def _checker(self):
+        '''
+        Reconnect dead instances
+        '''
+        while True:
+            gevent.sleep(self._retryinterval)
+            for instance in self.instances:
+                if not instance.isAlive():
+                    self._markDead(instance)
+                    self._connect(instance)